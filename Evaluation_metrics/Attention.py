@@ -1,8 +1,11 @@
-import spacy
+import os
 import logging
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer, CrossEncoder
 import math
+import numpy as np
+from Evaluation_metrics.model_registry import get_cross_encoder, get_nlp
+from Evaluation_metrics.embeddings import UtteranceEmbeddings
+from Evaluation_metrics.similarity import pairwise_similarity, window_pool
+from Evaluation_metrics.telemetry import inference
 
 logging.basicConfig(level=logging.DEBUG, format= (
     "%(asctime)s | %(levelname)s | "
@@ -12,15 +15,8 @@ logging.basicConfig(level=logging.DEBUG, format= (
                     
 logger=logging.getLogger(__name__)
 
-model=SentenceTransformer("all-MiniLM-L6-v2")
-
-#Cross Encode for Entailment Score
-encoder_model=CrossEncoder('cross-encoder/nli-deberta-v3-base')
-
-nlp=spacy.load("en_core_web_sm")
-
 def keyword_extractor(text :str):
-    doc=nlp(text.lower())
+    doc=get_nlp()(text.lower())
     keywords=set()
     try:
         for words in doc:
@@ -43,46 +39,133 @@ def keyword_score(customer_text, agent_text):
         matched_score = len(matched_words) / len(customer_keywords)
     return matched_score
 
-def Paraphrasing_check(customer_text, agent_text):
+#NLI label order of cross-encoder/nli-deberta-v3-base, used when the model config has none
+NLI_LABELS=['contradiction', 'entailment', 'neutral']
+#customer turns before an agent reply forming the premise of its pair
+NLI_CONTEXT_TURNS=int(os.getenv('NLI_CONTEXT_TURNS', '2'))
+#cap on the (customer turns, agent reply) pairs scored per call, keeps the CPU cost bounded
+NLI_MAX_PAIRS=int(os.getenv('NLI_MAX_PAIRS', '32'))
+NLI_BATCH_SIZE=int(os.getenv('NLI_BATCH_SIZE', '16'))
+
+
+def paraphrase_pairs(customer_list:list, agent_list:list, context_turns:int=NLI_CONTEXT_TURNS) -> list[tuple]:
+    '''
+    Aligns every agent reply with the customer turns said since the previous agent reply
+    (the last context_turns of them), agent lines that do not follow a customer turn are skipped
+
+    RETURN : list of (agent reply, customer turns) text pairs, in the order of the call
+    '''
+    turns=sorted(
+        [(u.get('start') or 0, 'customer', u.get('text') or '') for u in customer_list]+
+        [(u.get('start') or 0, 'agent', u.get('text') or '') for u in agent_list],
+        key=lambda t: t[0]
+    )
+    pairs=[]
+    pending=[]
+    for _, speaker, text in turns:
+        if speaker=='customer':
+            pending.append(text)
+        elif pending:
+            pairs.append((text, ' '.join(pending[-context_turns:])))
+            pending=[]
+    return pairs
+
+
+def _entailment_index(model) -> int:
+    id2label=getattr(getattr(model, 'config', None), 'id2label', None) or dict(enumerate(NLI_LABELS))
+    for index, label in id2label.items():
+        if str(label).lower()=='entailment':
+            return int(index)
+    return NLI_LABELS.index('entailment')
+
+
+def Paraphrasing_check(customer_list:list, agent_list:list, max_pairs:int=None, batch_size:int=None) -> float:
+    '''
+    Entailment between every agent reply and the customer turns before it, instead of the
+    whole conversation in one pair (which is far past the 512 tokens of DeBERTa and gets
+    truncated). The pairs go through CrossEncoder.predict in batches, when a call has more
+    than max_pairs of them an evenly spaced subset covering the whole call is scored.
+
+    RETURN : mean entailment probability of the pairs in [0, 1], 0.0 without any pair
+    '''
+    max_pairs=NLI_MAX_PAIRS if max_pairs is None else max_pairs
+    batch_size=NLI_BATCH_SIZE if batch_size is None else batch_size
+    pairs=paraphrase_pairs(customer_list, agent_list)
+    if not pairs or max_pairs<=0:
+        return 0.0
+    if len(pairs)>max_pairs:
+        keep=np.linspace(0, len(pairs)-1, max_pairs).round().astype(int)
+        pairs=[pairs[i] for i in keep]
+
     try:
-        entailment_score=encoder_model(agent_text, customer_text)
+        #Cross Encode for Entailment Score, softmax over the NLI logits of each pair
+        model=get_cross_encoder()
+        with inference('cross_encoder', len(pairs)):
+            logits=np.asarray(model.predict(pairs, batch_size=batch_size, show_progress_bar=False), dtype=np.float32)
+        logits=logits.reshape(len(pairs), -1)
+        probabilities=np.exp(logits-logits.max(axis=1, keepdims=True))
+        probabilities/=probabilities.sum(axis=1, keepdims=True)
+        entailment_score=float(np.mean(probabilities[:, _entailment_index(model)]))
     except Exception:
         logger.exception("Paraphrasing failed")
         raise
     return entailment_score
 
 
-def similarity_score(customer_list:list, agent_list:list):
-    semantic_score_sum=0
-    entailment_score=[]
-    count=[]
-    n=0
-    for i, texts in enumerate(customer_list):
-        if i==0 or i==len(customer_list)-1:
-            continue
-        text1=customer_list[i-1].get('text')+customer_list[i].get('text')+customer_list[i+1].get('text')
-        text2=agent_list[i-1].get('text')+agent_list[i].get('text')+agent_list[i+1].get('text')
-        
-        embeddings1=model.encode(text1, normalize_embeddings=True)
-        embeddings2=model.encode(text2, normalize_embeddings=True)
-
-        score=cosine_similarity(embeddings1, embeddings2)[0][0]
-        count.append(score)
-
-# adding the weight value of the semantic score
-# more recent conversation will have more importance in overall conversation 
-# taking index of the semantic score in the list as the weight
-
-    weighted_sum=0
-    total_weight=0
-    for i, c in enumerate(count):
-        weighted_sum+=(i+1)*c 
-        total_weight+=(i+1)
-
-    if total_weight == 0:
+#utterances pooled together on each side by similarity_score
+SIMILARITY_WINDOW=3
+
+
+def reply_alignment(customer_list:list, agent_list:list) -> list[tuple]:
+    '''
+    Aligns every customer utterance with the agent reply that follows it (by start time),
+    customer utterances the agent never replied to are left out
+
+    RETURN : list of (customer index, agent index) in the order of the call
+    '''
+    turns=sorted(
+        [(u.get('start') or 0, 'customer', i) for i, u in enumerate(customer_list)]+
+        [(u.get('start') or 0, 'agent', i) for i, u in enumerate(agent_list)],
+        key=lambda t: t[0]
+    )
+    aligned=[]
+    pending=[]
+    for _, speaker, i in turns:
+        if speaker=='customer':
+            pending.append(i)
+        else:
+            aligned+=[(c, i) for c in pending]
+            pending=[]
+    return aligned
+
+
+def similarity_score(customer_list:list, agent_list:list, embeddings:UtteranceEmbeddings=None, window:int=SIMILARITY_WINDOW):
+    '''
+    Semantic similarity between what the customer says and the agent replies
+
+    Every customer utterance is aligned with the agent reply that follows it, the aligned
+    pairs are grouped in sliding windows of window pairs and each side of a window is the
+    mean of its utterance embeddings (running sums, every utterance is encoded only once,
+    by the shared call embeddings). Later windows weigh more.
+
+    RETURN : weighted cosine similarity of the windows normalized to [0, 1], 0.5 when the
+    call has less than window aligned pairs
+    '''
+    aligned=reply_alignment(customer_list, agent_list)
+
+    if len(aligned)<window:
         weight_semantic_score = 0.0
     else:
-        weight_semantic_score=weighted_sum/total_weight
+        if embeddings is None:
+            embeddings=UtteranceEmbeddings()
+        customer_vectors=embeddings.vectors([customer_list[c] for c, _ in aligned])
+        agent_vectors=embeddings.vectors([agent_list[a] for _, a in aligned])
+        count=pairwise_similarity(window_pool(customer_vectors, window), window_pool(agent_vectors, window))
+
+        # adding the weight value of the semantic score
+        # more recent conversation will have more importance in overall conversation 
+        # taking index of the semantic score in the list as the weight
+        weight_semantic_score=float(np.average(count, weights=np.arange(1, len(count)+1)))
     
     # Normalize cosine similarity from [-1, 1] to [0, 1] range
     # Using formula: (score + 1) / 2
@@ -1,10 +1,12 @@
+import os
 import requests
-import ast
-import json
 import numpy as np
 from pydantic import BaseModel, TypeAdapter, Field, ValidationError
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from Transcript_actions.llm_cache import default_llm_cache, llm_cache_key
+from Transcript_actions.ollama_client import shared_ollama_client
+from Transcript_actions.Speaker_classification import AGENT, CUSTOMER
 
 logging.basicConfig(level=logging.DEBUG, format=(
     "%(asctime)s | %(levelname)s | %(filename)s:%(lineno)d | %(funcName)s | %(message)s"
@@ -18,96 +20,135 @@ class Empathy_Metrics(BaseModel):
     final_empathy_score : float= Field(alias='final_empathy_score')
     Valid_Reason : str= Field(alias='Valid Reason')
 
-class LLM_response(BaseModel):
-    Customer_message : str=Field(alias='Customer message')
-    Agent_reponse : str=Field(alias='Agent response')
-    Empathy : Empathy_Metrics=Field(alias='Empathy')
+EMPATHY_MODEL='llama3'
+#bump whenever the prompt below changes, it is part of the LLM cache key
+EMPATHY_PROMPT_VERSION='empathy-pair-v1'
+#agent turns scored at the same time (keep it at or below OLLAMA_NUM_PARALLEL of the server)
+EMPATHY_CONCURRENCY=int(os.getenv('EMPATHY_CONCURRENCY', '4'))
+#earlier turns given to the LLM as context of each pair
+EMPATHY_CONTEXT_TURNS=2
 
-adapter=TypeAdapter(List[LLM_response])
+adapter=TypeAdapter(Empathy_Metrics)
 
-def empathy_check(dialogue_diarized_string):
 
-    prompt=f"""
+def turn_pairs(diarized_utterance_list:list[dict], context_turns:int=EMPATHY_CONTEXT_TURNS) -> list[dict]:
+    '''
+    Splits the call in (customer message, agent response) pairs, consecutive utterances of
+    the same speaker are merged in one turn
+
+    RETURN : list of {'customer': str, 'agent': str, 'context': str}
+    '''
+    turns=[]
+    for u in diarized_utterance_list:
+        text=str(u.get('text') or '').strip()
+        if not text:
+            continue
+        if turns and turns[-1][0]==u.get('speaker'):
+            turns[-1][1]+=' '+text
+        else:
+            turns.append([u.get('speaker'), text])
+
+    pairs=[]
+    for i in range(1, len(turns)):
+        if turns[i][0]==AGENT and turns[i-1][0]==CUSTOMER:
+            context=turns[max(0, i-1-context_turns):i-1]
+            pairs.append({
+                'customer': turns[i-1][1],
+                'agent': turns[i][1],
+                'context': '\n'.join(f'{speaker}: {text}' for speaker, text in context)
+            })
+    return pairs
+
+
+def _pair_prompt(pair:dict) -> str:
+    return f"""
 You are an impartial quality auditor evaluating empathy in a customer service call.
 
-You will receive a full transcript containing CUSTOMER and CUSTOMER SERVICE AGENT turns.
+You will receive one CUSTOMER message and the CUSTOMER SERVICE AGENT response to it,
+with a few earlier turns of the call as context.
 
 Instructions:
-1. Read the transcript turn-by-turn.
-2. For each AGENT response, evaluate empathy toward the previous CUSTOMER message.
-3. Empathy has three dimensions:
+1. Evaluate the empathy of the AGENT response toward the CUSTOMER message.
+2. Empathy has three dimensions:
    - Emotional Recognition
    - Emotional Validation
    - Supportive Intent
-4. Assign empathy score to all the individual agent response to the customer's message.
-5. Score EACH dimension between 0 and 1.
+3. Score EACH dimension between 0 and 1.
    - Assign 1 ONLY if supported by the agent's exact words.
    - If no evidence exists, score must be 0.
    - Politeness alone is NOT empathy.
-6. Calculate the final agent empathy score as the average across all agent turns.
-7. Provide valid reason/justification for assigning the score. 
-
-Return a list of all Agent responses to the customer messages as per the provided Transcript along with the
-Empathy JSON in the following format:
-
-[{'Customer message': str(),
-  'Agent response' : str(),
-  'Empathy':{
-    "emotion_recognition": 0-1,
-    "emotion_validation": 0-1,
-    "support_intent": 0-1,
-    "final_empathy_score": 0-1,
-    "Valid Reason": str()}
-},
-{ 'Customer message': str(),
-  'Agent response' : str(),
-  'Empathy':{
-    "emotion_recognition": 0-1,
-    "emotion_validation": 0-1,
-    "support_intent": 0-1,
-    "final_empathy_score": 0-1,
-    "Valid Reason": str()}
-}
-.....
-]
-
-Transcript:
-{dialogue_diarized_string}
+4. final_empathy_score is the average of the three dimensions.
+5. Provide valid reason/justification for assigning the score.
+
+Return only this JSON:
+{{"emotion_recognition": 0-1,
+  "emotion_validation": 0-1,
+  "support_intent": 0-1,
+  "final_empathy_score": 0-1,
+  "Valid Reason": "..."}}
+
+Context:
+{pair['context'] or '(start of the call)'}
+
+Customer message:
+{pair['customer']}
+
+Agent response:
+{pair['agent']}
 """
-    response=requests.post(
-        url='http://localhost:11434/api/generate',
-        json={
-            'model':'llama3',
-            'prompt': prompt,
-            'temperature': 0   
-        },
-        stream=True
-    )
-
-    # Here i have iterated over the line becasue llama APIs return the output in chunks 
-    output=''
-    for line in response.iter_lines():
-        if line:
-            data=json.loads(line)
-            output+=str(data['response'])      
-    output_list=ast.literal_eval(output)
-    
-    score=[]
-    try:
-        validate_output=adapter.validate_python(output_list)
-        for dictionary in validate_output:
-            Empathy=dictionary.get('Empathy')
-            Valid_reason=Empathy.get('Valid Reason')
-            if Valid_reason:
-                score.append(float(Empathy.get('final_empathy_score')))
-    
-    except ValidationError as e:
-        logger.error(f'Unexpected error {e} occurred')
-        raise
-    
-    score_value=np.mean(score)
-    return score_value
-
-        
 
 
+def score_pair(pair:dict, cache=None) -> Empathy_Metrics:
+    '''
+    Empathy of one agent response, cached per pair
+    '''
+    cache_key=llm_cache_key(EMPATHY_MODEL, EMPATHY_PROMPT_VERSION, f"{pair['context']}\0{pair['customer']}\0{pair['agent']}")
+    output=cache.get(cache_key) if cache is not None else None
+    from_cache=output is not None
+    if not from_cache:
+        output=shared_ollama_client().generate_json(_pair_prompt(pair), EMPATHY_MODEL)
+
+    result=adapter.validate_python(output)
+    # only cached once validated so a malformed answer is asked again next time
+    if cache is not None and not from_cache:
+        cache.put(cache_key, output)
+    return result
+
+
+def empathy_check(diarized_utterance_list:list[dict], concurrency:int=None):
+    '''
+    Scores every (customer message, agent response) pair with its own short LLM call,
+    at most `concurrency` calls at a time, so latency scales with the parallelism and not
+    with the length of the call and a turn the LLM gets wrong is dropped on its own.
+
+    RETURN : dictionary with the average emotion_recognition, emotion_validation,
+    support_intent and final_empathy_score over the agent responses
+    '''
+    pairs=turn_pairs(diarized_utterance_list)
+    if not pairs:
+        logger.warning('No customer message followed by an agent response, empathy is 0')
+        return _average_empathy([])
+
+    cache=default_llm_cache()
+    results=[]
+    with ThreadPoolExecutor(max_workers=concurrency or EMPATHY_CONCURRENCY, thread_name_prefix='empathy') as executor:
+        futures=[executor.submit(score_pair, pair, cache) for pair in pairs]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except (ValidationError, ValueError, RuntimeError, requests.RequestException) as e:
+                logger.warning(f'Skipping an agent turn the empathy check failed on : {e}')
+
+    if not results:
+        raise ValueError(f'The empathy check failed on all the {len(pairs)} agent turns')
+    return _average_empathy(results)
+
+
+def _average_empathy(validate_output:list) -> dict:
+    dimensions={'emotion_recognition': [], 'emotion_validation': [], 'support_intent': [], 'final_empathy_score': []}
+    for Empathy in validate_output:
+        if Empathy.Valid_Reason:
+            for name, values in dimensions.items():
+                values.append(float(getattr(Empathy, name)))
+
+    return {name: float(np.mean(values)) if values else 0.0 for name, values in dimensions.items()}
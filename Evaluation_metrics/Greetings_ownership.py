@@ -75,71 +75,45 @@ CANONICAL_OWNERSHIP = (
     CANONICAL_OWNERSHIP_SUPPORT
 )
 
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+from Evaluation_metrics.phrase_embeddings import phrase_embeddings
+from Evaluation_metrics.embeddings import UtteranceEmbeddings, embed_utterances
+from Evaluation_metrics.similarity import any_above, mean_similarity
 
-model= SentenceTransformer("all-MiniLM-L6-v2")
+#agent lines checked for a greeting and the similarity to a canonical greeting counted as one
+GREETING_LINES=3
+GREETING_THRESHOLD=0.65
 
-greetings_embeddings=model.encode(
-    sentences=CANONICAL_GREETINGS,
-    normalize_embeddings=True
-)
+def greetings_embeddings():
+    return phrase_embeddings(CANONICAL_GREETINGS)
 
 def check_greetings(
-    agent_list:list[dict])-> int:
-    final_value=0
-    for i, line in enumerate(agent_list):
-        if i<3: #checking if the agent greeted in the first 3 lines
-            sentence_embedding=model.encode(
-                sentences=line.get('text'),
-                normalize_embeddings=True
-            )
-            similarity_matrix=cosine_similarity(
-                [sentence_embedding], #(1,384)
-                greetings_embeddings  #(3,384)
-            ) 
-            similarity_matrix=similarity_matrix.flatten()
-            max_value=np.max(similarity_matrix)
-            if max_value>0.65:
-                final_value=1
-                break
-
-            #Let's say greeting_embeddings is for 3 sentences so the greeting embeddings will have the shape (3, 384)
-            #and the sentence embedding will have a shape (384,) so after [sentence_embedding] it will be (1, 384)\
-            # cosine similarity will be of shape (1, 3) eg. [0.45, 0.78, 0,12] 
-    
+    agent_list:list[dict], embeddings:UtteranceEmbeddings=None)-> int:
+    opening_lines=agent_list[:GREETING_LINES] #checking if the agent greeted in the first 3 lines
+    if not opening_lines:
+        return 0
+    if embeddings is None:
+        embeddings=embed_utterances(opening_lines)
+
+    #the first 3 agent lines (3, 384) against the 30 greetings (30, 384) in one matrix
+    #multiply, (3, 30) similarities, greeted when any of them is above the threshold
+    final_value=1 if any_above(embeddings.vectors(opening_lines), greetings_embeddings(), GREETING_THRESHOLD) else 0
+
     return final_value
 
-ownership_embeddings=model.encode(
-    sentences=CANONICAL_OWNERSHIP,
-    normalize_embeddings=True
-)
+def ownership_embeddings():
+    return phrase_embeddings(CANONICAL_OWNERSHIP)
 
-def check_ownership(agent_list:list[dict])-> float:
+def check_ownership(agent_list:list[dict], embeddings:UtteranceEmbeddings=None)-> float:
     if not agent_list:
         return 0.0
+    if embeddings is None:
+        embeddings = embed_utterances(agent_list)
+
+    # Get average similarity for each utterance
+    all_scores = mean_similarity(embeddings.vectors(agent_list), ownership_embeddings())
     
-    all_scores = []
-    
-    for line in agent_list:
-        sentence_embedding = model.encode(
-            sentences=line.get('text'),
-            normalize_embeddings=True
-        )
-        similarity_matrix = cosine_similarity(
-            [sentence_embedding],
-            ownership_embeddings
-        )
-        
-        # Get average similarity for this utterance
-        utterance_score = np.mean(similarity_matrix)
-        all_scores.append(utterance_score)
-    
-    if not all_scores:
-        return 0.0
-    
-    average_score = np.mean(all_scores)
+    average_score = float(np.mean(all_scores))
     
     # Normalize from [-1, 1] to [0, 1] and ensure bounds
     normalized_score = (average_score + 1) / 2
@@ -1,19 +1,22 @@
-def interuptions(corrected_utterances, tolerance):
-    customer_turns=0
-    interuption_count=0
+from Evaluation_metrics.intervals import utterance_arrays, interval_sweep
+from Transcript_actions.Speaker_classification import AGENT, CUSTOMER
 
-    interuption_time=[]
-    for u,i in enumerate(corrected_utterances):
-        if i+1>=len(corrected_utterances):
-            speaker_1=u.get('speaker')
-            speaker_2=corrected_utterances[i+1].get('speaker')
+def interuptions(corrected_utterances, tolerance=100):
+    '''
+    Share of the customer -> agent turns where the agent started more than tolerance ms
+    before the customer was done, and the start times of those interuptions
+    (see Evaluation_metrics.intervals)
+    '''
+    start, end, codes, labels=utterance_arrays(corrected_utterances)
+    if AGENT not in labels or CUSTOMER not in labels:
+        return 0.0, []
+    agent, customer=labels.index(AGENT), labels.index(CUSTOMER)
+    sweep=interval_sweep(start, end, codes, len(labels), tolerance=tolerance)
 
-            if speaker_1=='Customer' and speaker_2=='Customer Service Agent':
-                customer_turns+=1
-                if corrected_utterances[i].get('end') - 100 > corrected_utterances[i+1].get('start'):
-                    
-                    interuption_time.append(corrected_utterances[i+1].get('start'))
-                    
-                    interuption_count+=1
+    customer_turns=int(sweep['transitions'][customer, agent])
+    by_agent=sweep['interruption_index'][(codes[sweep['interruption_index']]==agent) & (sweep['interrupted']==customer)]
+    interuption_time=[int(t) for t in start[by_agent]]
     
-    return interuption_count/customer_turns, interuption_time
\ No newline at end of file
+    if customer_turns==0:
+        return 0.0, interuption_time
+    return int(sweep['interruptions'][agent, customer])/customer_turns, interuption_time
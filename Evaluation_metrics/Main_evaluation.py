@@ -5,8 +5,18 @@ from Evaluation_metrics.Greetings_ownership import check_greetings, check_owners
 from Evaluation_metrics.Interruption import interuptions
 from Evaluation_metrics.satisfaction import sentiment_trajectory, explicit_check, implicit_check
 from Evaluation_metrics.Talk_to_listen import talk_to_listen
+from Evaluation_metrics.embeddings import embed_utterances
 
-def Normalize_attention(customer_utterance_string, agent_utterance_string, customer_utterance_list, agent_utterance_list):
+def Utterance_embeddings(diarized_utterance_list):
+    '''
+    Encode every utterance of the call once, in a single batch.
+
+    Args: diarized_utterance_list: List of all the utterance dictionaries of the call
+    Returns: UtteranceEmbeddings shared by all the semantic metrics below
+    '''
+    return embed_utterances(diarized_utterance_list)
+
+def Normalize_attention(customer_utterance_string, agent_utterance_string, customer_utterance_list, agent_utterance_list, embeddings=None):
     '''
     Calculate attention metrics between customer and agent utterances.
 
@@ -14,11 +24,12 @@ def Normalize_attention(customer_utterance_string, agent_utterance_string, custo
         agent_utterance_string: Combined string of all agent utterances
         customer_utterance_list: List of customer utterance dictionaries
         agent_utterance_list: List of agent utterance dictionaries
+        embeddings: UtteranceEmbeddings of the call (optional)
     Returns: Dictionary with matched_score, similarity_score, and overall_attention
     '''
     matched_score = keyword_score(customer_utterance_string, agent_utterance_string)
-    sim_score = similarity_score(customer_utterance_list, agent_utterance_list)
-    paraphrasing_score=Paraphrasing_check(customer_utterance_string, agent_utterance_string)
+    sim_score = similarity_score(customer_utterance_list, agent_utterance_list, embeddings=embeddings)
+    paraphrasing_score=Paraphrasing_check(customer_utterance_list, agent_utterance_list)
 
     overall_attn = overall_attention(sim_score, matched_score, paraphrasing_score)
 
@@ -32,15 +43,15 @@ def Normalize_attention(customer_utterance_string, agent_utterance_string, custo
 
 
 
-def Empathy(dialogue_diarized_string):
+def Empathy(diarized_utterance_list):
     '''
-    Calculate empathy score from dialogue.
+    Calculate empathy score from dialogue, one LLM call per (customer message, agent response) pair.
 
-    Args: dialogue_diarized_string: String with CUSTOMER and AGENT labels
+    Args: diarized_utterance_list: List of utterance dictionaries with Customer / Customer Service Agent speakers
 
     Returns: Final empathy score)
     '''
-    empathy_dict = empathy_check(dialogue_diarized_string=dialogue_diarized_string)
+    empathy_dict = empathy_check(diarized_utterance_list=diarized_utterance_list)
 
     emotion_recognition = float(empathy_dict.get('emotion_recognition', 0))
     emotion_validation = float(empathy_dict.get('emotion_validation', 0))
@@ -50,31 +61,34 @@ def Empathy(dialogue_diarized_string):
     return final_empathy_score/3
 
 
-def Greet_Ownership(agent_utterance_list):
+def Greet_Ownership(agent_utterance_list, embeddings=None):
     '''
     Calculate greeting and ownership scores.
     
     Args: agent_utterance_list: List of agent utterance dictionaries
+        embeddings: UtteranceEmbeddings of the call (optional)
     
     Returns: Tuple of (greet_score, ownership_score)
     '''
-    greet_score = check_greetings(agent_utterance_list)
-    ownership_score = check_ownership(agent_utterance_list)
+    greet_score = check_greetings(agent_utterance_list, embeddings=embeddings)
+    ownership_score = check_ownership(agent_utterance_list, embeddings=embeddings)
     return greet_score, ownership_score
 
 
-def Interuptions(corrected_utterances, tolerance):
+def Interuptions(corrected_utterances, tolerance=100):
     '''Interuption_score represents the number of time the speaker was interupted 
     and the interuption_time represenets hte time when the agent was interupted'''
     interuption_score, interuption_time=interuptions(corrected_utterances, tolerance)
+    return interuption_score, interuption_time
 
-def Satisfaction(customer_utterance_list, portion=0.3):
+def Satisfaction(customer_utterance_list, portion=0.3, embeddings=None):
     """
     Calculate customer satisfaction score and show the emotion trajectory
     
     Args:
         customer_utterance_list: List of customer utterance dictionaries
         portion: Portion of conversation to analyze (default 0.3 = last 30%)
+        embeddings: UtteranceEmbeddings of the call (optional)
     
     Returns:
         Final satisfaction score (0-1), Satisfaction trajecory of the customer
@@ -82,12 +96,15 @@ def Satisfaction(customer_utterance_list, portion=0.3):
 
     trajectory = sentiment_trajectory(customer_utterance_list)
 
-    explicit_score = explicit_check(customer_utterance_list, portion=portion)
-    implicit_score = implicit_check(customer_utterance_list, portion=portion)
+    explicit_score = explicit_check(customer_utterance_list, portion=portion, embeddings=embeddings)
+    implicit_score = implicit_check(customer_utterance_list, portion=portion, embeddings=embeddings)
     final_satisfaction_score = (explicit_score + implicit_score) / 2
 
     return final_satisfaction_score, trajectory
 
 
-# def Talk_to_listen_ratio(dialogue_string, dialogue_dict):
-   
\ No newline at end of file
+def Talk_to_listen_ratio(agent_utterance_list, customer_utterance_list):
+    '''
+    Customer talk time over agent talk time, see talk_to_listen for the healthy range
+    '''
+    return talk_to_listen(agent_utterance_list, customer_utterance_list)
@@ -0,0 +1,89 @@
+'''
+Per call embedding stage.
+
+All the utterances of a diarized transcript are encoded once, in a single batch,
+and every semantic metric reads its vectors from the shared matrix instead of
+calling model.encode() line by line. Rows are keyed by the utterance text so a
+line repeated in the call (eg. "okay") is only embedded once. One instance is shared by
+the metric stages running on different threads, adding rows is serialized by a lock.
+'''
+import threading
+import numpy as np
+from Evaluation_metrics.model_registry import get_sentence_model
+from Evaluation_metrics.telemetry import inference
+
+BATCH_SIZE=64
+
+
+def _text(utterance) -> str:
+    if isinstance(utterance, dict):
+        return str(utterance.get('text') or '').strip()
+    return str(utterance or '').strip()
+
+
+class UtteranceEmbeddings:
+    def __init__(self, texts:list[str]=(), model=None, batch_size:int=BATCH_SIZE):
+        '''
+        ARGS : texts to encode up front, the sentence model (shared one by default)
+        and the encoder batch size
+        '''
+        self.model=model if model is not None else get_sentence_model()
+        self.batch_size=batch_size
+        self.index={}
+        self.matrix=None
+        self._lock=threading.Lock()
+        self._add(texts)
+
+    def _add(self, texts):
+        with self._lock:
+            self._add_locked(texts)
+
+    def _add_locked(self, texts):
+        #dict keeps the first occurrence order and dedups in linear time
+        new_texts=list(dict.fromkeys(t for t in texts if t not in self.index))
+        if not new_texts:
+            return
+
+        with inference('sentence_embedding', len(new_texts)):
+            new_rows=self.model.encode(
+                sentences=new_texts,
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            )
+        new_rows=np.asarray(new_rows, dtype=np.float32).reshape(len(new_texts), -1)
+        offset=0 if self.matrix is None else len(self.matrix)
+        for i, t in enumerate(new_texts):
+            self.index[t]=offset+i
+        self.matrix=new_rows if self.matrix is None else np.vstack([self.matrix, new_rows])
+
+    def vectors(self, utterances:list) -> np.ndarray:
+        '''
+        Unit normalized embeddings for a list of utterance dicts (or plain strings),
+        shape (len(utterances), dim). Texts that were not part of the call are encoded
+        together in one extra batch and kept for later lookups.
+        '''
+        texts=[_text(u) for u in utterances]
+        with self._lock:
+            self._add_locked(texts)
+            if not texts:
+                dim=0 if self.matrix is None else self.matrix.shape[1]
+                return np.zeros((0, dim), dtype=np.float32)
+            return self.matrix[[self.index[t] for t in texts]]
+
+    def vector(self, utterance) -> np.ndarray:
+        return self.vectors([utterance])[0]
+
+    def __len__(self):
+        return len(self.index)
+
+
+def embed_utterances(utterance_list:list[dict], model=None) -> UtteranceEmbeddings:
+    '''
+    Encodes every utterance of the transcript in one batch
+
+    ARGS : list of utterance dictionaries with the 'text' key
+
+    RETURN : UtteranceEmbeddings shared by all the metrics of the call
+    '''
+    return UtteranceEmbeddings([_text(u) for u in utterance_list], model=model)
@@ -0,0 +1,160 @@
+'''
+Interval engine over the start/end times (ms) of the utterances of a call.
+
+The utterances are turned into NumPy arrays once and everything is computed with
+vectorized sweeps, for any number of speakers :
+
+- talk time per speaker
+- overlap : time during which two utterances or more are running
+- silence : time during which nobody talks, gaps of at least HOLD_GAP_MS are holds
+- turn transitions, interruptions and backchannels between every pair of speakers
+
+An utterance is compared with the one holding the floor, the utterance with the latest
+end so far, not only with the one right before it. An utterance of another speaker that
+ends before the floor holder does is a backchannel ("mm-hmm" said over a long turn) : it
+is neither a turn nor an interruption and the floor stays with the long turn. One that
+takes the floor is a turn, and an interruption when it starts more than tolerance ms
+before the end of the floor holder.
+'''
+import os
+import numpy as np
+
+#silences at least this long (ms) are counted as holds
+HOLD_GAP_MS=int(os.getenv('HOLD_GAP_MS', '10000'))
+
+
+def utterance_arrays(utterances:list[dict]):
+    '''
+    RETURN : (start, end, speaker code) arrays sorted by start and the speaker labels,
+    label of code i being labels[i]
+    '''
+    start=np.fromiter((u.get('start') or 0 for u in utterances), dtype=np.int64, count=len(utterances))
+    end=np.fromiter((u.get('end') or 0 for u in utterances), dtype=np.int64, count=len(utterances))
+    labels, codes=np.unique([str(u.get('speaker')) for u in utterances], return_inverse=True)
+    order=np.argsort(start, kind='stable')
+    return start[order], end[order], codes.reshape(-1)[order].astype(np.int64), [str(l) for l in labels]
+
+
+def talk_time(start:np.ndarray, end:np.ndarray, codes:np.ndarray, speakers:int) -> np.ndarray:
+    '''
+    RETURN : (speakers,) summed duration of the utterances of every speaker
+    '''
+    return np.bincount(codes, weights=end-start, minlength=speakers)
+
+
+def speaker_talk_time(utterances:list[dict]) -> dict:
+    '''
+    RETURN : speaker label -> summed duration (ms) of its utterances
+    '''
+    start, end, codes, labels=utterance_arrays(utterances)
+    return {label: float(t) for label, t in zip(labels, talk_time(start, end, codes, len(labels)))}
+
+
+def overlap_and_silence(start:np.ndarray, end:np.ndarray) -> tuple[float, float]:
+    '''
+    One sweep over the start (+1) and end (-1) events, ends first on equal times
+
+    RETURN : (time with two utterances or more running, time without any between the
+    first start and the last end)
+    '''
+    if not len(start):
+        return 0.0, 0.0
+    times=np.concatenate([start, end])
+    deltas=np.concatenate([np.ones(len(start), dtype=np.int64), -np.ones(len(end), dtype=np.int64)])
+    order=np.lexsort((deltas, times))
+    running=np.cumsum(deltas[order])[:-1]
+    durations=np.diff(times[order])
+    return float(durations[running>=2].sum()), float(durations[running==0].sum())
+
+
+def interval_sweep(start:np.ndarray, end:np.ndarray, codes:np.ndarray, speakers:int, tolerance:int=100, hold_gap_ms:int=HOLD_GAP_MS) -> dict:
+    '''
+    ARGS : arrays of utterance_arrays, number of speakers, overlap (ms) tolerated before a
+    reply counts as an interruption, shortest silence (ms) counted as a hold
+
+    RETURN : dictionary of arrays
+    talk_time_ms : (speakers,) see talk_time
+    overlap_ms, silence_ms : see overlap_and_silence
+    transitions : (speakers, speakers), [i, j] turns going from speaker i to speaker j
+    interruptions : (speakers, speakers), [i, j] times speaker i interrupted speaker j
+    backchannels : (speakers, speakers), [i, j] times speaker i spoke inside a turn of speaker j
+    interruption_index : positions (in the sorted arrays) of the interrupting utterances
+    interrupted : speaker code of the interrupted speaker of each of them
+    interruption_overlap_ms : time both spoke for each of them
+    hold_start, hold_ms : start and duration of every hold
+    '''
+    n=len(start)
+    result={
+        'talk_time_ms': talk_time(start, end, codes, speakers),
+        'transitions': np.zeros((speakers, speakers), dtype=np.int64),
+        'interruptions': np.zeros((speakers, speakers), dtype=np.int64),
+        'backchannels': np.zeros((speakers, speakers), dtype=np.int64),
+        'interruption_index': np.zeros(0, dtype=np.int64),
+        'interrupted': np.zeros(0, dtype=np.int64),
+        'interruption_overlap_ms': np.zeros(0, dtype=np.int64),
+        'hold_start': np.zeros(0, dtype=np.int64),
+        'hold_ms': np.zeros(0, dtype=np.int64)
+    }
+    result['overlap_ms'], result['silence_ms']=overlap_and_silence(start, end)
+    if n<2:
+        return result
+
+    #floor holder before every utterance : the one with the latest end so far
+    floor_end=np.maximum.accumulate(end)
+    holder=np.maximum.accumulate(np.where(end>=floor_end, np.arange(n), 0))
+    previous_end=floor_end[:-1]
+    previous_speaker=codes[holder[:-1]]
+    speaker=codes[1:]
+
+    other=previous_speaker!=speaker
+    backchannel=other & (end[1:]<previous_end)
+    result['backchannels']=np.bincount(
+        speaker[backchannel]*speakers+previous_speaker[backchannel], minlength=speakers*speakers
+    ).reshape(speakers, speakers)
+
+    switch=other & ~backchannel
+    result['transitions']=np.bincount(
+        previous_speaker[switch]*speakers+speaker[switch], minlength=speakers*speakers
+    ).reshape(speakers, speakers)
+
+    interrupt=switch & (previous_end-tolerance>start[1:])
+    result['interruptions']=np.bincount(
+        speaker[interrupt]*speakers+previous_speaker[interrupt], minlength=speakers*speakers
+    ).reshape(speakers, speakers)
+    result['interruption_index']=np.flatnonzero(interrupt)+1
+    result['interrupted']=previous_speaker[interrupt]
+    result['interruption_overlap_ms']=(np.minimum(previous_end, end[1:])-start[1:])[interrupt]
+
+    gaps=start[1:]-previous_end
+    hold=gaps>=hold_gap_ms
+    result['hold_start']=previous_end[hold]
+    result['hold_ms']=gaps[hold]
+    return result
+
+
+def interval_stats(utterances:list[dict], tolerance:int=100, hold_gap_ms:int=HOLD_GAP_MS) -> dict:
+    '''
+    interval_sweep of a list of utterance dictionaries {speaker, start, end}, keyed by the
+    speaker labels and made of plain numbers so it can be serialized as is
+    '''
+    start, end, codes, labels=utterance_arrays(utterances)
+    sweep=interval_sweep(start, end, codes, len(labels), tolerance=tolerance, hold_gap_ms=hold_gap_ms)
+
+    def by_pair(matrix):
+        return {labels[i]: {labels[j]: int(matrix[i, j]) for j in range(len(labels)) if j!=i} for i in range(len(labels))}
+
+    index=sweep['interruption_index']
+    return {
+        'speakers': labels,
+        'talk_time_ms': {label: float(t) for label, t in zip(labels, sweep['talk_time_ms'])},
+        'overlap_ms': sweep['overlap_ms'],
+        'silence_ms': sweep['silence_ms'],
+        'holds': [{'start': int(s), 'duration_ms': int(d)} for s, d in zip(sweep['hold_start'], sweep['hold_ms'])],
+        'transitions': by_pair(sweep['transitions']),
+        'interruptions': by_pair(sweep['interruptions']),
+        'backchannels': by_pair(sweep['backchannels']),
+        'interruption_events': [
+            {'time': int(start[i]), 'by': labels[codes[i]], 'of': labels[j], 'overlap_ms': int(o)}
+            for i, j, o in zip(index, sweep['interrupted'], sweep['interruption_overlap_ms'])
+        ]
+    }
@@ -0,0 +1,171 @@
+'''
+Incremental scoring of a call while it is happening.
+
+The utterances are fed one at a time, in the order they are said, and LiveScorer keeps
+running state for each metric instead of rescoring the transcript :
+
+- talk to listen : agent and customer talk time accumulators (talk_to_listen)
+- interuptions : customer -> agent turns and overlapping ones, against the utterance
+  holding the floor as in Evaluation_metrics.intervals (interuptions)
+- sentiment trajectory : one point per customer utterance (sentiment_trajectory)
+- greeting : the first GREETING_LINES agent lines against the canonical greetings (check_greetings)
+- attention similarity : customer utterances wait for the agent reply that follows them,
+  the aligned pairs go through the sliding windows of similarity_score with running sums
+
+Every utterance is encoded once (customer ones together with the agent reply they are
+aligned with) and the update is O(window), the scores match the ones of the batch
+pipeline on the same utterances.
+'''
+from collections import deque
+import numpy as np
+from Evaluation_metrics.model_registry import get_sentence_model
+from Evaluation_metrics.telemetry import inference
+from Evaluation_metrics.similarity import any_above
+from Evaluation_metrics.Attention import SIMILARITY_WINDOW
+from Evaluation_metrics.Greetings_ownership import greetings_embeddings, GREETING_LINES, GREETING_THRESHOLD
+from Evaluation_metrics.satisfaction import sentiment_score
+from Transcript_actions.Speaker_classification import AGENT, CUSTOMER
+
+
+class LiveScorer:
+    def __init__(self, tolerance:int=100, model=None, window:int=SIMILARITY_WINDOW):
+        '''
+        ARGS : overlap (ms) tolerated before an agent reply counts as an interuption (see
+        Interuptions), the sentence model (shared one by default), pairs per similarity window
+        '''
+        self.tolerance=tolerance
+        self.window=window
+        self.model=model if model is not None else get_sentence_model()
+        self.utterances=0
+        #end and speaker of the utterance with the latest end so far
+        self.floor_end=None
+        self.floor_speaker=None
+
+        self.agent_time=0
+        self.customer_time=0
+
+        self.customer_turns=0
+        self.interuption_count=0
+        self.interuption_time=[]
+
+        self.trajectory={'time_ms': [], 'sentiment': []}
+
+        self.agent_lines=0
+        self.greeted=0
+
+        #customer texts waiting for the agent reply, last window aligned pairs and their sums
+        self.pending=[]
+        self.customer_window=deque()
+        self.agent_window=deque()
+        self.customer_sum=None
+        self.agent_sum=None
+        self.windows=0
+        self.weighted_similarity=0.0
+        self.weight_total=0
+
+    def _encode(self, texts:list[str]) -> np.ndarray:
+        with inference('sentence_embedding', len(texts)):
+            vectors=self.model.encode(sentences=texts, normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    def _push_pair(self, customer_vector:np.ndarray, agent_vector:np.ndarray):
+        '''
+        Slides the window by one aligned pair, scores the window once it is full
+        '''
+        if self.customer_sum is None:
+            self.customer_sum=np.zeros(len(customer_vector))
+            self.agent_sum=np.zeros(len(agent_vector))
+        self.customer_window.append(customer_vector)
+        self.agent_window.append(agent_vector)
+        self.customer_sum+=customer_vector
+        self.agent_sum+=agent_vector
+        if len(self.customer_window)>self.window:
+            self.customer_sum-=self.customer_window.popleft()
+            self.agent_sum-=self.agent_window.popleft()
+        if len(self.customer_window)<self.window:
+            return
+        norms=max(np.linalg.norm(self.customer_sum), 1e-12)*max(np.linalg.norm(self.agent_sum), 1e-12)
+        similarity=float(self.customer_sum@self.agent_sum/norms)
+        #the weight of a window is its index, as in similarity_score
+        self.windows+=1
+        self.weighted_similarity+=self.windows*similarity
+        self.weight_total+=self.windows
+
+    def add(self, utterance:dict) -> dict:
+        '''
+        ARGS : utterance dictionary {speaker, text, start, end}, speaker being
+        'Customer Service Agent' or 'Customer' (as after corrected_list)
+
+        RETURN : the scores after this utterance (see scores), with the new trajectory
+        point for a customer utterance
+        '''
+        speaker=utterance.get('speaker')
+        if speaker not in (AGENT, CUSTOMER):
+            raise ValueError(f'Unknown speaker {speaker}, expected {AGENT!r} or {CUSTOMER!r}')
+        text=utterance.get('text') or ''
+        start, end=utterance.get('start'), utterance.get('end')
+        self.utterances+=1
+
+        if speaker==AGENT:
+            self.agent_time+=end-start
+        else:
+            self.customer_time+=end-start
+
+        #an agent line ending inside the customer turn is a backchannel, not a turn
+        if self.floor_speaker==CUSTOMER and speaker==AGENT and end>=self.floor_end:
+            self.customer_turns+=1
+            if self.floor_end-self.tolerance>start:
+                self.interuption_time.append(start)
+                self.interuption_count+=1
+        if self.floor_end is None or end>=self.floor_end:
+            self.floor_end, self.floor_speaker=end, speaker
+
+        point=None
+        if speaker==CUSTOMER:
+            point={'time_ms': (start+end)/2, 'sentiment': round(sentiment_score(text), 4)}
+            self.trajectory['time_ms'].append(point['time_ms'])
+            self.trajectory['sentiment'].append(point['sentiment'])
+            self.pending.append(text.strip())
+        else:
+            #the agent line and the customer utterances it replies to go through the model in one batch
+            vectors=self._encode([text.strip()]+self.pending)
+            if not self.greeted and self.agent_lines<GREETING_LINES:
+                self.greeted=1 if any_above(vectors[:1], greetings_embeddings(), GREETING_THRESHOLD) else 0
+            self.agent_lines+=1
+            for customer_vector in vectors[1:]:
+                self._push_pair(customer_vector, vectors[0])
+            self.pending=[]
+
+        scores=self.scores()
+        if point is not None:
+            scores['sentiment_point']=point
+        return scores
+
+    def similarity(self) -> float:
+        '''
+        similarity_score of the utterances received so far, normalized to [0, 1]
+        '''
+        weighted=self.weighted_similarity/self.weight_total if self.weight_total else 0.0
+        return round((weighted+1)/2, 2)
+
+    def scores(self) -> dict:
+        return {
+            'utterances': self.utterances,
+            'talk_to_listen': round(self.customer_time/self.agent_time, 2) if self.agent_time else 0.0,
+            'agent_talk_ms': self.agent_time,
+            'customer_talk_ms': self.customer_time,
+            'interuption_score': self.interuption_count/self.customer_turns if self.customer_turns else 0.0,
+            'interuptions': self.interuption_count,
+            'greet_score': self.greeted,
+            'similarity_score': self.similarity()
+        }
+
+    def summary(self) -> dict:
+        '''
+        Scores with the whole sentiment trajectory and the interuption times
+        '''
+        return {
+            **self.scores(),
+            'sentiment_trajectory': self.trajectory,
+            'interuption_times': self.interuption_time
+        }
@@ -0,0 +1,242 @@
+'''
+Process wide registry for the heavy NLP models used by the metrics.
+
+Every model is loaded at most once per process, either the first time a metric
+asks for it or up front through warm_up(). The load time and the growth of the
+resident memory of the process while loading are recorded for each model so
+that the pods can be sized from model_stats().
+
+The sentence model and the cross-encoder run on the backend chosen by INFERENCE_BACKEND :
+- torch (default) : the PyTorch models as published
+- torch-int8 : the same models with their Linear layers dynamically quantized to int8
+- onnx : the models exported to ONNX and run by onnxruntime
+- onnx-int8 : the ONNX export dynamically quantized to int8 (ONNX_QUANTIZATION, default
+  avx2, sets the instruction set it is tuned for), the quantized files are written once
+  to ONNX_MODEL_DIR (default cache/onnx)
+The ONNX backends need the extras of requirements-onnx.txt (sentence-transformers 4.1 or
+newer with onnxruntime and optimum), choosing one without them fails right away.
+The backend is part of the registry key, so several backends can live side by side in one
+process (see api.compare_backends).
+'''
+import os
+import time
+import threading
+import logging
+import importlib.util
+from importlib import metadata
+from functools import partial, lru_cache
+
+logging.basicConfig(level=logging.DEBUG, format=(
+    "%(asctime)s | %(levelname)s | %(filename)s:%(lineno)d | %(funcName)s | %(message)s"
+))
+logger=logging.getLogger(__name__)
+
+SENTENCE_MODEL_NAME="all-MiniLM-L6-v2"
+CROSS_ENCODER_NAME="cross-encoder/nli-deberta-v3-base"
+SPACY_MODEL_NAME="en_core_web_sm"
+
+BACKENDS=('torch', 'torch-int8', 'onnx', 'onnx-int8')
+ONNX_QUANTIZATION=os.getenv('ONNX_QUANTIZATION', 'avx2')
+ONNX_MODEL_DIR=os.getenv('ONNX_MODEL_DIR', os.path.join('cache', 'onnx'))
+#first sentence-transformers release with the ONNX backend of CrossEncoder
+ONNX_MIN_SENTENCE_TRANSFORMERS=(4, 1)
+
+_backend_override=None
+_models={}
+_stats={}
+_lock=threading.Lock()
+
+
+def _rss_bytes() -> int:
+    '''
+    Current resident set size of the process in bytes (0 when it can not be read)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages=int(f.read().split()[1])
+        return resident_pages*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            # ru_maxrss is the peak in KiB on linux, it is the best we can do elsewhere
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+        except ImportError:
+            return 0
+
+
+@lru_cache(maxsize=None)
+def check_backend(backend:str) -> str:
+    '''
+    Raises ValueError for an unknown backend and RuntimeError when the packages it needs
+    are not installed, checked once per backend and without importing them
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown inference backend {backend}, expected one of {BACKENDS}')
+    if not backend.startswith('onnx'):
+        return backend
+    missing=[m for m in ('onnxruntime', 'optimum') if importlib.util.find_spec(m) is None]
+    try:
+        version=metadata.version('sentence-transformers')
+        release=tuple(int(p) for p in version.split('.')[:2])
+    except (metadata.PackageNotFoundError, ValueError):
+        version, release=None, (0, 0)
+    if release<ONNX_MIN_SENTENCE_TRANSFORMERS:
+        missing.append(f"sentence-transformers>={'.'.join(map(str, ONNX_MIN_SENTENCE_TRANSFORMERS))} (installed : {version})")
+    if missing:
+        raise RuntimeError(
+            f"The {backend} inference backend needs {', '.join(missing)}, install them with "
+            f"pip install -r requirements-onnx.txt"
+        )
+    return backend
+
+
+def current_backend() -> str:
+    '''
+    Backend of the sentence model and the cross-encoder : set_backend() or INFERENCE_BACKEND
+    '''
+    return check_backend(_backend_override or os.getenv('INFERENCE_BACKEND', 'torch'))
+
+
+def set_backend(backend:str=None):
+    '''
+    Overrides INFERENCE_BACKEND for this process, None goes back to the environment
+    '''
+    global _backend_override
+    if backend is not None:
+        check_backend(backend)
+    _backend_override=backend
+
+
+def _quantize_torch(model):
+    import torch
+    #CrossEncoder wraps the transformers model in .model in older sentence-transformers
+    module=model if isinstance(model, torch.nn.Module) else model.model
+    torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def _load_onnx_int8(cls, name):
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    directory=os.path.join(ONNX_MODEL_DIR, name.replace('/', '--'))
+    file_name=f'model_qint8_{ONNX_QUANTIZATION}.onnx'
+    if not os.path.exists(os.path.join(directory, 'onnx', file_name)):
+        logger.info(f"Exporting {name} to a {ONNX_QUANTIZATION} int8 ONNX model in {directory}")
+        model=cls(name, backend='onnx')
+        model.save(directory)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, directory)
+    return cls(directory, backend='onnx', model_kwargs={'file_name': f'onnx/{file_name}'})
+
+
+def _load_transformer(cls, backend, name):
+    if backend=='onnx':
+        return cls(name, backend='onnx')
+    if backend=='onnx-int8':
+        return _load_onnx_int8(cls, name)
+    model=cls(name)
+    if backend=='torch-int8':
+        model=_quantize_torch(model)
+    return model
+
+
+def _load_sentence_model(backend, name):
+    from sentence_transformers import SentenceTransformer
+    return _load_transformer(SentenceTransformer, backend, name)
+
+
+def _load_cross_encoder(backend, name):
+    from sentence_transformers import CrossEncoder
+    return _load_transformer(CrossEncoder, backend, name)
+
+
+def _load_spacy(name):
+    import spacy
+    return spacy.load(name)
+
+
+def _get(kind:str, name:str, loader, backend:str=None):
+    '''
+    Returns the cached model for (kind, name, backend), loading it with loader(name) on first use.
+    The lock is held during loading so concurrent first calls do not load twice.
+    '''
+    key=(kind, name, backend)
+    model=_models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        model=_models.get(key)
+        if model is not None:
+            return model
+
+        rss_before=_rss_bytes()
+        start=time.perf_counter()
+        try:
+            model=loader(name)
+        except Exception:
+            logger.exception(f"Loading {kind} model {name} ({backend}) failed")
+            raise
+        load_seconds=time.perf_counter()-start
+        rss_delta=max(0, _rss_bytes()-rss_before)
+
+        _models[key]=model
+        _stats[key]={
+            'kind': kind,
+            'name': name,
+            'backend': backend,
+            'load_seconds': round(load_seconds, 3),
+            'rss_bytes': rss_delta
+        }
+        logger.info(f"Loaded {kind} model {name} ({backend}) in {load_seconds:.2f}s (+{rss_delta/2**20:.1f} MiB RSS)")
+    return model
+
+
+def get_sentence_model(name:str=SENTENCE_MODEL_NAME, backend:str=None):
+    '''
+    Shared SentenceTransformer used for all the embedding based metrics
+    '''
+    backend=backend or current_backend()
+    return _get('sentence_transformer', name, partial(_load_sentence_model, backend), backend)
+
+
+def get_cross_encoder(name:str=CROSS_ENCODER_NAME, backend:str=None):
+    '''
+    Shared CrossEncoder used for the entailment (paraphrasing) score
+    '''
+    backend=backend or current_backend()
+    return _get('cross_encoder', name, partial(_load_cross_encoder, backend), backend)
+
+
+def get_nlp(name:str=SPACY_MODEL_NAME):
+    '''
+    Shared spaCy pipeline used for keyword extraction
+    '''
+    return _get('spacy', name, _load_spacy)
+
+
+def warm_up():
+    '''
+    Loads every model up front, meant to be called once when a worker process starts
+    so that the first request does not pay for the model loading.
+
+    RETURN : model_stats() after loading
+    '''
+    get_sentence_model()
+    get_cross_encoder()
+    get_nlp()
+    return model_stats()
+
+
+def is_loaded(kind:str, name:str, backend:str=None) -> bool:
+    if kind=='spacy':
+        return (kind, name, None) in _models
+    return (kind, name, backend or current_backend()) in _models
+
+
+def model_stats() -> list[dict]:
+    '''
+    Load time (seconds) and resident memory growth (bytes) of each model loaded so far.
+    The memory figure is the RSS growth of the process while the model was loading,
+    so it is an estimate that also includes the libraries imported for the first model.
+    '''
+    with _lock:
+        return [dict(s) for s in _stats.values()]
@@ -0,0 +1,116 @@
+'''
+On-disk artifacts of the canonical phrase embeddings.
+
+The phrase sets (greetings, ownership, satisfaction patterns, speaker styles) are encoded
+once into .npy files named after the sentence model, its inference backend and a hash of
+the phrase list. Every worker memory-maps them instead of encoding the phrases again, so
+all the processes of a host share the same pages and a cold start does not run the encoder
+at all. Editing a phrase list changes its hash, the artifact is then rebuilt on first use.
+
+PHRASE_EMBEDDING_DIR (default cache/phrase_embeddings, empty to keep them in memory only)
+sets the location. python -m Evaluation_metrics.phrase_embeddings builds all of them, eg.
+when building the image.
+'''
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+from Evaluation_metrics.model_registry import SENTENCE_MODEL_NAME, current_backend, get_sentence_model
+from Evaluation_metrics.telemetry import inference
+
+logger=logging.getLogger(__name__)
+
+_mapped={}
+_lock=threading.Lock()
+
+
+def phrase_set_key(phrases:list[str], model_name:str=SENTENCE_MODEL_NAME, backend:str='torch') -> str:
+    '''
+    File name of the artifact : model name, backend and hash of the phrase list
+    '''
+    digest=hashlib.sha256('\0'.join([model_name, backend, *phrases]).encode('utf-8')).hexdigest()[:16]
+    return f"{model_name.replace('/', '--')}-{backend}-{digest}"
+
+
+def _encode(phrases:list[str], model_name:str, backend:str) -> np.ndarray:
+    with inference('sentence_embedding', len(phrases)):
+        vectors=get_sentence_model(model_name, backend).encode(sentences=list(phrases), normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _build(path:str, phrases:list[str], model_name:str, backend:str):
+    vectors=_encode(phrases, model_name, backend)
+    directory=os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    #written next to the final file first, a worker never maps half an artifact
+    fd, temp_path=tempfile.mkstemp(dir=directory, suffix='.npy.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, vectors)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logger.info(f'Built phrase embeddings {path} {vectors.shape}')
+
+
+def phrase_embeddings(phrases:list[str], model_name:str=SENTENCE_MODEL_NAME) -> np.ndarray:
+    '''
+    Normalized embeddings of the phrases, shape (len(phrases), dim), read-only
+
+    RETURN : the memory-mapped artifact, built first when it does not exist yet
+    '''
+    backend=current_backend()
+    key=phrase_set_key(phrases, model_name, backend)
+    with _lock:
+        if key in _mapped:
+            return _mapped[key]
+
+        directory=os.getenv('PHRASE_EMBEDDING_DIR', os.path.join('cache', 'phrase_embeddings'))
+        if not directory:
+            vectors=_encode(phrases, model_name, backend)
+        else:
+            path=os.path.join(directory, f'{key}.npy')
+            try:
+                if not os.path.exists(path):
+                    _build(path, phrases, model_name, backend)
+                vectors=np.load(path, mmap_mode='r')
+            except (OSError, ValueError):
+                logger.exception(f'Could not use the phrase embeddings artifact {path}, encoding in memory')
+                vectors=_encode(phrases, model_name, backend)
+
+        if len(vectors)!=len(phrases):
+            logger.warning(f'Phrase embeddings {key} do not match the phrase list, encoding in memory')
+            vectors=_encode(phrases, model_name, backend)
+        _mapped[key]=vectors
+        return vectors
+
+
+def load_all() -> dict:
+    '''
+    Maps (building them when needed) the embeddings of every canonical phrase set,
+    meant to run once when a worker starts
+
+    RETURN : shape of each phrase set
+    '''
+    from Evaluation_metrics.Greetings_ownership import greetings_embeddings, ownership_embeddings
+    from Evaluation_metrics.satisfaction import explicit_embedding, implicit_patterns_embedding
+    from Transcript_actions.Speaker_classification import agent_phrase_embeddings, customer_phrase_embeddings
+
+    sets={
+        'greetings': greetings_embeddings,
+        'ownership': ownership_embeddings,
+        'explicit_satisfaction': explicit_embedding,
+        'implicit_satisfaction': implicit_patterns_embedding,
+        'agent_style': agent_phrase_embeddings,
+        'customer_style': customer_phrase_embeddings
+    }
+    return {name: tuple(loader().shape) for name, loader in sets.items()}
+
+
+if __name__=='__main__':
+    logging.basicConfig(level=logging.INFO)
+    for name, shape in load_all().items():
+        print(f'{name} : {shape}')
@@ -87,20 +87,17 @@ NEGATIVE_CONTEXT_INDICATORS = [
 
 IMPLICIT=' '.join(IMPLICIT_ACCEPTANCE_WORDS)
 
-from sentence_transformers.util.tensor import normalize_embeddings
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-import spacy
-import matplotlib.pyplot as plt
+from Evaluation_metrics.model_registry import get_nlp
+from Evaluation_metrics.phrase_embeddings import phrase_embeddings
+from Evaluation_metrics.embeddings import UtteranceEmbeddings, embed_utterances
+from Evaluation_metrics.similarity import max_similarity
 
-model= SentenceTransformer("all-MiniLM-L6-v2")
-nlp=spacy.load("en_core_web_sm")
 sentiment_analyzer = SentimentIntensityAnalyzer()
 
 def keywords_func(sentence:str):
-    doc=nlp(sentence.lower())
+    doc=get_nlp()(sentence.lower())
     set1=set()
     for Token in doc:
         if Token.pos_ in {'ADJ', 'NOUN', 'VERB'}:
@@ -116,12 +113,14 @@ def sentiment_score(text: str) -> float:
     """
     return sentiment_analyzer.polarity_scores(text)["compound"]
 
-def sentiment_trajectory(customer_utterance_list: list[dict]):
+def sentiment_trajectory(customer_utterance_list: list[dict]) -> dict:
     '''
     To show the trajecotry of the customer emotion through out the conversation
-    '''
-    fig, ax=plt.subplots() #fig represent the whole plot as an image, while the ax is the graph/plot 
 
+    RETURN : {'time_ms': middle of every customer utterance, 'sentiment': its compound
+    sentiment score}, plain lists so it can be serialized as is. The plot is rendered
+    on demand only (api.plots)
+    '''
     traj_score=[]
     time_of_observation=[]
 
@@ -131,48 +130,37 @@ def sentiment_trajectory(customer_utterance_list: list[dict]):
 
         sentiment_state=sentiment_score(text)
 
-        traj_score.append(sentiment_state)
+        traj_score.append(round(sentiment_state, 4))
         time_of_observation.append(time_stamp)
     
-    ax.plot(time_of_observation, traj_score)
-    ax.set_xlabel("Time (ms)")
-    ax.set_ylabel("Emotion sentiment score")
-    ax.set_title("Line graph between two values")
-    
-    return fig, ax
+    return {'time_ms': time_of_observation, 'sentiment': traj_score}
 
-explicit_embedding=model.encode(
-    sentences= Explicit_statements,
-    normalize_embeddings=True)
+def explicit_embedding():
+    return phrase_embeddings(Explicit_statements)
 
-# Pre-compute embeddings for implicit satisfaction patterns
-implicit_patterns_embedding = model.encode(
-    sentences=IMPLICIT_SATISFACTION_PATTERNS,
-    normalize_embeddings=True)
+# Precomputed embeddings of the implicit satisfaction patterns (memory-mapped artifact)
+def implicit_patterns_embedding():
+    return phrase_embeddings(IMPLICIT_SATISFACTION_PATTERNS)
 
-def explicit_check(customer_dict_list:list[dict], portion= 0.3):
+def explicit_check(customer_dict_list:list[dict], portion= 0.3, embeddings:UtteranceEmbeddings=None):
     '''
     1. Generated explicit phrases via GPT that shows satisfied emotions
     2. Iterating over customer utterances to check for similar
        phrases with the help of sentence & phrases embeddings
-       with cosine_similarity.
+       with one matrix multiply (embeddings are normalized).
     3. We are looking for emotions that show satisfaction that last
        portion of the conversation
     '''
-    semantic_list=[]
     begin=int(len(customer_dict_list)*(1-portion))
-    for u in customer_dict_list[begin:]:
-        text=u.get('text')
-        text_embedding=model.encode( text, normalize_embeddings=True)
-        #comparing all the explicit phrases with the customer utterance
-        similarity_score=cosine_similarity(
-            explicit_embedding,
-            [text_embedding]
-        )
-        similarity_score=similarity_score.flatten()
-        score=np.max(similarity_score)
-        semantic_list.append(score)
-    avg_score=np.mean(semantic_list)
+    relevant_utterances=customer_dict_list[begin:]
+    if not relevant_utterances:
+        return 0.0
+    if embeddings is None:
+        embeddings=embed_utterances(relevant_utterances)
+
+    #comparing all the explicit phrases with every customer utterance at once, shape (utterances, phrases)
+    semantic_list=max_similarity(embeddings.vectors(relevant_utterances), explicit_embedding())
+    avg_score=float(np.mean(semantic_list))
     avg_score=(avg_score+1)/2
     return avg_score
 
@@ -183,19 +171,20 @@ def _has_negative_context(text: str) -> bool:
             return True
     return False
 
-def _calculate_semantic_similarity(text: str) -> float:
+def _calculate_semantic_similarity(text: str, embeddings: UtteranceEmbeddings = None) -> float:
     '''
     Calculate semantic similarity with implicit satisfaction patterns using embeddings.
     Returns max similarity score [0, 1].
     '''
-    text_embedding = model.encode(text, normalize_embeddings=True)
-    similarity_scores = cosine_similarity(
-        implicit_patterns_embedding,
-        [text_embedding]
-    )
-    similarity_scores = similarity_scores.flatten()
-    max_similarity = np.max(similarity_scores)
-    return max(0.0, max_similarity)
+    if embeddings is None:
+        embeddings = embed_utterances([text])
+    return float(_semantic_similarities([text], embeddings)[0])
+
+def _semantic_similarities(texts: list[str], embeddings: UtteranceEmbeddings) -> np.ndarray:
+    '''
+    _calculate_semantic_similarity of all the texts at once, one matrix multiply
+    '''
+    return np.maximum(max_similarity(embeddings.vectors(texts), implicit_patterns_embedding()), 0.0)
 
 def _calculate_keyword_match_score(text: str) -> float:
     '''
@@ -226,7 +215,7 @@ def _get_contextual_sentiment(text: str, prev_text: str = "", next_text: str = "
     normalized_sentiment = (current_sentiment + 1) / 2
     return max(0.0, min(1.0, normalized_sentiment))
 
-def implicit_check(customer_dict_list: list[dict], portion: float = 0.4):
+def implicit_check(customer_dict_list: list[dict], portion: float = 0.4, embeddings: UtteranceEmbeddings = None):
     '''
     Improved implicit satisfaction detection using multiple signals:
     
@@ -239,6 +228,7 @@ def implicit_check(customer_dict_list: list[dict], portion: float = 0.4):
     Args:
         customer_dict_list: List of customer utterance dictionaries with 'text' key
         portion: Portion of conversation to analyze (default 0.4 = last 40%)
+        embeddings: Per call UtteranceEmbeddings, built from the analysed utterances when not given
     
     Returns:
         Implicit satisfaction score [0, 1]
@@ -251,7 +241,12 @@ def implicit_check(customer_dict_list: list[dict], portion: float = 0.4):
     
     if not relevant_utterances:
         return 0.0
+    if embeddings is None:
+        embeddings = embed_utterances(relevant_utterances)
     
+    texts = [u.get('text', '').strip() for u in relevant_utterances]
+    semantic_scores = _semantic_similarities(texts, embeddings)
+
     utterance_scores = []
     for i, utterance in enumerate(relevant_utterances):
         text = utterance.get('text', '').strip()
@@ -270,7 +265,7 @@ def implicit_check(customer_dict_list: list[dict], portion: float = 0.4):
             if sentiment < -0.3:  
                 continue  
 
-        semantic_score = _calculate_semantic_similarity(text)
+        semantic_score = float(semantic_scores[i])
         keyword_score = _calculate_keyword_match_score(text)
         contextual_sentiment = _get_contextual_sentiment(text, prev_text, next_text)
         
@@ -309,4 +304,4 @@ def implicit_check(customer_dict_list: list[dict], portion: float = 0.4):
     
     final_score = max(0.0, min(1.0, normalized_score))
     
-    return round(final_score, 4)
\ No newline at end of file
+    return round(float(final_score), 4)
\ No newline at end of file
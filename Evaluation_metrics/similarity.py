@@ -0,0 +1,73 @@
+'''
+Similarity kernels over unit-normalized embeddings.
+
+Every vector coming out of the sentence model (UtteranceEmbeddings, phrase sets) is
+normalized, so the cosine similarity is a plain dot product : the whole
+(utterances x phrases) score matrix of a metric is one matrix multiply, and the per
+utterance reductions (max, mean, threshold) run on that matrix instead of calling
+sklearn's cosine_similarity row by row.
+'''
+import numpy as np
+
+
+def _matrix(vectors) -> np.ndarray:
+    vectors=np.asarray(vectors, dtype=np.float32)
+    return vectors.reshape(1, -1) if vectors.ndim==1 else vectors
+
+
+def similarity_matrix(vectors, phrases) -> np.ndarray:
+    '''
+    ARGS : (n, d) utterance vectors, (m, d) phrase vectors, both normalized
+    RETURN : (n, m) cosine similarities
+    '''
+    return _matrix(vectors)@_matrix(phrases).T
+
+
+def max_similarity(vectors, phrases) -> np.ndarray:
+    '''
+    RETURN : (n,) similarity of every utterance with its closest phrase
+    '''
+    vectors=_matrix(vectors)
+    if not len(vectors):
+        return np.zeros(0, dtype=np.float32)
+    return similarity_matrix(vectors, phrases).max(axis=1)
+
+
+def mean_similarity(vectors, phrases) -> np.ndarray:
+    '''
+    RETURN : (n,) average similarity of every utterance with all the phrases
+
+    The mean of the dot products is the dot product with the mean phrase vector,
+    so this is a single matrix-vector product
+    '''
+    return _matrix(vectors)@_matrix(phrases).mean(axis=0)
+
+
+def any_above(vectors, phrases, threshold:float) -> bool:
+    '''
+    True when at least one utterance is closer than threshold to one of the phrases
+    '''
+    return bool(len(_matrix(vectors))) and bool(np.max(max_similarity(vectors, phrases))>threshold)
+
+
+def pairwise_similarity(vectors1, vectors2) -> np.ndarray:
+    '''
+    RETURN : (n,) similarity of row i of vectors1 with row i of vectors2
+    '''
+    return np.einsum('ij,ij->i', _matrix(vectors1), _matrix(vectors2))
+
+
+def window_pool(vectors, size:int) -> np.ndarray:
+    '''
+    Sliding windows of size consecutive rows pooled into one unit vector each, from the
+    running (prefix) sums so the cost does not depend on size
+
+    RETURN : (n-size+1, d) normalized window vectors, empty when n<size
+    '''
+    vectors=_matrix(vectors)
+    if len(vectors)<size:
+        return np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    running=np.concatenate([np.zeros((1, vectors.shape[1])), np.cumsum(vectors, axis=0, dtype=np.float64)])
+    sums=running[size:]-running[:-size]
+    norms=np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return (sums/norms).astype(np.float32)
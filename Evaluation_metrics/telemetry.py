@@ -0,0 +1,119 @@
+'''
+Prometheus instrumentation of the evaluation pipeline.
+
+- evaluation_stage_seconds : duration of every stage timed with api.scheduler.timed
+  (upload, polling, diarization, each metric, final_score, the whole evaluation...)
+- model_inference_* : calls, items, batch sizes and durations of the sentence model and
+  the cross-encoder
+- llm_request_seconds / llm_requests_total : Ollama requests by model and outcome
+- cache_* : hits, misses and hit ratio of the caches registered with register_cache
+
+The metrics live in the default registry of the process, GET /metrics of the API exposes
+them. With several uvicorn workers every worker is scraped on its own.
+'''
+import time
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+STAGE_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BATCH_BUCKETS=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+STAGE_SECONDS=Histogram(
+    'evaluation_stage_seconds', 'Duration of the evaluation pipeline stages', ['stage'], buckets=STAGE_BUCKETS
+)
+STAGE_FAILURES=Counter(
+    'evaluation_stage_failures', 'Stages that raised', ['stage']
+)
+INFERENCE_CALLS=Counter(
+    'model_inference_calls', 'Model inference calls', ['kind']
+)
+INFERENCE_ITEMS=Counter(
+    'model_inference_items', 'Texts or text pairs sent to the models', ['kind']
+)
+INFERENCE_BATCH_SIZE=Histogram(
+    'model_inference_batch_size', 'Texts or text pairs per inference call', ['kind'], buckets=BATCH_BUCKETS
+)
+INFERENCE_SECONDS=Histogram(
+    'model_inference_seconds', 'Duration of the inference calls', ['kind'], buckets=STAGE_BUCKETS
+)
+LLM_REQUESTS=Counter(
+    'llm_requests', 'Ollama requests', ['model', 'outcome']
+)
+LLM_SECONDS=Histogram(
+    'llm_request_seconds', 'Duration of the Ollama requests', ['model'], buckets=STAGE_BUCKETS
+)
+
+
+def observe_stage(stage:str, seconds:float, failed:bool=False):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if failed:
+        STAGE_FAILURES.labels(stage).inc()
+
+
+@contextmanager
+def inference(kind:str, batch_size:int):
+    '''
+    Records one model call of batch_size texts (or pairs) and its duration
+    '''
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        INFERENCE_CALLS.labels(kind).inc()
+        INFERENCE_ITEMS.labels(kind).inc(batch_size)
+        INFERENCE_BATCH_SIZE.labels(kind).observe(batch_size)
+        INFERENCE_SECONDS.labels(kind).observe(time.perf_counter()-start)
+
+
+def record_llm_request(model:str, seconds:float, ok:bool):
+    LLM_REQUESTS.labels(model, 'ok' if ok else 'error').inc()
+    LLM_SECONDS.labels(model).observe(seconds)
+
+
+class _CacheCollector:
+    '''
+    Reads the stats() of the registered caches at scrape time
+    '''
+    def __init__(self):
+        self.caches={}
+        self._lock=threading.Lock()
+
+    def collect(self):
+        hits=CounterMetricFamily('cache_hits', 'Cache hits', labels=['cache'])
+        misses=CounterMetricFamily('cache_misses', 'Cache misses', labels=['cache'])
+        ratio=GaugeMetricFamily('cache_hit_ratio', 'Hits over lookups since the start of the process', labels=['cache'])
+        with self._lock:
+            caches=dict(self.caches)
+        for name, get_cache in caches.items():
+            cache=get_cache()
+            if cache is None:
+                continue
+            stats=cache.stats()
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            ratio.add_metric([name], stats['hit_rate'])
+        yield hits
+        yield misses
+        yield ratio
+
+
+_cache_collector=_CacheCollector()
+REGISTRY.register(_cache_collector)
+
+
+def register_cache(name:str, get_cache):
+    '''
+    ARGS : label of the cache, callable returning the cache (or None when it is disabled),
+    the cache has a stats() method with hits, misses and hit_rate
+    '''
+    with _cache_collector._lock:
+        _cache_collector.caches[name]=get_cache
+
+
+def render() -> tuple[bytes, str]:
+    '''
+    RETURN : the metrics in the Prometheus text format and its content type
+    '''
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,7 +1,52 @@
-import requests
-import json
+import os
+import math
+import logging
+import numpy as np
+from Transcript_actions.llm_cache import default_llm_cache, llm_cache_key
+from Transcript_actions.ollama_client import shared_ollama_client
+from Evaluation_metrics.phrase_embeddings import phrase_embeddings
+from Evaluation_metrics.embeddings import UtteranceEmbeddings, embed_utterances
+from Evaluation_metrics.similarity import max_similarity
+from Evaluation_metrics.Greetings_ownership import CANONICAL_GREETINGS, CANONICAL_OWNERSHIP
+
+logger=logging.getLogger(__name__)
+
+SPEAKER_MODEL='llama3'
+#bump whenever the prompt below changes, it is part of the LLM cache key
+SPEAKER_PROMPT_VERSION='speaker-v2'
+
+AGENT='Customer Service Agent'
+CUSTOMER='Customer'
+
+
+def speaker_roles(result):
+    '''
+    Checks an answer of the LLM : 'Speaker A' and 'Speaker B' have to be one AGENT and one
+    CUSTOMER (any case)
+
+    RETURN : the answer with the canonical role names, None when it is not valid
+    '''
+    if not isinstance(result, dict):
+        return None
+    roles={AGENT.lower(): AGENT, CUSTOMER.lower(): CUSTOMER}
+    a=roles.get(str(result.get('Speaker A', '')).strip().lower())
+    b=roles.get(str(result.get('Speaker B', '')).strip().lower())
+    if a is None or b is None or a==b:
+        return None
+    return {**result, 'Speaker A': a, 'Speaker B': b}
+
 
 def find_speaker(dialogue_string:str) :
+    '''
+    Asks the LLM who is who, raises ValueError when its answer is not one agent and one customer
+    '''
+    cache=default_llm_cache()
+    cache_key=llm_cache_key(SPEAKER_MODEL, SPEAKER_PROMPT_VERSION, dialogue_string)
+    if cache is not None:
+        cached=speaker_roles(cache.get(cache_key))
+        if cached is not None:
+            return cached
+
     prompt=f"""
     ROLE:
     You are a specialist in analysing cutomer care calls, therefore you will be provided by a transcript string and you have to
@@ -17,39 +62,120 @@ def find_speaker(dialogue_string:str) :
     - take the final decision after analysing all the lines of the conversation carefully
     - output should be in the form of JSON:
     OUTPUT FORMAT - 
-    { 'Speaker A' : 'Customer', 'Speaker B' : 'Customer Service Agent', 'Confidence': 'for example 92%'}
+    {{"Speaker A": "Customer", "Speaker B": "Customer Service Agent", "Confidence": "for example 92%"}}
 
     INPUT:
     Transcipt : {dialogue_string}
     """
 
-    Ollama_response=requests.post(
-        url= 'http://localhost:11434/api/generate',
-        json={
-            'model': 'llama3',
-            'prompt': prompt,
-            'temperature': 0
-        }
-    )
-
-    #Ollama returns out put line by line in this form:
-
-# {"response":"{","done":false}
-# {"response":"\"customer\":","done":false}
-# {"response":"\"Speaker B\"","done":false}
-# {"response":",","done":false}
-# {"response":"\"agent\":","done":false}
-# {"response":"\"Speaker A\"","done":false}
-# {"response":"}","done":false}
-# {"done":true}
-    output=''
-    for line in Ollama_response.iter_lines():
-        if line:
-             # we need to do this because sometime the HTTP returns empty strings that might lead to json CRASH when we do json.loads()
-            data=json.loads(line) # converts the line(bytes here in json format) into dictionary
-            output+=str(data['response'])
-    
-    return json.loads(output)
+    # The client streams the answer, keeps the model loaded between calls and
+    # constrains llama3 to valid JSON (format="json")
+    output=shared_ollama_client().generate_json(prompt, SPEAKER_MODEL)
+    result=speaker_roles(output)
+    if result is None:
+        raise ValueError(f'The LLM did not answer one agent and one customer : {output}')
+
+    # only cached once validated so a malformed answer is asked again next time
+    if cache is not None:
+        cache.put(cache_key, output)
+    return result
+
+CANONICAL_CUSTOMER = [
+    "I have a problem with my order",
+    "I am having an issue with my account",
+    "My internet connection keeps dropping",
+    "I was charged twice on my bill",
+    "I want to cancel my subscription",
+    "I need help with my payment",
+    "It is still not working",
+    "I have been waiting for my refund",
+    "Can you help me with this?",
+    "Why was my card declined?",
+    "I did not receive my package",
+    "I want to speak to a manager",
+    "This is really frustrating",
+    "I already tried restarting it",
+    "How do I reset my password?",
+    "I'm calling because my service is down",
+    "Can you tell me when it will be fixed?",
+    "I would like a refund",
+    "The product I received is damaged",
+    "I can't log in to my account",
+    "Thank you, that solved my issue",
+    "Okay, thanks for your help",
+    "My order number is",
+    "I've been a customer for years",
+    "Nobody has called me back"
+]
+
+#below this confidence the LLM decides who is who
+SPEAKER_CONFIDENCE_THRESHOLD=float(os.getenv('SPEAKER_CONFIDENCE_THRESHOLD', '0.8'))
+#how fast the confidence grows with the gap between the role scores of the two speakers
+SPEAKER_CONFIDENCE_SCALE=25.0
+
+
+def agent_phrase_embeddings():
+    return phrase_embeddings(CANONICAL_GREETINGS+CANONICAL_OWNERSHIP)
+
+def customer_phrase_embeddings():
+    return phrase_embeddings(CANONICAL_CUSTOMER)
+
+
+def classify_speakers_by_embedding(dialogue_dict:dict, embeddings:UtteranceEmbeddings=None):
+    '''
+    Local fast path of find_speaker : every utterance is scored against the agent style
+    (greetings + ownership) and customer style phrase sets, the speaker whose lines lean
+    the most towards the agent phrases is the agent.
+
+    RETURN : same dictionary as find_speaker with a numeric 'Confidence' in [0.5, 1],
+    None when the transcript does not have exactly the two speakers A and B
+    '''
+    utterances_list=dialogue_dict.get('utterances') or []
+    by_speaker={'A': [], 'B': []}
+    for u in utterances_list:
+        if u.get('speaker') not in by_speaker:
+            return None
+        by_speaker[u.get('speaker')].append(u)
+    if not by_speaker['A'] or not by_speaker['B']:
+        return None
+
+    if embeddings is None:
+        embeddings=embed_utterances(utterances_list)
+
+    role_score={}
+    for speaker, utterances in by_speaker.items():
+        vectors=embeddings.vectors(utterances)
+        agent_similarity=max_similarity(vectors, agent_phrase_embeddings())
+        customer_similarity=max_similarity(vectors, customer_phrase_embeddings())
+        role_score[speaker]=float(np.mean(agent_similarity-customer_similarity))
+
+    gap=role_score['A']-role_score['B']
+    confidence=1/(1+math.exp(-SPEAKER_CONFIDENCE_SCALE*abs(gap)))
+    agent_speaker='A' if gap>=0 else 'B'
+    return {
+        'Speaker A': AGENT if agent_speaker=='A' else CUSTOMER,
+        'Speaker B': AGENT if agent_speaker=='B' else CUSTOMER,
+        'Confidence': round(confidence, 4),
+        'Source': 'embedding'
+    }
+
+
+def identify_speakers(dialogue_dict:dict, dialogue_string:str, embeddings:UtteranceEmbeddings=None, threshold:float=None):
+    '''
+    Embedding classifier first, the LLM (find_speaker) only when its confidence is below threshold
+
+    ARGS : transcript dictionary, its "Speaker X: text" string for the LLM, per call
+    embeddings (optional), confidence threshold (SPEAKER_CONFIDENCE_THRESHOLD by default)
+    '''
+    threshold=SPEAKER_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    result=classify_speakers_by_embedding(dialogue_dict, embeddings)
+    if result is not None and result['Confidence']>=threshold:
+        return result
+
+    confidence=None if result is None else result['Confidence']
+    logger.info(f'Embedding speaker classification not confident enough ({confidence}), asking the LLM')
+    return find_speaker(dialogue_string)
+
 
 def String_4_Semantic_analysis(dialogue_dict:dict, output:dict):
     string1=''
@@ -0,0 +1,116 @@
+'''
+Persistent cache of the Ollama answers for speaker classification and empathy.
+
+Both calls run at temperature 0, so the same transcript sent with the same prompt template
+to the same model gives the same answer. The key is built from those three things
+(llm_cache_key) and the answers live in an in-memory LRU tier backed by a SQLite file,
+so re-evaluations and retries never hit the LLM a second time, even after a restart.
+
+LLM_CACHE_PATH (default cache/llm.sqlite3, empty to disable) and LLM_CACHE_MEMORY_ENTRIES
+(default 1024) configure the shared instance.
+'''
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger=logging.getLogger(__name__)
+
+
+def llm_cache_key(model:str, prompt_version:str, text:str) -> str:
+    '''
+    ARGS : LLM model name, version of the prompt template (bump it whenever the template
+    changes), the transcript (or any input) sent in the prompt
+    '''
+    text_hash=hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f'{model}\0{prompt_version}\0{text_hash}'.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path:str=None, memory_entries:int=1024):
+        '''
+        ARGS : SQLite file of the on-disk tier (None for memory only), entries kept in memory
+        '''
+        self.path=path
+        self.memory_entries=memory_entries
+        self.hits=0
+        self.disk_hits=0
+        self.misses=0
+        self._memory=OrderedDict()
+        self._lock=threading.Lock()
+        self._db=None
+        if path:
+            directory=os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db=sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._db.commit()
+
+    def _remember(self, key, value):
+        self._memory[key]=value
+        self._memory.move_to_end(key)
+        while len(self._memory)>self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key:str):
+        '''
+        RETURN : the cached (JSON) value or None
+        '''
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits+=1
+                return json.loads(self._memory[key])
+            if self._db is not None:
+                row=self._db.execute('SELECT value FROM responses WHERE key=?', (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.hits+=1
+                    self.disk_hits+=1
+                    return json.loads(row[0])
+            self.misses+=1
+            return None
+
+    def put(self, key:str, value):
+        data=json.dumps(value)
+        with self._lock:
+            self._remember(key, data)
+            if self._db is not None:
+                try:
+                    self._db.execute('INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)', (key, data))
+                    self._db.commit()
+                except sqlite3.Error:
+                    logger.exception('Could not persist the LLM response')
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups=self.hits+self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits/lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory)
+            }
+
+
+_default_cache=None
+_default_lock=threading.Lock()
+
+
+def default_llm_cache():
+    '''
+    Shared cache configured from the environment, None when LLM_CACHE_PATH is empty
+    '''
+    global _default_cache
+    path=os.getenv('LLM_CACHE_PATH', os.path.join('cache', 'llm.sqlite3'))
+    if not path:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache=LLMCache(path, int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', '1024')))
+        return _default_cache
@@ -0,0 +1,176 @@
+'''
+Shared client for the local Ollama server.
+
+- one keep-alive requests.Session per process for every call
+- keep_alive sent with every request so the model stays loaded between calls
+- format="json" so the model is constrained to emit valid JSON
+- the answer is really streamed (stream=True) and IncrementalJSONParser spots the end
+  of the JSON document, a model emitting whitespace after it is not waited for
+
+OLLAMA_URL (default http://localhost:11434) and OLLAMA_KEEP_ALIVE (default 30m) configure it.
+'''
+import os
+import json
+import logging
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from Evaluation_metrics.telemetry import record_llm_request
+
+logger=logging.getLogger(__name__)
+
+OLLAMA_URL=os.getenv('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_KEEP_ALIVE=os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+#chunks read after the end of the JSON document before the stream is closed
+TRAILING_CHUNKS=8
+
+
+class IncrementalJSONParser:
+    '''
+    Fed with the text of the answer chunk by chunk, feed() tells when the top level JSON
+    document is complete. In JSON mode the model may keep emitting whitespace after the
+    closing brace until it runs out of tokens, the stream is closed as soon as the
+    document is whole instead.
+    '''
+    def __init__(self):
+        self.text=''
+        self.end=None #index right after the closing bracket of the document
+        self._pos=0
+        self._depth=0
+        self._in_string=False
+        self._escape=False
+
+    def feed(self, chunk:str) -> bool:
+        '''
+        RETURN : True once the document is complete
+        '''
+        self.text+=chunk
+        if self.end is not None:
+            return True
+        text=self.text
+        for i in range(self._pos, len(text)):
+            c=text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape=False
+                elif c=='\\':
+                    self._escape=True
+                elif c=='"':
+                    self._in_string=False
+            elif c=='"':
+                self._in_string=True
+            elif c in '{[':
+                self._depth+=1
+            elif c in '}]':
+                self._depth-=1
+                if self._depth==0:
+                    self.end=i+1
+                    break
+        self._pos=len(text)
+        return self.end is not None
+
+    def document(self):
+        '''
+        The document parsed, raises ValueError when it is not valid JSON
+        '''
+        if self.end is not None:
+            return json.loads(self.text[:self.end])
+        #top level scalar or cut answer, whatever parses at the start of the text
+        value, _=json.JSONDecoder().raw_decode(self.text.strip())
+        return value
+
+
+class OllamaClient:
+    def __init__(self, base_url:str=None, keep_alive:str=None, request_timeout:float=600, session:requests.Session=None):
+        self.base_url=(base_url or OLLAMA_URL).rstrip('/')
+        self.keep_alive=keep_alive or OLLAMA_KEEP_ALIVE
+        self.request_timeout=request_timeout
+        if session is None:
+            session=requests.Session()
+            adapter=HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session=session
+
+    def stream(self, prompt:str, model:str, json_mode:bool=True, options:dict=None):
+        '''
+        Yields the text of the answer as Ollama generates it
+        '''
+        payload={
+            'model': model,
+            'prompt': prompt,
+            'stream': True,
+            'keep_alive': self.keep_alive,
+            'options': {'temperature': 0, **(options or {})}
+        }
+        if json_mode:
+            payload['format']='json'
+
+        start=time.perf_counter()
+        ok=False
+        try:
+            with self.session.post(f'{self.base_url}/api/generate', json=payload, stream=True, timeout=self.request_timeout) as response:
+                if response.status_code!=200:
+                    raise RuntimeError(f'Ollama request failed : {response.status_code}, {response.text}')
+                # Ollama returns the answer line by line {"response": "...", "done": false}
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data=json.loads(line)
+                    if data.get('error'):
+                        raise RuntimeError(f"Ollama error : {data['error']}")
+                    if data.get('response'):
+                        yield data['response']
+                    if data.get('done'):
+                        break
+            ok=True
+        except GeneratorExit:
+            #closed by the consumer once it had what it needed (eg. generate_json)
+            ok=True
+            raise
+        finally:
+            record_llm_request(model, time.perf_counter()-start, ok)
+
+    def generate(self, prompt:str, model:str, json_mode:bool=True, options:dict=None) -> str:
+        return ''.join(self.stream(prompt, model, json_mode=json_mode, options=options))
+
+    def generate_json(self, prompt:str, model:str, options:dict=None):
+        '''
+        RETURN : the answer parsed as JSON, the stream is closed TRAILING_CHUNKS chunks
+        after the JSON document is complete (see IncrementalJSONParser)
+        '''
+        parser=IncrementalJSONParser()
+        trailing=0
+        for chunk in self.stream(prompt, model, json_mode=True, options=options):
+            if parser.feed(chunk):
+                #the final "done" line usually follows right away, reading it keeps the
+                #connection reusable, a model still emitting whitespace is cut short
+                trailing+=1
+                if trailing>TRAILING_CHUNKS:
+                    break
+        return parser.document()
+
+    def warm(self, model:str):
+        '''
+        Loads the model in Ollama without generating anything
+        '''
+        response=self.session.post(
+            f'{self.base_url}/api/generate',
+            json={'model': model, 'keep_alive': self.keep_alive},
+            timeout=self.request_timeout
+        )
+        if response.status_code!=200:
+            raise RuntimeError(f'Loading {model} in Ollama failed : {response.status_code}, {response.text}')
+
+
+_client=None
+_client_lock=threading.Lock()
+
+
+def shared_ollama_client() -> OllamaClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client=OllamaClient()
+        return _client
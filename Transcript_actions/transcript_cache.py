@@ -0,0 +1,152 @@
+'''
+Content addressed cache of completed AssemblyAI transcripts.
+
+The key is the SHA-256 of the audio bytes, so re-submitting a recording (re-scoring after
+a weight change, disputes...) skips the transcription and the polling and goes straight to
+diarization. The upload is skipped only when the hash is known before it : a file on disk
+(UPLOAD_TEE_TO_DISK=1, batch runs) is hashed first, while in the default direct mode the
+hash is computed as the audio streams to AssemblyAI so the upload happens again.
+
+Entries are JSON files on local disk and the directory is the index : every process using
+it (uvicorn workers, batch workers) sees the entries of the others, and the size limit and
+the eviction of the least recently used entries (oldest modification time, refreshed on
+every hit) are computed from the files themselves once the directory grows past max_bytes.
+
+TRANSCRIPT_CACHE_DIR (default cache/transcripts, empty to disable) and
+TRANSCRIPT_CACHE_MAX_BYTES (default 1 GiB) configure the shared instance.
+'''
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger=logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE=1024*1024
+
+
+def hash_file(path:str) -> str:
+    '''
+    SHA-256 hex digest of the file, read in chunks
+    '''
+    digest=hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    def __init__(self, directory:str, max_bytes:int=1024**3):
+        '''
+        ARGS : directory of the cache entries (may be shared by several processes), total
+        size (bytes) kept on disk
+        '''
+        self.directory=directory
+        self.max_bytes=max_bytes
+        self.hits=0
+        self.misses=0
+        self._lock=threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, audio_hash:str) -> str:
+        return os.path.join(self.directory, f'{audio_hash}.json')
+
+    def _entries(self) -> list:
+        '''
+        RETURN : (modification time, key, size) of the entries on disk, least recently used first
+        '''
+        entries=[]
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    st=entry.stat()
+                except FileNotFoundError:
+                    #evicted by another process meanwhile
+                    continue
+                entries.append((st.st_mtime, entry.name[:-5], st.st_size))
+        return sorted(entries)
+
+    def get(self, audio_hash:str):
+        '''
+        RETURN : the cached transcript dictionary or None
+        '''
+        path=self._path(audio_hash)
+        try:
+            with open(path) as f:
+                transcript=json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            transcript=None
+        except (OSError, ValueError):
+            logger.warning(f'Dropping unreadable cache entry {path}')
+            self._remove(audio_hash)
+            transcript=None
+        with self._lock:
+            if transcript is None:
+                self.misses+=1
+            else:
+                self.hits+=1
+        return transcript
+
+    def put(self, audio_hash:str, transcript:dict):
+        data=json.dumps(transcript).encode()
+        #written to a temporary file first so a reader never sees half an entry
+        fd, temp_path=tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._path(audio_hash))
+        with self._lock:
+            self._evict()
+
+    def _remove(self, key:str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries=self._entries()
+        total=sum(size for _, _, size in entries)
+        #the newest entry is always kept
+        for _, key, size in entries[:-1]:
+            if total<=self.max_bytes:
+                break
+            self._remove(key)
+            total-=size
+            logger.debug(f'Evicted transcript {key} from the cache')
+
+    def stats(self) -> dict:
+        entries=self._entries()
+        with self._lock:
+            lookups=self.hits+self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits/lookups, 4) if lookups else 0.0,
+                'entries': len(entries),
+                'bytes': sum(size for _, _, size in entries),
+                'max_bytes': self.max_bytes
+            }
+
+
+_default_cache=None
+_default_lock=threading.Lock()
+
+
+def default_transcript_cache():
+    '''
+    Shared cache configured from the environment, None when TRANSCRIPT_CACHE_DIR is empty
+    '''
+    global _default_cache
+    directory=os.getenv('TRANSCRIPT_CACHE_DIR', os.path.join('cache', 'transcripts'))
+    if not directory:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache=TranscriptCache(directory, int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(1024**3))))
+        return _default_cache
@@ -2,99 +2,216 @@ import os
 import requests
 import time
 import json
+import random
+import asyncio
+import logging
+import threading
+import weakref
+from requests.adapters import HTTPAdapter
+
+logger=logging.getLogger(__name__)
+
+BASE_URL=os.getenv('ASSEMBLYAI_BASE_URL', "https://api.assemblyai.com/v2")
+UPLOAD_CHUNK_SIZE=1024*1024
+
+#Polling : the first check is scheduled after a fraction of the audio duration (AssemblyAI
+#usually needs 15-30% of it), every next wait grows by POLL_BACKOFF with some jitter
+MIN_POLL_INTERVAL=1.0
+MAX_POLL_INTERVAL=30.0
+POLL_DURATION_FRACTION=0.15
+POLL_BACKOFF=1.5
+POLL_JITTER=0.2
+
+#header AssemblyAI adds to the webhook callback so the receiver can authenticate it
+WEBHOOK_AUTH_HEADER='X-Webhook-Secret'
+
+_session=None
+_session_lock=threading.Lock()
+
+
+def shared_session(pool_size:int=20) -> requests.Session:
+    '''
+    One pooled keep-alive session per process shared by every AudioTranscription
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session=requests.Session()
+            adapter=HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def next_poll_delay(attempt:int, audio_duration=None) -> float:
+    '''
+    Seconds to wait before the next status check
+
+    ARGS : number of checks already made, audio_duration in seconds when AssemblyAI reported it
+    '''
+    base=MIN_POLL_INTERVAL
+    if audio_duration:
+        base=max(MIN_POLL_INTERVAL, float(audio_duration)*POLL_DURATION_FRACTION)
+    delay=min(MAX_POLL_INTERVAL, base*(POLL_BACKOFF**attempt))
+    delay*=random.uniform(1-POLL_JITTER, 1+POLL_JITTER)
+    return max(MIN_POLL_INTERVAL, delay)
+
+
+def _file_chunks(audio_path:str, chunk_size:int=UPLOAD_CHUNK_SIZE):
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk=f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _transcript_request(upload_url:str, webhook_url:str=None, webhook_secret:str=None) -> dict:
+    request={"audio_url": upload_url, "speaker_labels": True, "speaker_options": {
+      "min_speakers_expected": 2,
+      "max_speakers_expected": 5}}
+    if webhook_url:
+        request["webhook_url"]=webhook_url
+        if webhook_secret:
+            request["webhook_auth_header_name"]=WEBHOOK_AUTH_HEADER
+            request["webhook_auth_header_value"]=webhook_secret
+    return request
+
+
+def _check_status(transcript:dict) -> bool:
+    '''
+    True once the transcript is completed, raises when AssemblyAI reports an error
+    '''
+    status=transcript.get('status')
+    if status=='completed':
+        return True
+    if status=='error':
+        raise RuntimeError(f"Transcription failed : {transcript.get('error')}")
+    return False
+
 
 #Initialising all the necessary variables
 class AudioTranscription:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, timeout: float = 300, request_timeout: float = 30, session: requests.Session = None, base_url: str = None):
         '''
         passing the necessary arguments
 
-        ARGS : API_KEY
+        ARGS : API_KEY, timeout (seconds) to wait for the transcript to complete,
+        request_timeout (seconds) of every HTTP call, session (shared pooled one by default),
+        base_url of the API (eg. a local stand-in server)
         '''
         self.API_KEY = api_key
-        self.base_url = "https://api.assemblyai.com/v2"
+        self.base_url = base_url or BASE_URL
         self.headers={
             'authorization': self.API_KEY
         }
+        self.timeout=timeout
+        self.request_timeout=request_timeout
+        self.session=session if session is not None else shared_session()
 #Transcription involves the following steps: upload -> perform transcription -> check_status of transcription-> once completed json.dump
     def upload_audio(self, audio_path: str):
         '''
-        To get the response on POST of upload URL
+        To get the response on POST of upload URL, the file is streamed in chunks
 
         ARGS : audio file path
         
         RETURN : To get the upload URL at Assembly AI server endpoint
         '''
-        with open(audio_path, "rb") as f:
-            upload_request = requests.post(
-                url=f"{self.base_url}/upload",
-                headers={
-                    "authorization": self.API_KEY
-                },
-                data=f,
-            )
+        upload_request = self.session.post(
+            url=f"{self.base_url}/upload",
+            headers=self.headers,
+            data=_file_chunks(audio_path),
+            timeout=self.request_timeout
+        )
         if upload_request.status_code!=200:
             raise Exception(f'Upload failed : {upload_request.text}')
         return upload_request.json()["upload_url"]
 
-    def perform_transcription(self, upload_url: str):
+    def perform_transcription(self, upload_url: str, webhook_url: str = None, webhook_secret: str = None):
         '''
         Sending the upload url to ASsembly AI endpoint 
         and sending request to perform transcription.
 
-        ARGS : Assembly Ai response UPLOAD URL
+        ARGS : Assembly Ai response UPLOAD URL, optional webhook_url AssemblyAI calls back
+        on completion and the secret it sends in the WEBHOOK_AUTH_HEADER header
 
         RETURN : Transcription id
         '''
-        transcription = requests.post(
+        transcription = self.session.post(
             url=f"{self.base_url}/transcript",
-            headers={"authorization": self.API_KEY},
-            json={"audio_url": upload_url, "speaker_labels": True, "speaker_options": {
-      "min_speakers_expected": 2,
-      "max_speakers_expected": 5}}
+            headers=self.headers,
+            json=_transcript_request(upload_url, webhook_url, webhook_secret),
+            timeout=self.request_timeout
             )
+        if transcription.status_code!=200:
+            raise RuntimeError(f'Transcription request failed :{transcription.status_code}, {transcription.text}')
         return transcription.json()['id']
 
-    def get_transcript(self, transcription_id:str):
+    def get_transcript(self, transcription_id:str, timeout: float = None):
         '''
-        Retrieving the transcript
+        Retrieving the transcript, the status is polled with next_poll_delay()
 
         ARGS: 
         transcription_id : received from Assembly AI
-        saved_file_path : path where the transcription text is to be saved
+        timeout : seconds to wait for completion (defaults to the one of the instance)
         
         RETURN : 
         Dictionary of response form assembly ai containing the details with the diazrized transcript
         '''
-        start=time.time()
+        timeout=self.timeout if timeout is None else timeout
+        start=time.monotonic()
+        attempt=0
         while True:
-            transcription_process=requests.get(
-            url=f'{self.base_url}/transcript/{transcription_id}',
-            headers=self.headers)
-
-
-            if transcription_process.status_code!=200:
-                raise RuntimeError(f'Status Check failed :{transcription_process.status_code}, {transcription_process.text}')
-
-            status=(transcription_process.json()).get('status')
+            transcript=self.fetch_transcript(transcription_id)
+            if _check_status(transcript):
+                return transcript
 
+            remaining=timeout-(time.monotonic()-start)
+            if remaining<=0:
+                raise TimeoutError(f'Transcription still not completed after waiting for {timeout} seconds')
+            #the last sleep is cut to the time left, the loop checks once more before giving up
+            delay=min(next_poll_delay(attempt, transcript.get('audio_duration')), remaining)
 
-            if status=='completed':
-                break
+            logger.debug(f'Transcript {transcription_id} is {transcript.get("status")}, checking again in {delay:.1f}s')
+            time.sleep(delay)
+            attempt+=1
 
-            if status=='error':
-                raise RuntimeError(f'Transcription failed')
+    def fetch_transcript(self, transcription_id:str):
+        '''
+        Single status check, RETURN : the transcript dictionary whatever its status
+        '''
+        transcription_process=self.session.get(
+            url=f'{self.base_url}/transcript/{transcription_id}',
+            headers=self.headers,
+            timeout=self.request_timeout)
+        if transcription_process.status_code!=200:
+            raise RuntimeError(f'Status Check failed :{transcription_process.status_code}, {transcription_process.text}')
+        return transcription_process.json()
 
-            if (time.time() - start)> 300:
-                raise TimeoutError('Transcription still not completed after waiting for 300 seconds')
+    def wait_for_webhook(self, transcription_id:str, waiters, timeout: float = None):
+        '''
+        Webhook completion mode, blocks until the callback for the transcript reached
+        the receiver of any worker (see TranscriptWaiters) then fetches the transcript.
+        When no callback arrives, or an early one comes before the transcript is completed,
+        the status is polled with get_transcript for the rest of the timeout
 
-            else:
-                print('The task is still under process.....please wait')
-            time.sleep(3)
-        return transcription_process.json()
+        ARGS : transcription_id, TranscriptWaiters the receiver notifies, timeout in seconds
 
+        RETURN : same as get_transcript
+        '''
+        timeout=self.timeout if timeout is None else timeout
+        start=time.monotonic()
+        status=waiters.wait(transcription_id, timeout)
+        if status is None:
+            logger.warning(f'No webhook received for {transcription_id} after {timeout}s, checking the status directly')
+        remaining=max(0.0, timeout-(time.monotonic()-start))
+        try:
+            return self.get_transcript(transcription_id, timeout=remaining)
+        except TimeoutError:
+            raise TimeoutError(f'Transcription still not completed after waiting for {timeout} seconds') from None
 
-    def string_4_speaker_Classification(self, transcription_process:dict):
+    @staticmethod
+    def string_4_speaker_Classification(transcription_process:dict):
         '''
         For converting the json of dialogues into a full readable string for the Speaker classification by Ollama
         Sample output of the transcript json after speech diarization:
@@ -145,6 +262,130 @@ class AudioTranscription:
 
         return dialogue_string
         
+_async_clients=weakref.WeakKeyDictionary()
+
+
+def shared_async_client(pool_size:int=100):
+    '''
+    One pooled httpx.AsyncClient per event loop shared by every AsyncAudioTranscription
+    '''
+    import httpx
+    loop=asyncio.get_running_loop()
+    client=_async_clients.get(loop)
+    if client is None or client.is_closed:
+        client=httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+        _async_clients[loop]=client
+    return client
+
+
+async def _async_file_chunks(audio_path:str, chunk_size:int=UPLOAD_CHUNK_SIZE):
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk=await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class AsyncAudioTranscription:
+    '''
+    asyncio version of AudioTranscription, waiting on a transcript only holds a coroutine
+    (no thread) so hundreds of transcriptions can be in flight on one event loop
+    '''
+    def __init__(self, api_key: str, timeout: float = 300, request_timeout: float = 30, client=None, base_url: str = None):
+        '''
+        ARGS : same as AudioTranscription, client is an httpx.AsyncClient (shared pooled one by default)
+        '''
+        self.API_KEY = api_key
+        self.base_url = base_url or BASE_URL
+        self.headers={
+            'authorization': self.API_KEY
+        }
+        self.timeout=timeout
+        self.request_timeout=request_timeout
+        self.client=client
+
+    def _client(self):
+        if self.client is None:
+            self.client=shared_async_client()
+        return self.client
+
+    async def upload_stream(self, chunks):
+        '''
+        Uploads audio from an (async) iterable of bytes chunks
+
+        RETURN : upload URL at Assembly AI server endpoint
+        '''
+        upload_request=await self._client().post(
+            f"{self.base_url}/upload",
+            headers=self.headers,
+            content=chunks,
+            timeout=self.request_timeout
+        )
+        if upload_request.status_code!=200:
+            raise Exception(f'Upload failed : {upload_request.text}')
+        return upload_request.json()["upload_url"]
+
+    async def upload_audio(self, audio_path: str):
+        return await self.upload_stream(_async_file_chunks(audio_path))
+
+    async def perform_transcription(self, upload_url: str, webhook_url: str = None, webhook_secret: str = None):
+        transcription=await self._client().post(
+            f"{self.base_url}/transcript",
+            headers=self.headers,
+            json=_transcript_request(upload_url, webhook_url, webhook_secret),
+            timeout=self.request_timeout
+        )
+        if transcription.status_code!=200:
+            raise RuntimeError(f'Transcription request failed :{transcription.status_code}, {transcription.text}')
+        return transcription.json()['id']
+
+    async def get_transcript(self, transcription_id:str, timeout: float = None):
+        '''
+        Same as AudioTranscription.get_transcript, the waits between two checks only hold a coroutine
+        '''
+        timeout=self.timeout if timeout is None else timeout
+        start=time.monotonic()
+        attempt=0
+        while True:
+            transcript=await self.fetch_transcript(transcription_id)
+            if _check_status(transcript):
+                return transcript
+
+            remaining=timeout-(time.monotonic()-start)
+            if remaining<=0:
+                raise TimeoutError(f'Transcription still not completed after waiting for {timeout} seconds')
+            await asyncio.sleep(min(next_poll_delay(attempt, transcript.get('audio_duration')), remaining))
+            attempt+=1
+
+    async def fetch_transcript(self, transcription_id:str):
+        transcription_process=await self._client().get(
+            f'{self.base_url}/transcript/{transcription_id}',
+            headers=self.headers,
+            timeout=self.request_timeout
+        )
+        if transcription_process.status_code!=200:
+            raise RuntimeError(f'Status Check failed :{transcription_process.status_code}, {transcription_process.text}')
+        return transcription_process.json()
+
+    async def wait_for_webhook(self, transcription_id:str, waiters, timeout: float = None):
+        '''
+        Same as AudioTranscription.wait_for_webhook, awaits TranscriptWaiters.wait_async
+        '''
+        timeout=self.timeout if timeout is None else timeout
+        start=time.monotonic()
+        status=await waiters.wait_async(transcription_id, timeout)
+        if status is None:
+            logger.warning(f'No webhook received for {transcription_id} after {timeout}s, checking the status directly')
+        remaining=max(0.0, timeout-(time.monotonic()-start))
+        try:
+            return await self.get_transcript(transcription_id, timeout=remaining)
+        except TimeoutError:
+            raise TimeoutError(f'Transcription still not completed after waiting for {timeout} seconds') from None
+
+    string_4_speaker_Classification=staticmethod(AudioTranscription.string_4_speaker_Classification)
+
+
 #from transcription_pipeline import AudioTranscription
 
 # transcriber = AudioTranscription(api_key="YOUR_API_KEY")
@@ -0,0 +1,187 @@
+'''
+Webhook completion mode for AssemblyAI transcriptions.
+
+When a webhook_url is sent with the transcription request, AssemblyAI POSTs
+{"transcript_id": ..., "status": "completed" | "error"} to it once the transcript is
+ready. The receiver endpoint calls notify() and the job blocked in wait() (or awaiting
+wait_async() on the event loop) resumes, so no status polling is needed at all.
+
+With several uvicorn workers the callback can reach any of them, so notify() also writes
+the status to WEBHOOK_STATE_DIR (default cache/webhooks, empty to keep it in memory, which
+is enough for a single worker) and the waiters of every process check that directory
+every WEBHOOK_CHECK_INTERVAL seconds. When no callback arrives in time, or an early one
+arrives before the transcript is completed, the caller falls back to polling.
+'''
+import os
+import re
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger=logging.getLogger(__name__)
+
+WEBHOOK_CHECK_INTERVAL=float(os.getenv('WEBHOOK_CHECK_INTERVAL', '0.5'))
+#callbacks nobody claimed are removed from the shared directory after this many seconds
+WEBHOOK_STATE_TTL=3600
+
+#only ids of this shape are used as file names
+_TRANSCRIPT_ID=re.compile(r'[A-Za-z0-9_-]{1,128}')
+
+
+class TranscriptWaiters:
+    def __init__(self, max_early:int=1000, directory:str=None, check_interval:float=WEBHOOK_CHECK_INTERVAL):
+        '''
+        ARGS : number of callbacks kept for transcripts nobody waits on yet (the
+        callback can arrive before perform_transcription() has returned the id),
+        directory shared with the other workers (None to keep the callbacks in memory),
+        seconds between two checks of that directory
+        '''
+        self.max_early=max_early
+        self.directory=directory
+        self.check_interval=check_interval
+        self._events={}
+        self._statuses=OrderedDict()
+        self._lock=threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, transcript_id:str):
+        if not self.directory or not _TRANSCRIPT_ID.fullmatch(transcript_id):
+            return None
+        return os.path.join(self.directory, f'{transcript_id}.status')
+
+    def _write_shared(self, transcript_id:str, status:str):
+        path=self._path(transcript_id)
+        if path is None:
+            return
+        fd, temp_path=tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(status)
+        os.replace(temp_path, path)
+        self._prune_shared()
+
+    def _read_shared(self, transcript_id:str):
+        path=self._path(transcript_id)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _remove_shared(self, transcript_id:str):
+        path=self._path(transcript_id)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _prune_shared(self):
+        oldest=time.time()-WEBHOOK_STATE_TTL
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime<oldest:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def register(self, transcript_id:str):
+        '''
+        Must be called before wait(), right after the transcription request
+        '''
+        with self._lock:
+            self._events.setdefault(transcript_id, threading.Event())
+            if transcript_id in self._statuses:
+                self._events[transcript_id].set()
+
+    def notify(self, transcript_id:str, status:str) -> bool:
+        '''
+        Called by the webhook receiver
+
+        RETURN : True when a job of this process was waiting for this transcript
+        '''
+        self._write_shared(transcript_id, status)
+        with self._lock:
+            self._statuses[transcript_id]=status
+            self._statuses.move_to_end(transcript_id)
+            overflow=len(self._statuses)-self.max_early
+            if overflow>0:
+                unclaimed=[k for k in self._statuses if k not in self._events]
+                for old in unclaimed[:overflow]:
+                    del self._statuses[old]
+            event=self._events.get(transcript_id)
+            if event is not None:
+                event.set()
+                return True
+        logger.debug(f'Webhook for {transcript_id} arrived before anyone waited on it in this process')
+        return False
+
+    def status(self, transcript_id:str):
+        '''
+        RETURN : the status of the callback received by any worker, None before it arrives
+        '''
+        with self._lock:
+            status=self._statuses.get(transcript_id)
+        return status if status is not None else self._read_shared(transcript_id)
+
+    def wait(self, transcript_id:str, timeout:float):
+        '''
+        Blocks until the callback for transcript_id arrives
+
+        RETURN : the status sent by AssemblyAI, None on timeout
+        '''
+        self.register(transcript_id)
+        event=self._events[transcript_id]
+        deadline=time.monotonic()+timeout
+        try:
+            while True:
+                status=self.status(transcript_id)
+                remaining=deadline-time.monotonic()
+                if status is not None or remaining<=0:
+                    return status
+                event.wait(min(remaining, self.check_interval) if self.directory else remaining)
+        finally:
+            self.release(transcript_id)
+
+    async def wait_async(self, transcript_id:str, timeout:float):
+        '''
+        wait() for the event loop : the callback is checked every check_interval seconds
+        without holding a thread
+
+        RETURN : the status sent by AssemblyAI, None on timeout
+        '''
+        self.register(transcript_id)
+        deadline=time.monotonic()+timeout
+        try:
+            while True:
+                status=self.status(transcript_id)
+                remaining=deadline-time.monotonic()
+                if status is not None or remaining<=0:
+                    return status
+                await asyncio.sleep(min(remaining, self.check_interval))
+        finally:
+            self.release(transcript_id)
+
+    def release(self, transcript_id:str):
+        '''
+        Forgets the waiter and the callback of a transcript once it has been handled
+        '''
+        with self._lock:
+            self._events.pop(transcript_id, None)
+            self._statuses.pop(transcript_id, None)
+        self._remove_shared(transcript_id)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+
+#Shared by the receiver endpoint of the API and the pipeline
+transcript_waiters=TranscriptWaiters(directory=os.getenv('WEBHOOK_STATE_DIR', os.path.join('cache', 'webhooks')) or None)
@@ -1,13 +1,73 @@
 
 import os 
 import json
-import tempfile
-from api.main import Metrics, load_api_key, Final_score
-from fastapi import FastAPI, File, HTTPException, UploadFile, BackgroundTasks
-from pydantic import BaseModel
-from pathlib import Path
+import asyncio
+import hmac
+import hashlib
+import logging
+from typing import Optional
+from api.main import Transcribe_async, Evaluate_transcript, Transcript_metrics, load_api_key, Final_score
+from api.scheduler import timed
+from api.transcripts import Transcript_Input, Utterance
+from api.plots import trajectory_png
+from api.jobs import JobManager, QueueFullError
+from api.uploads import ALLOWED_EXTENSIONS, UploadTooLarge, UploadSizeLimit, limited_chunks, spool_to_disk, remove_file
+from Transcript_actions.transcription_pipeline import AsyncAudioTranscription
+from Evaluation_metrics.model_registry import warm_up, model_stats
+from Evaluation_metrics.phrase_embeddings import load_all as load_phrase_embeddings
+from Evaluation_metrics.telemetry import register_cache, render as render_metrics
+from Evaluation_metrics.live_scoring import LiveScorer
+from Transcript_actions.Speaker_classification import AGENT, CUSTOMER
+from Transcript_actions.webhooks import transcript_waiters
+from Transcript_actions.transcript_cache import default_transcript_cache
+from Transcript_actions.llm_cache import default_llm_cache
+from Transcript_actions.ollama_client import shared_ollama_client
+from Evaluation_metrics.Empathy import EMPATHY_MODEL
+from fastapi import FastAPI, File, Header, HTTPException, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, ValidationError
 
 app=FastAPI()
+#multipart uploads over MAX_UPLOAD_BYTES are refused while they come in
+app.add_middleware(UploadSizeLimit)
+logger=logging.getLogger('uvicorn')
+
+@app.on_event('startup')
+def load_models():
+    #Loading every model once per worker before the first request comes in
+    #set WARM_UP_MODELS=0 to load them lazily on first use instead
+    if os.getenv('WARM_UP_MODELS', '1')!='0':
+        warm_up()
+        #memory-mapping the canonical phrase embeddings (built on the first start only)
+        load_phrase_embeddings()
+        #loading llama3 in Ollama too, it then stays loaded thanks to keep_alive
+        try:
+            shared_ollama_client().warm(EMPATHY_MODEL)
+        except Exception as e:
+            logger.warning(f'Could not warm up the Ollama model : {e}')
+
+@app.get('/models')
+def loaded_models():
+    '''Load time and resident memory of each model loaded in this worker'''
+    return model_stats()
+
+@app.get('/cache')
+def cache_stats():
+    '''Hit/miss counts and size of the caches of this worker'''
+    cache=default_transcript_cache()
+    llm_cache=default_llm_cache()
+    return {
+        'transcripts': cache.stats() if cache is not None else None,
+        'llm': llm_cache.stats() if llm_cache is not None else None
+    }
+
+register_cache('transcripts', default_transcript_cache)
+register_cache('llm', default_llm_cache)
+
+@app.get('/metrics')
+def prometheus_metrics():
+    '''Stage durations, model inference counts and batch sizes, LLM requests and cache hit rates of this worker (Prometheus format)'''
+    data, content_type=render_metrics()
+    return Response(content=data, media_type=content_type)
 
 class Evaluation(BaseModel):
     attention_score : float
@@ -27,48 +87,276 @@ class Breakdown(BaseModel):
     greet : bool
     ownership : bool
 
+class Trajectory(BaseModel):
+    time_ms : list[float]
+    sentiment : list[float]
+
+class Hold(BaseModel):
+    start : int
+    duration_ms : int
+
+class Interruption_Event(BaseModel):
+    time : int
+    by : str
+    of : str
+    overlap_ms : int
+
+class Conversation_Intervals(BaseModel):
+    speakers : list[str]
+    talk_time_ms : dict[str, float]
+    overlap_ms : float
+    silence_ms : float
+    holds : list[Hold]
+    transitions : dict[str, dict[str, int]]
+    interruptions : dict[str, dict[str, int]]
+    backchannels : dict[str, dict[str, int]]
+    interruption_events : list[Interruption_Event]
+
 class Final_Output(BaseModel):
     final_agent_breakdown : float
     breakdown : Breakdown
     individual_score : Evaluation
+    sentiment_trajectory : Optional[Trajectory]=None
+    conversation_intervals : Optional[Conversation_Intervals]=None
 
 
-@app.post('/evaluate', responsemodel= Final_Output)
-async def Evaluate_score(
-    background: BackgroundTasks,
-    file : UploadFile=File(..., description='Calculate the final evaluation dictionary')):
+class Job_Status(BaseModel):
+    job_id : str
+    status : str
+    result : Optional[Final_Output]=None
+    error : Optional[str]=None
+
+
+#bounded pool of workers running the (blocking) evaluations off the event loop, the
+#transcriptions are awaited on the event loop and count in MAX_PENDING_EVALUATIONS only
+jobs=JobManager(
+    max_workers=int(os.getenv('EVALUATION_WORKERS', '2')),
+    max_pending=int(os.getenv('MAX_PENDING_EVALUATIONS', '100'))
+)
+
+@app.on_event('shutdown')
+def stop_workers():
+    jobs.shutdown(wait=False)
+
+
+def Build_output(Evaluation_dictionary:dict, final_score:dict, details:dict=None) -> Final_Output:
+    '''
+    Maps the dictionaries of Metrics() and Final_score() on the response models
+    '''
+    breakdown=final_score['Breakdown']
+    trajectory=(details or {}).get('sentiment trajectory')
+    intervals=(details or {}).get('conversation intervals')
+    return Final_Output(
+        final_agent_breakdown=final_score['Final Agent Score'],
+        breakdown=Breakdown(
+            attention=breakdown['Agent Attention Score'],
+            empathy=breakdown['Agent Empathy Score'],
+            interuption=breakdown['Interuption by Agent'],
+            satisfaction=breakdown['Satisfaction of the Customer'],
+            listening=breakdown['Agent Listening Score '],
+            greet=breakdown['Did the Agent greet'],
+            ownership=breakdown['Did the Agent took Ownership']
+        ),
+        individual_score=Evaluation(
+            attention_score=Evaluation_dictionary['attention score'],
+            empathy_sore=Evaluation_dictionary['empathy score'],
+            greet_score=Evaluation_dictionary['greet score'],
+            ownership_score=Evaluation_dictionary['ownership score'],
+            interuption_score=Evaluation_dictionary['interuption score'],
+            satisfaction_score=Evaluation_dictionary['satisfaction score'],
+            Talk_to_listen=Evaluation_dictionary['Talk to Listen']
+        ),
+        sentiment_trajectory=Trajectory(**trajectory) if trajectory is not None else None,
+        conversation_intervals=Conversation_Intervals(**intervals) if intervals is not None else None
+    )
+
+
+#Webhook completion mode : set WEBHOOK_BASE_URL to the public URL of this service and
+#AssemblyAI calls POST /webhooks/assemblyai instead of being polled
+WEBHOOK_BASE_URL=os.getenv('WEBHOOK_BASE_URL')
+WEBHOOK_SECRET=os.getenv('WEBHOOK_SECRET')
+if WEBHOOK_BASE_URL and not WEBHOOK_SECRET:
+    logger.warning('WEBHOOK_SECRET is not set, the webhook receiver accepts unauthenticated callbacks')
 
+def Webhook_url():
+    if not WEBHOOK_BASE_URL:
+        return None
+    return WEBHOOK_BASE_URL.rstrip('/')+'/webhooks/assemblyai'
 
-    #Uploading audio
-    allowed_extensions={'.wav', '.mp3', '.m4a', '.flac', '.ogg', '.webm', '.mp4'}
-    extension=os.path.splitext(file.filename)[1].lower()
 
-    if extension not in allowed_extensions:
+#UPLOAD_TEE_TO_DISK=1 : the upload is streamed to a temporary file which is then uploaded
+#to AssemblyAI, otherwise it is streamed straight to AssemblyAI while the request comes in
+UPLOAD_TEE_TO_DISK=os.getenv('UPLOAD_TEE_TO_DISK', '0')=='1'
+
+
+async def Transcribe_upload(api_key:str, upload:dict, timings:dict) -> dict:
+    '''
+    Transcription of a received upload (see Receive_upload), awaited on the event loop
+    '''
+    return await Transcribe_async(api_key, temp_path1=upload.get('temp_path'), upload_url=upload.get('upload_url'), audio_hash=upload.get('audio_hash'),
+                                  webhook_url=Webhook_url(), webhook_secret=WEBHOOK_SECRET, timings=timings)
+
+
+def Evaluate_audio(transcript_dict:dict, timings:dict=None) -> Final_Output:
+    '''
+    Diarization and metrics of a transcribed recording, runs on a worker thread of the job pool
+    '''
+    details={}
+    with timed('evaluation_audio'):
+        Evaluation_dictionary = Evaluate_transcript(transcript_dict, timings=timings, details=details)
+        with timed('final_score'):
+            final_score=Final_score(Evaluation_dict=Evaluation_dictionary)
+        return Build_output(Evaluation_dictionary, final_score, details)
+
+
+def Evaluate_transcript_input(transcript:dict) -> Final_Output:
+    '''
+    Diarization and metrics of an already transcribed call, runs on a worker thread of the job pool
+    '''
+    details={}
+    with timed('evaluation_transcript'):
+        Evaluation_dictionary = Transcript_metrics(transcript, details=details)
+        with timed('final_score'):
+            final_score=Final_score(Evaluation_dict=Evaluation_dictionary)
+        return Build_output(Evaluation_dictionary, final_score, details)
+
+
+def Check_extension(filename:str) -> str:
+    extension=os.path.splitext(filename or '')[1].lower()
+
+    if extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f'Unsupported file type uploaded {extension} /n Allowed Extensions = {allowed_extensions}')
-    
-    Temp_Dir=Path('temp_upload')
+            detail=f'Unsupported file type uploaded {extension} /n Allowed Extensions = {ALLOWED_EXTENSIONS}')
+    return extension
+
+
+async def Receive_upload(source, extension:str) -> dict:
+    '''
+    Streams the recording in chunks to disk or to AssemblyAI (see UPLOAD_TEE_TO_DISK)
+
+    ARGS : UploadFile or async iterator of bytes, file extension
+
+    RETURN : keyword arguments of Evaluate_audio (temp_path or upload_url, and audio_hash
+    the SHA-256 of the audio computed on the way, used as the transcript cache key)
+    '''
+    if jobs.full():
+        raise HTTPException(status_code=503, detail='Too many evaluations are already queued')
 
-    temp_path=None
+    digest=hashlib.sha256()
+    chunks=limited_chunks(source, digest=digest)
     try:
-        #create temporary path file
-        with tempfile.NamedTemporaryFile(dir=Temp_Dir, delete=False, suffix=extension) as temp_file:
-            temp_path= temp_file.name
-            content = await file.read()
-            temp_file.write(content)
-       
-        api_key=load_api_key()
-        Evaluation_dictionary = Metrics(API_key=api_key, temp_path1=temp_path)
-        final_score=Final_score(Evaluation_dict=Evaluation_dictionary)
-        
-        response = Final_Output(
-            final_agent_breakdown=final_score['Final Agent Score'],
-            breakdown=Breakdown(**final_score['Breakdown']),
-            individual_score=Evaluation(**Evaluation_dictionary)
+        if UPLOAD_TEE_TO_DISK:
+            temp_path=await spool_to_disk(chunks, suffix=extension)
+            return {'temp_path': temp_path, 'audio_hash': digest.hexdigest()}
+        upload_url=await AsyncAudioTranscription(api_key=load_api_key()).upload_stream(chunks)
+        return {'upload_url': upload_url, 'audio_hash': digest.hexdigest()}
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def Submit(upload:dict) -> str:
+    '''
+    The transcription is awaited on the event loop, only the evaluation takes a worker of the pool
+    '''
+    temp_path=upload.get('temp_path')
+    #shared by both phases so the stage_timings line covers the whole call
+    timings={}
+    try:
+        return jobs.submit_async(Transcribe_upload(load_api_key(), upload, timings), Evaluate_audio, timings=timings, cleanup=lambda: remove_file(temp_path))
+    except QueueFullError as e:
+        remove_file(temp_path)
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post('/jobs', response_model=Job_Status, status_code=202)
+async def Submit_evaluation(
+    file : UploadFile=File(..., description='Audio recording of the call to evaluate')):
+    '''
+    Queues the evaluation and returns the job id right away, poll GET /jobs/{job_id} for the result
+    '''
+    extension=Check_extension(file.filename)
+    job_id=Submit(await Receive_upload(file, extension))
+    return Job_Status(job_id=job_id, status=jobs.get(job_id)['status'])
+
+
+@app.post('/jobs/stream', response_model=Job_Status, status_code=202)
+async def Submit_evaluation_stream(request:Request, filename:str):
+    '''
+    Same as POST /jobs with the raw audio as the request body (no multipart), the body is
+    forwarded chunk by chunk as it arrives, filename is only used for its extension
+    '''
+    extension=Check_extension(filename)
+    job_id=Submit(await Receive_upload(request.stream(), extension))
+    return Job_Status(job_id=job_id, status=jobs.get(job_id)['status'])
+
+
+@app.get('/jobs/{job_id}', response_model=Job_Status)
+def Job_result(job_id:str):
+    job=jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'Unknown job id {job_id}')
+    return Job_Status(job_id=job_id, status=job['status'], result=job['result'], error=job['error'])
+
+
+@app.get('/jobs/{job_id}/trajectory.png', response_class=Response)
+def Trajectory_plot(job_id:str):
+    '''
+    Customer sentiment trajectory of a completed evaluation, rendered on demand
+    '''
+    job=jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'Unknown job id {job_id}')
+    result=job['result']
+    if result is None or result.sentiment_trajectory is None:
+        raise HTTPException(status_code=409, detail=f'Job {job_id} has no sentiment trajectory (status {job["status"]})')
+    png=trajectory_png(result.sentiment_trajectory.model_dump())
+    return Response(content=png, media_type='image/png')
+
+
+@app.post('/evaluate', response_model= Final_Output)
+async def Evaluate_score(
+    file : UploadFile=File(..., description='Calculate the final evaluation dictionary')):
+    '''
+    Same as POST /jobs but waits for the result, the evaluation still runs on the
+    worker pool so the event loop keeps serving other requests meanwhile
+    '''
+    extension=Check_extension(file.filename)
+    job_id=Submit(await Receive_upload(file, extension))
+    try:
+        return await asyncio.wrap_future(jobs.future(job_id))
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Unexpected Error occurred : {str(e)}'
         )
 
-        return response
+def Submit_transcript(transcript:Transcript_Input) -> str:
+    try:
+        return jobs.submit(Evaluate_transcript_input, transcript.model_dump())
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post('/jobs/transcript', response_model=Job_Status, status_code=202)
+def Submit_transcript_evaluation(transcript:Transcript_Input):
+    '''
+    Queues the evaluation of a call transcribed upstream (or a chat), no audio processing,
+    poll GET /jobs/{job_id} for the result
+    '''
+    job_id=Submit_transcript(transcript)
+    return Job_Status(job_id=job_id, status=jobs.get(job_id)['status'])
+
+
+@app.post('/evaluate/transcript', response_model=Final_Output)
+async def Evaluate_transcript_score(transcript:Transcript_Input):
+    '''
+    Same as POST /jobs/transcript but waits for the result
+    '''
+    job_id=Submit_transcript(transcript)
+    try:
+        return await asyncio.wrap_future(jobs.future(job_id))
 
     except Exception as e:
         raise HTTPException(
@@ -76,6 +364,77 @@ async def Evaluate_score(
             detail=f'Unexpected Error occurred : {str(e)}'
         )
 
+#speaker labels of a live call, overridden by the "roles" of the start message
+LIVE_ROLES={'A': AGENT, 'B': CUSTOMER}
+ROLE_NAMES={'agent': AGENT, 'customer': CUSTOMER, AGENT.lower(): AGENT, CUSTOMER.lower(): CUSTOMER}
+
+
+def Live_role(speaker:str, roles:dict) -> str:
+    role=roles.get(speaker, speaker)
+    if role.lower() not in ROLE_NAMES:
+        raise ValueError(f'Unknown speaker {speaker}, send its role in the "roles" of the start message')
+    return ROLE_NAMES[role.lower()]
+
+
+@app.websocket('/live')
+async def Live_scoring(websocket:WebSocket):
+    '''
+    Scores a call while it is happening, one JSON message per utterance in the order they are said :
+
+    {"type": "start", "roles": {"A": "agent", "B": "customer"}} (optional, A is the agent by default)
+    {"speaker": "A", "text": "...", "start": 0, "end": 1500} -> {"type": "scores", ...}
+    {"type": "end"} -> {"type": "summary", ...} with the whole sentiment trajectory, then closed
+
+    An invalid message gets {"type": "error", "detail": ...} and the call goes on.
+    '''
+    await websocket.accept()
+    scorer=await asyncio.to_thread(LiveScorer)
+    roles=dict(LIVE_ROLES)
+    try:
+        while True:
+            try:
+                message=await websocket.receive_json()
+                kind=message.get('type', 'utterance') if isinstance(message, dict) else None
+                if kind=='start':
+                    #validated on a copy so an invalid role leaves the current ones untouched
+                    new_roles={**roles, **{str(k): str(v) for k, v in (message.get('roles') or {}).items()}}
+                    for role in new_roles.values():
+                        Live_role(role, {})
+                    roles=new_roles
+                    await websocket.send_json({'type': 'started', 'roles': roles})
+                elif kind=='end':
+                    await websocket.send_json({'type': 'summary', **scorer.summary()})
+                    await websocket.close()
+                    return
+                elif kind=='utterance':
+                    utterance=Utterance(**{k: v for k, v in message.items() if k!='type'}).model_dump()
+                    utterance['speaker']=Live_role(utterance['speaker'], roles)
+                    with timed('live_update'):
+                        scores=await asyncio.to_thread(scorer.add, utterance)
+                    await websocket.send_json({'type': 'scores', **scores})
+                else:
+                    raise ValueError(f'Unknown message type {kind}')
+            except (ValidationError, ValueError, TypeError) as e:
+                await websocket.send_json({'type': 'error', 'detail': str(e)})
+    except WebSocketDisconnect:
+        logger.info(f'Live call disconnected after {scorer.utterances} utterances')
+
+
+class Transcript_Callback(BaseModel):
+    transcript_id : str
+    status : str
+
+
+@app.post('/webhooks/assemblyai')
+def Transcript_completed(callback:Transcript_Callback, x_webhook_secret:Optional[str]=Header(default=None)):
+    '''
+    Receiver of the AssemblyAI completion webhook, resumes the job waiting on the transcript
+    '''
+    if WEBHOOK_SECRET and not hmac.compare_digest(x_webhook_secret or '', WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail='Invalid webhook secret')
+    resumed=transcript_waiters.notify(callback.transcript_id, callback.status)
+    return {'transcript_id': callback.transcript_id, 'resumed': resumed}
+
 if __name__ ==  '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=8000)
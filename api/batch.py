@@ -0,0 +1,281 @@
+'''
+Offline batch evaluation of recordings or saved transcripts.
+
+    python -m api.batch recordings/ --output results.jsonl --workers 4
+    python -m api.batch manifest.txt --output results.csv
+
+Every input is either a directory (searched recursively), a manifest (text file with one
+path per line, relative paths are relative to the manifest) or a single file. Audio files go
+through Metrics() (transcription included), .json files are transcripts (AssemblyAI or the
+utterance schema of api.transcripts) and go straight to Transcript_metrics().
+
+The files are evaluated on a process pool, every worker loads the models once when it starts.
+Results are appended to the output (JSONL or CSV, from its extension) as soon as each file is
+done, so an interrupted run is resumed by running the same command again : inputs that already
+have a successful result in the output are skipped (--retry-failed also re-runs the failures).
+'''
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from api.uploads import ALLOWED_EXTENSIONS
+
+logger=logging.getLogger(__name__)
+
+TRANSCRIPT_EXTENSIONS={'.json'}
+MANIFEST_EXTENSIONS={'.txt', '.lst', '.manifest'}
+
+METRIC_KEYS=[
+    'attention score',
+    'empathy score',
+    'greet score',
+    'ownership score',
+    'interuption score',
+    'satisfaction score',
+    'Talk to Listen'
+]
+CSV_FIELDS=['input', 'status', 'final_score', *METRIC_KEYS, 'seconds', 'error']
+
+OK='ok'
+ERROR='error'
+
+
+def _is_evaluable(path:str) -> bool:
+    ext=os.path.splitext(path)[1].lower()
+    return ext in ALLOWED_EXTENSIONS or ext in TRANSCRIPT_EXTENSIONS
+
+
+def _read_manifest(path:str) -> list:
+    base=os.path.dirname(os.path.abspath(path))
+    files=[]
+    with open(path) as f:
+        for line in f:
+            line=line.strip()
+            if not line or line.startswith('#'):
+                continue
+            files.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return files
+
+
+def collect_inputs(paths:list) -> list:
+    '''
+    ARGS : directories, manifests or files
+    RETURN : absolute paths of the files to evaluate, sorted and without duplicates
+    '''
+    files=[]
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if _is_evaluable(name))
+        elif os.path.splitext(path)[1].lower() in MANIFEST_EXTENSIONS:
+            files.extend(_read_manifest(path))
+        elif _is_evaluable(path):
+            files.append(path)
+        else:
+            raise ValueError(f'{path} is neither a directory, a manifest, an audio file nor a transcript')
+    return sorted({os.path.abspath(f) for f in files})
+
+
+def completed_inputs(output_path:str, retry_failed:bool=False) -> set:
+    '''
+    Inputs already evaluated in a previous run of the same output file
+    '''
+    if not os.path.exists(output_path):
+        return set()
+    done=set()
+    with open(output_path, newline='') as f:
+        if output_path.endswith('.csv'):
+            rows=csv.DictReader(f)
+        else:
+            rows=[]
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    #last line of an interrupted run
+                    continue
+        for row in rows:
+            if row.get('status')==OK or not retry_failed:
+                done.add(row.get('input'))
+    return done
+
+
+class ResultWriter:
+    '''
+    Appends one result per line to a JSONL or CSV file and flushes it right away
+    '''
+    def __init__(self, path:str):
+        self.path=path
+        self.csv=path.endswith('.csv')
+        directory=os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        new_file=not os.path.exists(path) or os.path.getsize(path)==0
+        self._file=open(path, 'a', newline='')
+        if self.csv:
+            self._writer=csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if new_file:
+                self._writer.writeheader()
+
+    def write(self, row:dict):
+        if self.csv:
+            self._writer.writerow({**row, **(row.get('scores') or {})})
+        else:
+            self._file.write(json.dumps(row)+'\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _init_worker(threads:int=None):
+    '''
+    Runs once in every worker process : the models are loaded here and reused for every file
+    '''
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from Evaluation_metrics.model_registry import warm_up
+    from Evaluation_metrics.phrase_embeddings import load_all
+    warm_up()
+    load_all()
+
+
+def _to_float(value):
+    return None if value is None else float(value)
+
+
+def evaluate_file(path:str) -> dict:
+    '''
+    Worker side evaluation of one audio file or transcript
+
+    RETURN : result row, errors are reported in the row instead of being raised
+    '''
+    from api.main import Metrics, Transcript_metrics, Final_score, load_api_key
+
+    start=time.perf_counter()
+    timings={}
+    details={}
+    row={'input': path}
+    try:
+        if os.path.splitext(path)[1].lower() in TRANSCRIPT_EXTENSIONS:
+            with open(path) as f:
+                transcript_dict=json.load(f)
+            evaluation=Transcript_metrics(transcript_dict, timings=timings, details=details)
+        else:
+            evaluation=Metrics(API_key=load_api_key(), temp_path1=path, timings=timings, details=details)
+        final=Final_score(evaluation)
+        row.update({
+            'status': OK,
+            'final_score': _to_float(final['Final Agent Score']),
+            'scores': {key: _to_float(value) for key, value in evaluation.items()},
+            'timings': timings,
+            'sentiment_trajectory': details.get('sentiment trajectory'),
+            'conversation_intervals': details.get('conversation intervals')
+        })
+    except Exception as e:
+        logger.exception(f'Evaluation of {path} failed')
+        row.update({'status': ERROR, 'error': f'{type(e).__name__}: {e}'})
+    row['seconds']=round(time.perf_counter()-start, 4)
+    return row
+
+
+def throughput_stats(latencies:list, elapsed:float, failed:int=0) -> dict:
+    '''
+    ARGS : per file latencies (s) of the files evaluated successfully, wall clock duration of
+    the run (s), number of failed files
+    '''
+    latencies=np.asarray(latencies, dtype=float)
+    stats={
+        'files': int(latencies.size),
+        'failed': failed,
+        'elapsed_seconds': round(elapsed, 2),
+        'files_per_second': round(latencies.size/elapsed, 4) if elapsed>0 else 0.0
+    }
+    if latencies.size:
+        stats.update({
+            'latency_mean': round(float(latencies.mean()), 3),
+            'latency_p50': round(float(np.percentile(latencies, 50)), 3),
+            'latency_p95': round(float(np.percentile(latencies, 95)), 3),
+            'latency_max': round(float(latencies.max()), 3)
+        })
+    return stats
+
+
+def run_batch(inputs:list, output_path:str, workers:int=2, threads:int=None, retry_failed:bool=False, progress_every:int=10) -> dict:
+    '''
+    Evaluates every input not already in output_path on a pool of workers processes
+
+    RETURN : throughput statistics of the run
+    '''
+    files=collect_inputs(inputs)
+    #spawned processes only : torch is never loaded in this process, a fork of a process
+    #holding the torch/OpenMP thread pools can deadlock
+    context=multiprocessing.get_context('spawn')
+    #building the phrase embedding artifacts once, in a child, the workers only map them
+    from Evaluation_metrics.phrase_embeddings import load_all
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as builder:
+        builder.submit(load_all).result()
+    done=completed_inputs(output_path, retry_failed=retry_failed)
+    pending=[f for f in files if f not in done]
+    print(f'{len(files)} inputs, {len(files)-len(pending)} already evaluated, {len(pending)} to evaluate', flush=True)
+
+    latencies=[]
+    failed=0
+    start=time.perf_counter()
+    with ResultWriter(output_path) as writer, \
+         ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures=[pool.submit(evaluate_file, path) for path in pending]
+        for count, future in enumerate(as_completed(futures), start=1):
+            row=future.result()
+            writer.write(row)
+            if row['status']==OK:
+                latencies.append(row['seconds'])
+            else:
+                failed+=1
+                print(f"FAILED {row['input']} : {row['error']}", file=sys.stderr, flush=True)
+            if progress_every and (count%progress_every==0 or count==len(pending)):
+                elapsed=time.perf_counter()-start
+                rate=count/elapsed if elapsed>0 else 0.0
+                eta=(len(pending)-count)/rate if rate else 0.0
+                print(f'{count}/{len(pending)} done, {failed} failed, {rate:.3f} files/s, ETA {eta:.0f}s', flush=True)
+
+    stats=throughput_stats(latencies, time.perf_counter()-start, failed)
+    stats['skipped']=len(files)-len(pending)
+    return stats
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Batch evaluation of customer service calls')
+    parser.add_argument('inputs', nargs='+', help='directories, manifests, audio files or transcript JSONs')
+    parser.add_argument('-o', '--output', default='results.jsonl', help='results file, .jsonl or .csv (default results.jsonl)')
+    parser.add_argument('-w', '--workers', type=int, default=int(os.getenv('BATCH_WORKERS', '2')),
+                        help='worker processes, every one holds its own copy of the models (default 2)')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads per worker')
+    parser.add_argument('--retry-failed', action='store_true', help='evaluate again the inputs that failed in a previous run')
+    parser.add_argument('--progress-every', type=int, default=10, help='print the throughput every N files')
+    args=parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    stats=run_batch(args.inputs, args.output, workers=args.workers, threads=args.threads,
+                    retry_failed=args.retry_failed, progress_every=args.progress_every)
+    print(json.dumps(stats, indent=2))
+    return 1 if stats['failed'] else 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
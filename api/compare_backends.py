@@ -0,0 +1,179 @@
+'''
+Latency and score drift of an inference backend against the PyTorch one.
+
+    python -m api.compare_backends samples/ --candidate onnx-int8
+    python -m api.compare_backends samples/ --baseline torch --candidate torch-int8 --output drift.json
+
+The samples are transcripts (directories, manifests or .json files as for api.batch). Each
+one is diarized once with the baseline backend so both backends score exactly the same
+utterances, then every model based metric (embeddings, similarity, paraphrasing, greetings,
+ownership, satisfaction) is run and timed on both backends. The report gives, per metric,
+the mean latency of each backend with the speedup and the mean / max absolute score drift.
+The LLM (empathy) and the spaCy keyword metrics do not depend on the backend and are left out.
+'''
+import sys
+import copy
+import json
+import argparse
+import logging
+import numpy as np
+
+from api.batch import collect_inputs
+from api.scheduler import timed
+from api.transcripts import parse_transcript
+from Evaluation_metrics.model_registry import BACKENDS, check_backend, set_backend, get_sentence_model, get_cross_encoder
+from Evaluation_metrics.phrase_embeddings import load_all
+from Evaluation_metrics.embeddings import embed_utterances
+from Evaluation_metrics.Attention import similarity_score, Paraphrasing_check
+from Evaluation_metrics.Greetings_ownership import check_greetings, check_ownership
+from Evaluation_metrics.satisfaction import explicit_check, implicit_check
+from Transcript_actions.Speaker_classification import (
+    AGENT,
+    CUSTOMER,
+    classify_speakers_by_embedding,
+    corrected_list,
+    customer_list_dict,
+    agent_list_dict
+)
+
+logger=logging.getLogger(__name__)
+
+
+def load_samples(paths:list) -> list[dict]:
+    samples=[]
+    for path in collect_inputs(paths):
+        if not path.endswith('.json'):
+            logger.warning(f'Skipping {path}, only transcripts can be compared')
+            continue
+        with open(path) as f:
+            samples.append({'input': path, 'transcript': parse_transcript(json.load(f))})
+    return samples
+
+
+def diarize(transcript_dict:dict) -> dict:
+    '''
+    Customer and agent utterances of the transcript, from the embedding speaker classifier
+    (A is taken as the agent when it can not decide)
+    '''
+    transcript_dict=copy.deepcopy(transcript_dict)
+    roles=classify_speakers_by_embedding(transcript_dict) or {'Speaker A': AGENT, 'Speaker B': CUSTOMER}
+    utterances=corrected_list(dialogue_dict=transcript_dict, output=roles)
+    customer_list, _=customer_list_dict(corrected_list=utterances)
+    agent_list, _=agent_list_dict(corrected_list=utterances)
+    return {'utterances': utterances, 'customer': customer_list, 'agent': agent_list}
+
+
+def score_sample(sample:dict) -> tuple[dict, dict]:
+    '''
+    RETURN : scores and latencies (seconds) of every model based metric on the current backend
+    '''
+    customer_list, agent_list=sample['customer'], sample['agent']
+    timings={}
+    with timed('embeddings', timings):
+        embeddings=embed_utterances(sample['utterances'])
+    stages={
+        'similarity': lambda: similarity_score(customer_list, agent_list, embeddings=embeddings),
+        'paraphrasing': lambda: Paraphrasing_check(customer_list, agent_list),
+        'greet': lambda: check_greetings(agent_list, embeddings=embeddings),
+        'ownership': lambda: check_ownership(agent_list, embeddings=embeddings),
+        'explicit satisfaction': lambda: explicit_check(customer_list, portion=0.35, embeddings=embeddings),
+        'implicit satisfaction': lambda: implicit_check(customer_list, portion=0.35, embeddings=embeddings)
+    }
+    scores={}
+    for name, stage in stages.items():
+        with timed(name, timings):
+            scores[name]=float(stage())
+    return scores, timings
+
+
+def run_backend(backend:str, samples:list[dict]) -> tuple[list, list]:
+    set_backend(backend)
+    #loading outside of the timings : the models, the phrase embeddings and one warm up call
+    get_sentence_model()
+    get_cross_encoder()
+    load_all()
+    score_sample(samples[0])
+
+    scores, timings=[], []
+    for sample in samples:
+        s, t=score_sample(sample)
+        scores.append(s)
+        timings.append(t)
+    return scores, timings
+
+
+def compare(samples:list[dict], baseline:str='torch', candidate:str='onnx-int8') -> dict:
+    #both backends are checked before any model is loaded
+    check_backend(baseline)
+    check_backend(candidate)
+    set_backend(baseline)
+    diarized=[diarize(s['transcript']) for s in samples]
+
+    baseline_scores, baseline_timings=run_backend(baseline, diarized)
+    candidate_scores, candidate_timings=run_backend(candidate, diarized)
+    set_backend(None)
+
+    latency={}
+    for stage in baseline_timings[0]:
+        base=float(np.mean([t[stage] for t in baseline_timings]))*1000
+        cand=float(np.mean([t[stage] for t in candidate_timings]))*1000
+        latency[stage]={
+            f'{baseline}_ms': round(base, 2),
+            f'{candidate}_ms': round(cand, 2),
+            'speedup': round(base/cand, 2) if cand else None
+        }
+    base_total=sum(v[f'{baseline}_ms'] for v in latency.values())
+    cand_total=sum(v[f'{candidate}_ms'] for v in latency.values())
+    latency['total']={
+        f'{baseline}_ms': round(base_total, 2),
+        f'{candidate}_ms': round(cand_total, 2),
+        'speedup': round(base_total/cand_total, 2) if cand_total else None
+    }
+
+    drift={}
+    for metric in baseline_scores[0]:
+        diff=np.abs(np.array([s[metric] for s in candidate_scores])-np.array([s[metric] for s in baseline_scores]))
+        drift[metric]={'mean_abs': round(float(diff.mean()), 4), 'max_abs': round(float(diff.max()), 4)}
+
+    return {
+        'baseline': baseline,
+        'candidate': candidate,
+        'samples': len(samples),
+        'latency': latency,
+        'drift': drift,
+        'per_sample': [
+            {'input': sample['input'], baseline: b, candidate: c}
+            for sample, b, c in zip(samples, baseline_scores, candidate_scores)
+        ]
+    }
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Latency and score drift of an inference backend')
+    parser.add_argument('inputs', nargs='+', help='directories, manifests or transcript JSONs')
+    parser.add_argument('--baseline', default='torch', choices=BACKENDS)
+    parser.add_argument('--candidate', default='onnx-int8', choices=BACKENDS)
+    parser.add_argument('-o', '--output', default=None, help='also write the report (JSON) to this file')
+    args=parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        check_backend(args.baseline)
+        check_backend(args.candidate)
+    except RuntimeError as e:
+        parser.error(str(e))
+    samples=load_samples(args.inputs)
+    if not samples:
+        parser.error('no transcript to compare on')
+    report=compare(samples, baseline=args.baseline, candidate=args.candidate)
+
+    summary={k: v for k, v in report.items() if k!='per_sample'}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+'''
+In-process job queue for the evaluation pipeline.
+
+Model inference is synchronous so it runs on a bounded pool of worker threads instead
+of the event loop. The workers share the models of the process through the model
+registry. A job can start with an I/O bound coroutine (submit_async, eg. the AssemblyAI
+transcription) awaited on the event loop, so waiting on a transcription does not hold a
+worker. Finished jobs are kept in memory until max_finished of them have piled up, then
+the oldest ones are dropped.
+'''
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from Evaluation_metrics.telemetry import observe_stage
+
+logger=logging.getLogger('uvicorn')
+
+PREPARING='preparing'
+QUEUED='queued'
+RUNNING='running'
+COMPLETED='completed'
+FAILED='failed'
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobManager:
+    def __init__(self, max_workers:int=2, max_pending:int=100, max_finished:int=1000):
+        '''
+        ARGS : number of worker threads running pipelines at the same time,
+        number of jobs allowed to prepare/wait/run before submissions are refused,
+        number of finished jobs kept for polling
+        '''
+        self.max_pending=max_pending
+        self.max_finished=max_finished
+        self._executor=ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='evaluation')
+        self._jobs=OrderedDict()
+        self._futures={}
+        self._lock=threading.Lock()
+        #running prepare coroutines, referenced so they are not garbage collected
+        self._tasks=set()
+
+    def _active(self) -> int:
+        return sum(1 for j in self._jobs.values() if j['status'] in (PREPARING, QUEUED, RUNNING))
+
+    def _prune(self):
+        finished=[k for k, j in self._jobs.items() if j['status'] in (COMPLETED, FAILED)]
+        for job_id in finished[:max(0, len(finished)-self.max_finished)]:
+            del self._jobs[job_id]
+            self._futures.pop(job_id, None)
+
+    def _new_job(self, status:str) -> str:
+        job_id=uuid.uuid4().hex
+        if self._active()>=self.max_pending:
+            raise QueueFullError(f'{self.max_pending} evaluations are already queued')
+        now=time.time()
+        self._jobs[job_id]={
+            'job_id': job_id,
+            'status': status,
+            'result': None,
+            'error': None,
+            'submitted_at': now,
+            'queued_at': now,
+            'started_at': None,
+            'finished_at': None
+        }
+        return job_id
+
+    def submit(self, fn, *args, cleanup=None, **kwargs) -> str:
+        '''
+        Queues fn(*args, **kwargs) on the worker pool
+
+        ARGS : pipeline callable and its arguments, optional cleanup() run after the job
+        whatever its outcome (eg. deleting the uploaded file)
+
+        RETURN : job id
+        '''
+        with self._lock:
+            job_id=self._new_job(QUEUED)
+            self._futures[job_id]=self._executor.submit(self._run, job_id, fn, args, kwargs, cleanup)
+        return job_id
+
+    def submit_async(self, prepare, fn, *args, cleanup=None, **kwargs) -> str:
+        '''
+        Awaits the coroutine prepare on the running event loop, then queues
+        fn(result of prepare, *args, **kwargs) on the worker pool, must be called from
+        the event loop
+
+        ARGS : see submit
+
+        RETURN : job id
+        '''
+        loop=asyncio.get_running_loop()
+        future=Future()
+        with self._lock:
+            try:
+                job_id=self._new_job(PREPARING)
+            except QueueFullError:
+                prepare.close()
+                raise
+            self._futures[job_id]=future
+        task=loop.create_task(self._prepare(job_id, prepare, fn, args, kwargs, cleanup, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    async def _prepare(self, job_id, prepare, fn, args, kwargs, cleanup, future):
+        try:
+            value=await prepare
+        except BaseException as e:
+            logger.exception(f'Job {job_id} failed')
+            self._finish(job_id, cleanup, status=FAILED, error=f'{type(e).__name__}: {e}', finished_at=time.time())
+            future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        self._update(job_id, status=QUEUED, queued_at=time.time())
+        try:
+            pool_future=self._executor.submit(self._run, job_id, fn, (value,)+args, kwargs, cleanup)
+        except RuntimeError as e:
+            #the pool is shut down
+            self._finish(job_id, cleanup, status=FAILED, error=f'{type(e).__name__}: {e}', finished_at=time.time())
+            future.set_exception(e)
+            return
+        pool_future.add_done_callback(lambda f: _copy_outcome(f, future))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job=self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _finish(self, job_id, cleanup, **fields):
+        self._update(job_id, **fields)
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception:
+                logger.exception(f'Cleanup of job {job_id} failed')
+        with self._lock:
+            self._prune()
+
+    def _run(self, job_id, fn, args, kwargs, cleanup):
+        started_at=time.time()
+        self._update(job_id, status=RUNNING, started_at=started_at)
+        job=self.get(job_id)
+        if job is not None:
+            #time spent waiting for a free worker
+            observe_stage('queue_wait', started_at-job['queued_at'])
+        try:
+            result=fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f'Job {job_id} failed')
+            self._finish(job_id, cleanup, status=FAILED, error=f'{type(e).__name__}: {e}', finished_at=time.time())
+            raise
+        self._finish(job_id, cleanup, status=COMPLETED, result=result, finished_at=time.time())
+        return result
+
+    def full(self) -> bool:
+        '''
+        True when a new submission would be refused
+        '''
+        with self._lock:
+            return self._active()>=self.max_pending
+
+    def future(self, job_id:str):
+        '''
+        concurrent.futures.Future of the job (None for unknown/expired job ids)
+        '''
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def get(self, job_id:str):
+        '''
+        RETURN : copy of the job record or None for unknown/expired job ids
+        '''
+        with self._lock:
+            job=self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def shutdown(self, wait:bool=True):
+        if not wait:
+            for task in list(self._tasks):
+                task.cancel()
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _copy_outcome(source:Future, target:Future):
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -1,18 +1,24 @@
 import os
 import json
+import asyncio
 from dotenv import load_dotenv
 import logging
 
  
-from Transcript_actions.transcription_pipeline import AudioTranscription
+from Transcript_actions.transcription_pipeline import AudioTranscription, AsyncAudioTranscription
+from Transcript_actions.webhooks import transcript_waiters
+from Transcript_actions.transcript_cache import default_transcript_cache, hash_file
 from Transcript_actions.Speaker_classification import (
-    find_speaker, 
-    String_4_Semantic_analysis, 
+    identify_speakers, 
     corrected_list, 
     customer_list_dict, 
     agent_list_dict
 )
+from api.scheduler import run_stages, timed
+from api.transcripts import parse_transcript
+from Evaluation_metrics.intervals import interval_stats
 from Evaluation_metrics.Main_evaluation import (
+    Utterance_embeddings,
     Normalize_attention, 
     Empathy, 
     Greet_Ownership, 
@@ -31,60 +37,199 @@ logging.basicConfig(
 )
 logger=logging.getLogger('uvicorn')
 
-def Metrics(API_key:str, temp_path1:str):
+#threads computing the metrics of one call, by default one per metric
+METRIC_WORKERS=int(os.getenv('METRIC_WORKERS', '0')) or None
+
+def Transcribe(API_key:str, temp_path1:str=None, timings:dict=None, webhook_url:str=None, webhook_secret:str=None, upload_url:str=None, audio_hash:str=None):
     '''
-    Transcription -> Diarization -> Metrics evaluation
+    Transcription of the audio, through the transcript cache
+
+    The audio is either the file at temp_path1 or already uploaded to AssemblyAI (upload_url)
+    audio_hash (SHA-256 of the audio, computed from temp_path1 when missing) is the key of the
+    transcript cache, a cached transcript skips the whole transcription
+
+    webhook_url (optional) switches the transcription to the webhook completion mode,
+    the receiver at that URL has to notify Transcript_actions.webhooks.transcript_waiters
+
+    RETURN : the AssemblyAI transcript dictionary
     '''
-    try:
+    if timings is None:
+        timings={}
+    transcript_cache=default_transcript_cache()
+    if transcript_cache is not None and audio_hash is None and temp_path1:
+        audio_hash=hash_file(temp_path1)
+    if transcript_cache is not None and audio_hash:
+        transcript_dict=transcript_cache.get(audio_hash)
+        if transcript_dict is not None:
+            logger.info(f'Transcript of audio {audio_hash} found in the cache')
+            return transcript_dict
+
+    transcription=AudioTranscription(api_key=API_key)
+    with timed('transcription', timings):
         logger.info("Initiating transcription")
-        transcription=AudioTranscription(api_key=API_key)
-        upload_url = transcription.upload_audio(audio_path=temp_path1)
+        if upload_url is None:
+            with timed('upload', timings):
+                upload_url = transcription.upload_audio(audio_path=temp_path1)
         logger.info(f'Upload URL : {upload_url}')   
     
         logger.info("Fetching transcription ID from Assembly AI")
-        transcription_id=transcription.perform_transcription(upload_url=upload_url)
-        transcript_dict=transcription.get_transcript(transcription_id=transcription_id)
+        with timed('transcription_request', timings):
+            transcription_id=transcription.perform_transcription(upload_url=upload_url, webhook_url=webhook_url, webhook_secret=webhook_secret)
+        if webhook_url:
+            with timed('webhook_wait', timings):
+                transcript_dict=transcription.wait_for_webhook(transcription_id=transcription_id, waiters=transcript_waiters)
+        else:
+            with timed('polling', timings):
+                transcript_dict=transcription.get_transcript(transcription_id=transcription_id)
+    if transcript_cache is not None and audio_hash:
+        transcript_cache.put(audio_hash, transcript_dict)
+    return transcript_dict
+
+
+async def Transcribe_async(API_key:str, temp_path1:str=None, timings:dict=None, webhook_url:str=None, webhook_secret:str=None, upload_url:str=None, audio_hash:str=None):
+    '''
+    Same as Transcribe on the event loop : the upload, the transcription request and the
+    wait for completion (polling or webhook) only hold a coroutine, so the number of
+    transcriptions in flight is not bound by the worker threads of the evaluations
+
+    RETURN : the AssemblyAI transcript dictionary
+    '''
+    if timings is None:
+        timings={}
+    transcript_cache=default_transcript_cache()
+    if transcript_cache is not None and audio_hash is None and temp_path1:
+        audio_hash=await asyncio.to_thread(hash_file, temp_path1)
+    if transcript_cache is not None and audio_hash:
+        transcript_dict=await asyncio.to_thread(transcript_cache.get, audio_hash)
+        if transcript_dict is not None:
+            logger.info(f'Transcript of audio {audio_hash} found in the cache')
+            return transcript_dict
+
+    transcription=AsyncAudioTranscription(api_key=API_key)
+    with timed('transcription', timings):
+        logger.info("Initiating transcription")
+        if upload_url is None:
+            with timed('upload', timings):
+                upload_url=await transcription.upload_audio(audio_path=temp_path1)
+        logger.info(f'Upload URL : {upload_url}')
+
+        logger.info("Fetching transcription ID from Assembly AI")
+        with timed('transcription_request', timings):
+            transcription_id=await transcription.perform_transcription(upload_url=upload_url, webhook_url=webhook_url, webhook_secret=webhook_secret)
+        if webhook_url:
+            with timed('webhook_wait', timings):
+                transcript_dict=await transcription.wait_for_webhook(transcription_id=transcription_id, waiters=transcript_waiters)
+        else:
+            with timed('polling', timings):
+                transcript_dict=await transcription.get_transcript(transcription_id=transcription_id)
+    if transcript_cache is not None and audio_hash:
+        await asyncio.to_thread(transcript_cache.put, audio_hash, transcript_dict)
+    return transcript_dict
+
+
+def Evaluate_transcript(transcript_dict:dict, timings:dict=None, details:dict=None):
+    '''
+    Diarization -> Metrics evaluation of a completed transcript (AssemblyAI format with
+    speaker labels A/B in 'utterances')
+
+    timings (optional) is filled with the duration in seconds of every stage
+    details (optional) is filled with the non score outputs : 'sentiment trajectory'
+    (see sentiment_trajectory), 'interuption times' and 'conversation intervals' (talk
+    time, overlap, silence, holds and interruptions of every speaker, see interval_stats)
+    '''
+    if timings is None:
+        timings={}
+    # every utterance is embedded once here, the speaker classification and all
+    # the semantic metrics read from the same batch
+    with timed('embeddings', timings):
+        embeddings=Utterance_embeddings(transcript_dict.get('utterances') or [])
 
-        logger.info("Diarization via LLM")
-        undiarized_dialogue_string=transcription.string_4_speaker_Classification(transcription_process=transcript_dict)
-        diarization_result=find_speaker(dialogue_string=undiarized_dialogue_string)
-        diarized_dialogue_string=String_4_Semantic_analysis(dialogue_dict=transcript_dict, output=diarization_result)
+    with timed('diarization', timings):
+        logger.info("Diarization")
+        undiarized_dialogue_string=AudioTranscription.string_4_speaker_Classification(transcription_process=transcript_dict)
+        with timed('speaker_classification', timings):
+            diarization_result=identify_speakers(dialogue_dict=transcript_dict, dialogue_string=undiarized_dialogue_string, embeddings=embeddings)
+        logger.info(f'Speakers : {diarization_result}')
         diarized_utterance_list=corrected_list(dialogue_dict=transcript_dict, output=diarization_result)
         customer_utterance_list, customer_utterance_string=customer_list_dict(corrected_list=diarized_utterance_list)
         agent_utterance_list, agent_utterance_string=agent_list_dict(corrected_list=diarized_utterance_list)
+
+    # attention_dict = {
+    #     'matched_score': matched_score,
+    #     'similarity_score': sim_score,
+    #     'overall_attention': overall_attn}
+
+    # The metrics are independent of each other, the LLM empathy call runs while the
+    # embedding/NLI metrics are computed
+    logger.info('Calculating the various metrics')
+    stages={
+        'empathy': lambda: Empathy(diarized_utterance_list=diarized_utterance_list),
+        'attention': lambda: Normalize_attention(customer_utterance_string, agent_utterance_string, customer_utterance_list, agent_utterance_list, embeddings=embeddings),
+        'greet_ownership': lambda: Greet_Ownership(agent_utterance_list=agent_utterance_list, embeddings=embeddings),
+        'satisfaction': lambda: Satisfaction(customer_utterance_list=customer_utterance_list, portion=0.35, embeddings=embeddings),
+        'interuptions': lambda: Interuptions(corrected_utterances=diarized_utterance_list),
+        'talk_to_listen': lambda: Talk_to_listen_ratio(agent_utterance_list=agent_utterance_list, customer_utterance_list=customer_utterance_list)
+    }
+    with timed('metrics', timings):
+        results=run_stages(stages, max_workers=METRIC_WORKERS, timings=timings)
+
+    overall_attention_score=results['attention'].get('overall_attention')
+    Empathy_score=results['empathy']
+    greet_score, ownership_score=results['greet_ownership']
+    interuption_score, interuption_time=results['interuptions']
+    satisfaction_score, trajectory=results['satisfaction']
+    Talk_to_listen=results['talk_to_listen']
+    if details is not None:
+        details['sentiment trajectory']=trajectory
+        details['interuption times']=interuption_time
+        details['conversation intervals']=interval_stats(diarized_utterance_list)
+    #one JSON line per call, the per stage durations are also in the /metrics histograms
+    logger.info(json.dumps({'event': 'stage_timings', 'seconds': timings}))
+
+    Evaluation_dict = {
+        'attention score': overall_attention_score,
+        'empathy score': Empathy_score,
+        'greet score': greet_score,
+        'ownership score': ownership_score,
+        'interuption score': interuption_score,
+        'satisfaction score': satisfaction_score,
+        'Talk to Listen': Talk_to_listen
+    }
+    
+    # Validation to mke sure all values are in b/w [0,1] 
+    for metric_name, score in Evaluation_dict.items():
+        if not isinstance(score, (int, float)):
+            logger.warning(f"{metric_name} is not a number: {score} (type: {type(score)})")
+        elif score < 0 or score > 1:
+            logger.warning(f"{metric_name} is outside [0,1] range: {score}")
     
-        # attention_dict = {
-        #     'matched_score': matched_score,
-        #     'similarity_score': sim_score,
-        #     'overall_attention': overall_attn}
-
-        logger.info('Calculating the various metrics')
-        Attention_dict=Normalize_attention(customer_utterance_string, agent_utterance_string, customer_utterance_list, agent_utterance_list)
-        overall_attention_score=Attention_dict.get('overall_attention')
-        Empathy_score=Empathy(dialogue_diarized_string=diarized_dialogue_string)
-        greet_score, ownership_score=Greet_Ownership(agent_utterance_list=agent_utterance_list)
-        interuption_score=Interuptions(corrected_utterances=diarized_utterance_list)
-        satisfaction_score=Satisfaction(customer_utterance_list=customer_utterance_list, portion=0.35)
-        Talk_to_listen= Talk_to_listen_ratio(agent_utterance_list=agent_utterance_list, customer_utterance_list=customer_utterance_list)
-
-        Evaluation_dict = {
-            'attention score': overall_attention_score,
-            'empathy score': Empathy_score,
-            'greet score': greet_score,
-            'ownership score': ownership_score,
-            'interuption score': interuption_score,
-            'satisfaction score': satisfaction_score,
-            'Talk to Listen': Talk_to_listen
-        }
-        
-        # Validation to mke sure all values are in b/w [0,1] 
-        for metric_name, score in Evaluation_dict.items():
-            if not isinstance(score, (int, float)):
-                logger.warning(f"{metric_name} is not a number: {score} (type: {type(score)})")
-            elif score < 0 or score > 1:
-                logger.warning(f"{metric_name} is outside [0,1] range: {score}")
-        
-        return Evaluation_dict
+    return Evaluation_dict
+
+
+def Transcript_metrics(transcript, timings:dict=None, details:dict=None):
+    '''
+    Diarization -> Metrics evaluation of a transcript produced outside of this service,
+    no upload, transcription or polling
+
+    ARGS : {"utterances": [{speaker, text, start, end}, ...]} or the list of utterances,
+    any two speaker labels (see api.transcripts), raises pydantic.ValidationError when invalid
+    '''
+    return Evaluate_transcript(parse_transcript(transcript), timings=timings, details=details)
+
+
+def Metrics(API_key:str, temp_path1:str=None, timings:dict=None, webhook_url:str=None, webhook_secret:str=None, upload_url:str=None, audio_hash:str=None, details:dict=None):
+    '''
+    Transcription -> Diarization -> Metrics evaluation
+
+    See Transcribe for the audio arguments and Evaluate_transcript for the evaluation
+    timings and details (optional) : see Evaluate_transcript
+    '''
+    if timings is None:
+        timings={}
+    try:
+        transcript_dict=Transcribe(API_key, temp_path1=temp_path1, timings=timings, webhook_url=webhook_url,
+                                   webhook_secret=webhook_secret, upload_url=upload_url, audio_hash=audio_hash)
+        return Evaluate_transcript(transcript_dict, timings=timings, details=details)
 
     except Exception as e:
         logger.exception(f'Exception {type(e).__name__} has occurred')
@@ -93,16 +238,16 @@ def Metrics(API_key:str, temp_path1:str):
 def Final_score(Evaluation_dict:dict):
     #randomnly assigned weights to the various score
     weights={
-        'attention_score' : 0.2,
-        'empathy_score' : 0.2,
-        'greet_score' : 0.1,
-        'ownership_score' : 0.15,
-        'interuption_score' : 0.1,
-        'satisfaction_score' : 0.15,
-        'Talk To Listen' : 0.1
+        'attention score' : 0.2,
+        'empathy score' : 0.2,
+        'greet score' : 0.1,
+        'ownership score' : 0.15,
+        'interuption score' : 0.1,
+        'satisfaction score' : 0.15,
+        'Talk to Listen' : 0.1
     }
 
-    attention_score=Evaluation_dict['attention score']*weights['attention_score']
+    attention_score=Evaluation_dict['attention score']*weights['attention score']
     empathy_score=Evaluation_dict['empathy score']*weights['empathy score']
     greet_score=Evaluation_dict['greet score']*weights['greet score']
     ownership_score=Evaluation_dict['ownership score']*weights['ownership score']
@@ -0,0 +1,64 @@
+'''
+On demand rendering of the customer sentiment trajectory.
+
+Scoring only returns the trajectory as numbers (sentiment_trajectory), the PNG is drawn
+here when a client asks for it. matplotlib is imported on the first render only, with the
+non interactive Agg backend, every figure is closed right after rendering and the PNGs are
+kept in a small LRU keyed by the trajectory content (PLOT_CACHE_ENTRIES, default 128).
+'''
+import io
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+PLOT_CACHE_ENTRIES=int(os.getenv('PLOT_CACHE_ENTRIES', '128'))
+
+_png_cache=OrderedDict()
+_lock=threading.Lock()
+
+
+def _trajectory_key(trajectory:dict) -> str:
+    return hashlib.sha256(json.dumps(trajectory, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _render(trajectory:dict) -> bytes:
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    #Figure instead of pyplot : not registered in the global figure manager, nothing leaks
+    fig=Figure(figsize=(8, 3.5))
+    ax=fig.subplots()
+    ax.plot(trajectory.get('time_ms') or [], trajectory.get('sentiment') or [], marker='o')
+    ax.axhline(0, color='grey', linewidth=0.8)
+    ax.set_ylim(-1.05, 1.05)
+    ax.set_xlabel("Time (ms)")
+    ax.set_ylabel("Emotion sentiment score")
+    ax.set_title("Customer sentiment trajectory")
+    fig.tight_layout()
+
+    buffer=io.BytesIO()
+    fig.savefig(buffer, format='png')
+    fig.clear()
+    return buffer.getvalue()
+
+
+def trajectory_png(trajectory:dict) -> bytes:
+    '''
+    ARGS : {'time_ms': [...], 'sentiment': [...]} as returned by sentiment_trajectory
+    RETURN : the line plot as PNG bytes
+    '''
+    key=_trajectory_key(trajectory)
+    with _lock:
+        if key in _png_cache:
+            _png_cache.move_to_end(key)
+            return _png_cache[key]
+
+    png=_render(trajectory)
+    with _lock:
+        _png_cache[key]=png
+        while len(_png_cache)>PLOT_CACHE_ENTRIES:
+            _png_cache.popitem(last=False)
+    return png
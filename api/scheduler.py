@@ -0,0 +1,63 @@
+'''
+Runs the independent stages of the pipeline concurrently and records how long each one took.
+
+A stage is a callable without arguments. All of them are started at once, so the I/O bound
+LLM call overlaps with the CPU bound embedding/NLI metrics and the wall clock time is close
+to the slowest stage instead of the sum of all of them.
+'''
+import time
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from Evaluation_metrics.telemetry import observe_stage
+
+logger=logging.getLogger('uvicorn')
+
+
+@contextmanager
+def timed(stage:str, timings:dict=None):
+    '''
+    Records the duration (seconds) of the with block in timings[stage] and in the
+    evaluation_stage_seconds histogram (see Evaluation_metrics.telemetry)
+    '''
+    start=time.perf_counter()
+    failed=False
+    try:
+        yield
+    except BaseException:
+        failed=True
+        raise
+    finally:
+        duration=time.perf_counter()-start
+        if timings is not None:
+            timings[stage]=round(duration, 4)
+        observe_stage(stage, duration, failed=failed)
+        logger.debug(f'{stage} took {duration:.3f}s')
+
+
+def run_stages(stages:dict, max_workers:int=None, timings:dict=None) -> dict:
+    '''
+    ARGS :
+    stages : stage name -> callable
+    max_workers : threads running stages at the same time (default one per stage)
+    timings : dictionary filled with the duration of every stage in seconds
+
+    RETURN : stage name -> result
+
+    The first stage that raises cancels the stages that have not started and the
+    exception is raised again once the running ones are done.
+    '''
+    def _call(name, fn):
+        with timed(name, timings):
+            return fn()
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(stages)), thread_name_prefix='stage') as executor:
+        futures={executor.submit(_call, name, fn): name for name, fn in stages.items()}
+        done, not_done=wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                logger.error(f'Stage {futures[future]} failed', exc_info=future.exception())
+                for other in not_done:
+                    other.cancel()
+                raise future.exception()
+        return {name: future.result() for future, name in futures.items()}
@@ -0,0 +1,70 @@
+'''
+Validation of transcripts produced outside of this service.
+
+Calls transcribed upstream (or text chat channels) are sent in the utterance schema of
+AudioTranscription.get_transcript : a list of {speaker, text, start, end}, start/end in
+milliseconds. Any two speaker labels are accepted, they are mapped to the A/B labels of
+AssemblyAI in order of appearance so the usual diarization (identify_speakers) decides
+who the agent is.
+'''
+from typing import Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+SPEAKER_LABELS=['A', 'B']
+
+
+class Utterance(BaseModel):
+    speaker : str= Field(min_length=1)
+    text : str
+    start : int= Field(ge=0, description='start of the utterance in milliseconds')
+    end : int= Field(ge=0, description='end of the utterance in milliseconds')
+
+    @model_validator(mode='after')
+    def check_times(self):
+        if self.end<self.start:
+            raise ValueError(f'utterance ends ({self.end}) before it starts ({self.start})')
+        return self
+
+
+class Transcript_Input(BaseModel):
+    id : Optional[str]=None
+    utterances : list[Utterance]= Field(min_length=1)
+
+    @field_validator('utterances')
+    @classmethod
+    def check_speakers(cls, utterances):
+        speakers={u.speaker for u in utterances}
+        if len(speakers)>len(SPEAKER_LABELS):
+            raise ValueError(f'expected at most {len(SPEAKER_LABELS)} speakers, got {len(speakers)} : {sorted(speakers)}')
+        return utterances
+
+
+def to_transcript_dict(transcript:Transcript_Input) -> dict:
+    '''
+    RETURN : the transcript in the AssemblyAI format expected by Evaluate_transcript,
+    utterances sorted by start time and speakers relabeled A/B
+    '''
+    labels={}
+    utterances=[]
+    for u in sorted(transcript.utterances, key=lambda u: (u.start, u.end)):
+        if u.speaker not in labels:
+            labels[u.speaker]=SPEAKER_LABELS[len(labels)]
+        utterances.append({'speaker': labels[u.speaker], 'text': u.text, 'start': u.start, 'end': u.end})
+    return {
+        'id': transcript.id,
+        'status': 'completed',
+        'utterances': utterances,
+        'audio_duration': utterances[-1]['end']/1000 if utterances else 0
+    }
+
+
+def parse_transcript(data) -> dict:
+    '''
+    ARGS : transcript JSON, either {"utterances": [...]} (an AssemblyAI transcript works as is)
+    or directly the list of utterances
+
+    RETURN : see to_transcript_dict, raises pydantic.ValidationError on invalid input
+    '''
+    if isinstance(data, list):
+        data={'utterances': data}
+    return to_transcript_dict(Transcript_Input.model_validate(data))
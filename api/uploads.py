@@ -0,0 +1,130 @@
+'''
+Streaming handling of the uploaded recordings.
+
+The audio is never read into memory as a whole, it flows through limited_chunks() in
+UPLOAD_CHUNK_SIZE pieces either straight to the AssemblyAI upload (direct mode) or to
+a temporary file uploaded once complete (tee-to-disk mode). Temporary files live in
+UPLOAD_DIR (system temp dir by default) and are removed once the job is over.
+
+Multipart uploads (POST /jobs, /evaluate) are parsed by Starlette, which spools the file
+part to a temporary file before the endpoint runs : UploadSizeLimit refuses them from the
+Content-Length header or as soon as the body grows past the limit, while it comes in.
+Only POST /jobs/stream forwards the audio to AssemblyAI as it arrives.
+'''
+import os
+import asyncio
+import logging
+import tempfile
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+logger=logging.getLogger('uvicorn')
+
+MAX_UPLOAD_BYTES=int(os.getenv('MAX_UPLOAD_BYTES', str(512*1024*1024)))
+UPLOAD_CHUNK_SIZE=int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024*1024)))
+UPLOAD_DIR=os.getenv('UPLOAD_DIR') or None
+
+#multipart boundaries and part headers allowed on top of MAX_UPLOAD_BYTES
+MULTIPART_OVERHEAD=64*1024
+
+ALLOWED_EXTENSIONS={'.wav', '.mp3', '.m4a', '.flac', '.ogg', '.webm', '.mp4'}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def limited_chunks(source, max_bytes:int=None, chunk_size:int=None, digest=None):
+    '''
+    Yields the upload in chunks and raises UploadTooLarge past max_bytes
+
+    ARGS : source is an UploadFile or an async iterator of bytes (eg. request.stream()),
+    max_bytes and chunk_size default to MAX_UPLOAD_BYTES and UPLOAD_CHUNK_SIZE,
+    digest (eg. hashlib.sha256()) is updated with every chunk on the way
+    '''
+    max_bytes=max_bytes or MAX_UPLOAD_BYTES
+    chunk_size=chunk_size or UPLOAD_CHUNK_SIZE
+    total=0
+    if hasattr(source, 'read'):
+        async def _read():
+            while True:
+                chunk=await source.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        stream=_read()
+    else:
+        stream=source
+
+    async for chunk in stream:
+        if not chunk:
+            continue
+        total+=len(chunk)
+        if total>max_bytes:
+            raise UploadTooLarge(f'Upload is larger than the {max_bytes} bytes limit')
+        if digest is not None:
+            digest.update(chunk)
+        yield chunk
+
+
+async def spool_to_disk(chunks, suffix:str='') -> str:
+    '''
+    Writes the chunks to a temporary file, the file is removed again when writing fails
+
+    RETURN : path of the temporary file
+    '''
+    temp_file=tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, delete=False, suffix=suffix, prefix='upload_')
+    try:
+        with temp_file:
+            async for chunk in chunks:
+                await asyncio.to_thread(temp_file.write, chunk)
+    except BaseException:
+        remove_file(temp_file.name)
+        raise
+    return temp_file.name
+
+
+def remove_file(path:str):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.exception(f'Could not remove temporary upload {path}')
+
+
+class UploadSizeLimit:
+    '''
+    ASGI middleware answering 413 to the multipart requests larger than max_bytes (default
+    MAX_UPLOAD_BYTES) plus MULTIPART_OVERHEAD, before they are spooled to disk as a whole
+    '''
+    def __init__(self, app, max_bytes:int=None):
+        self.app=app
+        self.max_bytes=(max_bytes or MAX_UPLOAD_BYTES)+MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        headers=dict(scope.get('headers') or []) if scope['type']=='http' else {}
+        if not headers.get(b'content-type', b'').startswith(b'multipart/'):
+            await self.app(scope, receive, send)
+            return
+
+        detail=f'Upload is larger than the {self.max_bytes-MULTIPART_OVERHEAD} bytes limit'
+        length=headers.get(b'content-length')
+        if length is not None and length.isdigit() and int(length)>self.max_bytes:
+            await JSONResponse({'detail': detail}, status_code=413)(scope, receive, send)
+            return
+
+        received=0
+        async def limited_receive():
+            #chunked requests : counted as the body comes in
+            nonlocal received
+            message=await receive()
+            if message['type']=='http.request':
+                received+=len(message.get('body', b''))
+                if received>self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,201 @@
+'''
+Load generator for the evaluation API.
+
+    # API already running (pointed at the fakes or at the real services)
+    python -m benchmarks.loadtest --url http://localhost:8000 --concurrency 8 --requests 200
+
+    # self contained : starts fake AssemblyAI and Ollama servers and an API process using them
+    python -m benchmarks.loadtest --spawn-api --concurrency 8 --duration 60 --ollama-latency 0.5
+
+--mode audio posts random audio bytes to /evaluate (upload, transcription, diarization and
+metrics), --mode transcript posts synthetic transcripts to /evaluate/transcript. With
+--spawn-api the fake AssemblyAI pushes the completion to the API webhook (as in production
+with WEBHOOK_BASE_URL), so the latency is the service's and not the poll schedule of the
+client, --poll measures the polling mode instead. Requests
+are sent by --concurrency clients in parallel until --requests have been sent or --duration
+seconds have passed, the report gives the p50/p95/p99 latency of the successful requests,
+the throughput and the errors by status code.
+'''
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+
+import httpx
+import numpy as np
+
+from benchmarks.synthetic import synthetic_transcript
+from fake_services import assemblyai as fake_assemblyai
+from fake_services import ollama as fake_ollama
+
+AUDIO_BYTES=256*1024
+
+
+def _request(mode:str, index:int, utterances:int) -> dict:
+    if mode=='transcript':
+        transcript=synthetic_transcript(utterances, seed=index)
+        return {'url': '/evaluate/transcript', 'json': {'utterances': transcript['utterances']}}
+    #different bytes for every request, a transcript cache would otherwise answer them all
+    return {'url': '/evaluate', 'files': {'file': (f'call-{index}.wav', os.urandom(AUDIO_BYTES), 'audio/wav')}}
+
+
+async def _client(client:httpx.AsyncClient, state:dict, args):
+    while True:
+        if state['sent']>=args.requests or time.perf_counter()>=state['deadline']:
+            return
+        index=state['sent']
+        state['sent']+=1
+        request=_request(args.mode, index, args.utterances)
+        start=time.perf_counter()
+        try:
+            response=await client.post(request.pop('url'), **request)
+            status=response.status_code
+        except httpx.HTTPError as e:
+            status=type(e).__name__
+        latency=time.perf_counter()-start
+        if status==200:
+            state['latencies'].append(latency)
+        else:
+            state['errors'][str(status)]+=1
+
+
+def load_report(latencies:list, errors:Counter, elapsed:float, concurrency:int) -> dict:
+    latencies=np.asarray(latencies, dtype=float)
+    report={
+        'concurrency': concurrency,
+        'completed': int(latencies.size),
+        'failed': sum(errors.values()),
+        'errors': dict(errors),
+        'elapsed_seconds': round(elapsed, 2),
+        'throughput_rps': round(latencies.size/elapsed, 3) if elapsed>0 else 0.0
+    }
+    if latencies.size:
+        p50, p95, p99=np.percentile(latencies, [50, 95, 99])
+        report.update({
+            'latency_p50_s': round(float(p50), 3),
+            'latency_p95_s': round(float(p95), 3),
+            'latency_p99_s': round(float(p99), 3),
+            'latency_mean_s': round(float(latencies.mean()), 3),
+            'latency_max_s': round(float(latencies.max()), 3)
+        })
+    return report
+
+
+async def run_load(args) -> dict:
+    state={'sent': 0, 'latencies': [], 'errors': Counter(), 'deadline': time.perf_counter()+args.duration}
+    limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        start=time.perf_counter()
+        await asyncio.gather(*(_client(client, state, args) for _ in range(args.concurrency)))
+        elapsed=time.perf_counter()-start
+    return load_report(state['latencies'], state['errors'], elapsed, args.concurrency)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_api(args):
+    '''
+    Starts the fake AssemblyAI and Ollama servers in this process and the API in a
+    subprocess pointed at them
+
+    RETURN : (API process, fake servers)
+    '''
+    transcripts=[synthetic_transcript(args.utterances, seed=i) for i in range(8)]
+    assemblyai_server, assemblyai_url=fake_assemblyai.start_server(fake_assemblyai.FakeAssemblyAI(
+        transcript=transcripts, processing_time=args.processing_time, latency=args.assemblyai_latency,
+        error_rate=args.assemblyai_error_rate, processing_ratio=args.processing_ratio))
+    ollama_server, ollama_url=fake_ollama.start_server(fake_ollama.FakeOllama(
+        first_token_latency=args.ollama_latency, tokens_per_second=args.ollama_tokens_per_second,
+        error_rate=args.ollama_error_rate))
+
+    port=_free_port()
+    env=dict(
+        os.environ,
+        ASSEMBLYAI_BASE_URL=assemblyai_url,
+        ASSEMBLY_AI_KEY='load-test',
+        OLLAMA_URL=ollama_url,
+        TRANSCRIPT_CACHE_DIR='',
+        LLM_CACHE_PATH=''
+    )
+    if not args.poll:
+        env.update(WEBHOOK_BASE_URL=f'http://127.0.0.1:{port}', WEBHOOK_SECRET='load-test')
+    else:
+        env.pop('WEBHOOK_BASE_URL', None)
+    process=subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api.api:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        env=env
+    )
+    args.url=f'http://127.0.0.1:{port}'
+
+    #model loading happens at startup, waiting for the API to answer
+    deadline=time.monotonic()+args.startup_timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f'The API exited during startup with code {process.returncode}')
+        try:
+            if httpx.get(f'{args.url}/models', timeout=2).status_code==200:
+                break
+        except httpx.HTTPError:
+            pass
+        if time.monotonic()>deadline:
+            process.terminate()
+            raise TimeoutError(f'The API did not start within {args.startup_timeout}s')
+        time.sleep(0.5)
+    return process, [assemblyai_server, ollama_server]
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Load generator for the evaluation API')
+    parser.add_argument('--url', default='http://localhost:8000', help='API base URL (ignored with --spawn-api)')
+    parser.add_argument('--mode', choices=['audio', 'transcript'], default='audio')
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('-n', '--requests', type=int, default=100, help='requests to send at most')
+    parser.add_argument('-d', '--duration', type=float, default=float('inf'), help='seconds to send requests at most')
+    parser.add_argument('--utterances', type=int, default=40, help='utterances of the synthetic transcripts')
+    parser.add_argument('--timeout', type=float, default=600, help='per request timeout (s)')
+    parser.add_argument('-o', '--output', default=None, help='also write the report (JSON) to this file')
+
+    fakes=parser.add_argument_group('--spawn-api', 'fake services used by the spawned API')
+    fakes.add_argument('--spawn-api', action='store_true')
+    fakes.add_argument('--startup-timeout', type=float, default=300)
+    fakes.add_argument('--processing-time', type=float, default=1.0, help='seconds AssemblyAI takes per transcript')
+    fakes.add_argument('--processing-ratio', type=float, default=0.0, help='extra seconds AssemblyAI takes per second of audio')
+    fakes.add_argument('--poll', action='store_true', help='the API polls AssemblyAI instead of receiving the webhook')
+    fakes.add_argument('--assemblyai-latency', type=float, default=0.0)
+    fakes.add_argument('--assemblyai-error-rate', type=float, default=0.0)
+    fakes.add_argument('--ollama-latency', type=float, default=0.0, help='seconds before the first token')
+    fakes.add_argument('--ollama-tokens-per-second', type=float, default=0.0)
+    fakes.add_argument('--ollama-error-rate', type=float, default=0.0)
+    args=parser.parse_args(argv)
+
+    process, servers=None, []
+    if args.spawn_api:
+        process, servers=spawn_api(args)
+    try:
+        report=asyncio.run(run_load(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        for server in servers:
+            server.shutdown()
+
+    report.update({'url': args.url, 'mode': args.mode})
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+'''
+Latency and peak memory of the evaluation pipeline on synthetic calls.
+
+    python -m benchmarks.pipeline --output bench.json
+    python -m benchmarks.pipeline --sizes 10 100 1000 --repeats 5 --baseline bench.json
+
+For every transcript size, each function of Evaluation_metrics.Main_evaluation and the full
+Metrics() path are run repeats times. The latency is the median and the minimum of the runs,
+the memory is the peak of the Python allocations (tracemalloc) during one extra run. Native
+allocations of torch/onnxruntime are not seen by tracemalloc, the RSS growth of the process
+is reported next to it for that reason.
+
+Nothing leaves the machine : Ollama is replaced by an in-process client returning canned
+answers after --llm-latency seconds, AssemblyAI by fake_services.assemblyai on localhost,
+and the transcript and LLM caches are disabled so every run does the full work.
+With --baseline the results are compared with a previous file, the run fails (exit code 1)
+when a latency or a memory peak grew by more than --tolerance.
+'''
+import os
+import sys
+import copy
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import logging
+
+#every run has to do the full work, set before anything reads them
+os.environ['TRANSCRIPT_CACHE_DIR']=''
+os.environ['LLM_CACHE_PATH']=''
+
+from benchmarks.synthetic import synthetic_transcript
+from fake_services.assemblyai import FakeAssemblyAI, start_server
+from Transcript_actions import ollama_client, transcription_pipeline
+from Transcript_actions.ollama_client import OllamaClient
+from Transcript_actions.Speaker_classification import identify_speakers, corrected_list, customer_list_dict, agent_list_dict
+from Evaluation_metrics.model_registry import current_backend, warm_up, _rss_bytes
+from Evaluation_metrics.phrase_embeddings import load_all
+from Evaluation_metrics.Main_evaluation import (
+    Utterance_embeddings,
+    Normalize_attention,
+    Empathy,
+    Greet_Ownership,
+    Interuptions,
+    Satisfaction,
+    Talk_to_listen_ratio
+)
+from api.main import Metrics
+
+logger=logging.getLogger(__name__)
+
+DEFAULT_SIZES=[10, 50, 200, 500, 1000, 2000]
+
+SPEAKER_ANSWER='{"Speaker A": "Customer Service Agent", "Speaker B": "Customer", "Confidence": "90%"}'
+EMPATHY_ANSWER=(
+    '{"emotion_recognition": 0.7, "emotion_validation": 0.6, "support_intent": 0.8, '
+    '"final_empathy_score": 0.7, "Valid Reason": "The agent acknowledges the problem"}'
+)
+
+
+class StubOllamaClient(OllamaClient):
+    '''
+    Answers every prompt with a canned speaker or empathy JSON after latency seconds
+    '''
+    def __init__(self, latency:float=0.0):
+        super().__init__(base_url='http://stub-ollama.invalid')
+        self.latency=latency
+        self.calls=0
+
+    def stream(self, prompt:str, model:str, json_mode:bool=True, options:dict=None):
+        self.calls+=1
+        if self.latency:
+            time.sleep(self.latency)
+        yield SPEAKER_ANSWER if '"Speaker A"' in prompt else EMPATHY_ANSWER
+
+    def warm(self, model:str):
+        return None
+
+
+def _diarize(transcript:dict) -> dict:
+    transcript=copy.deepcopy(transcript)
+    embeddings=Utterance_embeddings(transcript['utterances'])
+    dialogue_string=transcription_pipeline.AudioTranscription.string_4_speaker_Classification(transcript)
+    roles=identify_speakers(dialogue_dict=transcript, dialogue_string=dialogue_string, embeddings=embeddings)
+    utterances=corrected_list(dialogue_dict=transcript, output=roles)
+    customer_list, customer_string=customer_list_dict(corrected_list=utterances)
+    agent_list, agent_string=agent_list_dict(corrected_list=utterances)
+    return {
+        'raw': transcript['utterances'],
+        'utterances': utterances,
+        'customer_list': customer_list,
+        'customer_string': customer_string,
+        'agent_list': agent_list,
+        'agent_string': agent_string
+    }
+
+
+def function_cases(call:dict) -> dict:
+    '''
+    For each benchmarked function : a setup run outside of the measure (a fresh per call
+    embedding cache, as the pipeline has) returning the call to measure
+    '''
+    def with_embeddings(fn):
+        def setup():
+            embeddings=Utterance_embeddings(call['raw'])
+            return lambda: fn(embeddings)
+        return setup
+
+    return {
+        'Utterance_embeddings': lambda: (lambda: Utterance_embeddings(call['raw'])),
+        'Normalize_attention': with_embeddings(lambda e: Normalize_attention(
+            call['customer_string'], call['agent_string'], call['customer_list'], call['agent_list'], embeddings=e)),
+        'Empathy': lambda: (lambda: Empathy(diarized_utterance_list=call['utterances'])),
+        'Greet_Ownership': with_embeddings(lambda e: Greet_Ownership(agent_utterance_list=call['agent_list'], embeddings=e)),
+        'Interuptions': lambda: (lambda: Interuptions(corrected_utterances=call['utterances'])),
+        'Satisfaction': with_embeddings(lambda e: Satisfaction(customer_utterance_list=call['customer_list'], portion=0.35, embeddings=e)),
+        'Talk_to_listen_ratio': lambda: (lambda: Talk_to_listen_ratio(agent_utterance_list=call['agent_list'], customer_utterance_list=call['customer_list']))
+    }
+
+
+def measure(setup, repeats:int) -> dict:
+    '''
+    ARGS : callable returning the zero argument callable to measure, number of timed runs
+    '''
+    latencies=[]
+    for _ in range(repeats):
+        run=setup()
+        start=time.perf_counter()
+        run()
+        latencies.append(time.perf_counter()-start)
+
+    run=setup()
+    rss_before=_rss_bytes()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak=tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'latency_median_s': round(statistics.median(latencies), 6),
+        'latency_min_s': round(min(latencies), 6),
+        'peak_tracemalloc_bytes': peak,
+        'rss_growth_bytes': max(0, _rss_bytes()-rss_before)
+    }
+
+
+def metrics_case(transcript:dict, audio_path:str, fake:FakeAssemblyAI):
+    def setup():
+        fake.transcript=copy.deepcopy(transcript)
+        return lambda: Metrics(API_key='benchmark', temp_path1=audio_path)
+    return setup
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes:list, repeats:int=3, llm_latency:float=0.0, seed:int=0) -> dict:
+    ollama_client._client=StubOllamaClient(latency=llm_latency)
+    fake=FakeAssemblyAI(processing_time=0)
+    server, base_url=start_server(fake)
+    transcription_pipeline.BASE_URL=base_url
+
+    fd, audio_path=tempfile.mkstemp(suffix='.wav')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(os.urandom(256*1024))
+
+    #model loading is measured by /models, not here
+    warm_up()
+    load_all()
+
+    results=[]
+    try:
+        for size in sizes:
+            transcript=synthetic_transcript(size, seed=seed)
+            call=_diarize(transcript)
+            cases=function_cases(call)
+            cases['Metrics']=metrics_case(transcript, audio_path, fake)
+            for name, setup in cases.items():
+                result={'size': size, 'function': name, **measure(setup, repeats)}
+                results.append(result)
+                print(f"{size:>5} utterances  {name:<22} {result['latency_median_s']*1000:>10.1f} ms  "
+                      f"{result['peak_tracemalloc_bytes']/2**20:>8.1f} MiB peak", flush=True)
+    finally:
+        server.shutdown()
+        os.remove(audio_path)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'backend': current_backend(),
+            'sizes': sizes,
+            'repeats': repeats,
+            'llm_latency_s': llm_latency,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+#growths below these are noise, never reported as regressions
+MIN_DELTA={'latency_median_s': 0.001, 'peak_tracemalloc_bytes': 64*1024}
+
+
+def regressions(current:dict, baseline:dict, tolerance:float=0.2) -> list[dict]:
+    '''
+    Entries of current whose median latency or memory peak is more than tolerance
+    (relative) and MIN_DELTA (absolute) above the same (size, function) entry of baseline
+    '''
+    previous={(r['size'], r['function']): r for r in baseline.get('results', [])}
+    found=[]
+    for r in current['results']:
+        old=previous.get((r['size'], r['function']))
+        if old is None:
+            continue
+        for key, min_delta in MIN_DELTA.items():
+            if old[key] and r[key]>old[key]*(1+tolerance) and r[key]-old[key]>min_delta:
+                found.append({
+                    'size': r['size'],
+                    'function': r['function'],
+                    'measure': key,
+                    'baseline': old[key],
+                    'current': r[key],
+                    'ratio': round(r[key]/old[key], 3)
+                })
+    return found
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Benchmark of the evaluation pipeline on synthetic calls')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='utterances per synthetic call')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per function and size')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='seconds the stub LLM takes per answer')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='previous results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative growth against the baseline')
+    args=parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    logging.getLogger().setLevel(logging.WARNING)
+    report=run(args.sizes, repeats=args.repeats, llm_latency=args.llm_latency, seed=args.seed)
+
+    status=0
+    if args.baseline:
+        with open(args.baseline) as f:
+            found=regressions(report, json.load(f), args.tolerance)
+        report['regressions']=found
+        for r in found:
+            print(f"REGRESSION {r['function']} ({r['size']} utterances) {r['measure']} : {r['baseline']} -> {r['current']} (x{r['ratio']})", file=sys.stderr)
+        status=1 if found else 0
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+    return status
+
+
+if __name__=='__main__':
+    sys.exit(main())
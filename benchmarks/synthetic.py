@@ -0,0 +1,64 @@
+'''
+Synthetic diarized transcripts for the benchmarks and the load tests.
+
+The calls alternate between the two AssemblyAI speakers (A is the agent, B the customer)
+with lines drawn from small phrase pools, realistic durations and gaps, and a share of
+turns that start before the previous one ended (interruptions). The same seed always
+gives the same transcript, so results can be compared across commits.
+'''
+import random
+
+AGENT_LINES=[
+    "Hello, thank you for calling customer support, how may I help you?",
+    "I'm sorry to hear that, could you describe the problem?",
+    "Let me look into this for you",
+    "I can see the issue on your account",
+    "I will make sure this gets resolved today",
+    "Could you confirm your order number please?",
+    "I understand how frustrating this must be",
+    "I have issued a refund, it should arrive in three to five days",
+    "Is there anything else I can help you with?",
+    "Please restart the router and tell me if the light turns green"
+]
+
+CUSTOMER_LINES=[
+    "Hi, I'm having an issue with my internet connection",
+    "The connection drops every few minutes",
+    "I was charged twice on my last bill",
+    "My order number is 4 5 7 1 2",
+    "It is still not working",
+    "Okay, that makes sense",
+    "I already tried restarting it",
+    "Thank you, that solved my issue",
+    "Why does this keep happening?",
+    "Okay, thanks for your help"
+]
+
+
+def synthetic_transcript(n_utterances:int, seed:int=0, interruption_rate:float=0.1) -> dict:
+    '''
+    ARGS : number of utterances, random seed, share of turns starting before the previous ended
+    RETURN : transcript in the AssemblyAI format (speakers A/B, start/end in ms)
+    '''
+    rng=random.Random(seed)
+    utterances=[]
+    clock=rng.randint(200, 1500)
+    for i in range(n_utterances):
+        speaker='A' if i%2==0 else 'B'
+        pool=AGENT_LINES if speaker=='A' else CUSTOMER_LINES
+        text=pool[0] if i==0 else rng.choice(pool)
+        duration=rng.randint(800, 350*len(text.split())+800)
+        if utterances and rng.random()<interruption_rate:
+            start=max(utterances[-1]['start']+1, utterances[-1]['end']-rng.randint(200, 800))
+        else:
+            start=clock+rng.randint(100, 1200)
+        end=start+duration
+        utterances.append({'speaker': speaker, 'text': text, 'start': start, 'end': end, 'confidence': round(rng.uniform(0.85, 0.99), 2)})
+        clock=max(clock, end)
+    return {
+        'id': f'synthetic-{n_utterances}-{seed}',
+        'status': 'completed',
+        'language_code': 'en_us',
+        'audio_duration': round(clock/1000, 1),
+        'utterances': utterances
+    }
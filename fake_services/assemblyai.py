@@ -0,0 +1,239 @@
+'''
+Local stand-in for the AssemblyAI v2 endpoints used by AudioTranscription.
+
+POST /v2/upload            -> {"upload_url": ...}
+POST /v2/transcript        -> {"id": ..., "status": "queued"}
+GET  /v2/transcript/{id}   -> the canned transcript once it is processed
+
+A transcript is processed after processing_time seconds plus processing_ratio times its
+audio_duration, the way AssemblyAI takes longer on longer recordings (the client polls on
+a schedule derived from audio_duration, a fixed short processing time would leave it
+sleeping long after the transcript is ready).
+
+When the transcript request carries a webhook_url the server POSTs
+{"transcript_id": ..., "status": "completed"} to it (with the webhook auth header)
+as soon as the transcript is ready, the same way AssemblyAI does.
+
+For load tests every request can be delayed (latency), a share of them answered with an
+HTTP 500 (error_rate) and a share of the transcripts end in the "error" status
+(failure_rate). Several canned transcripts are served in turn.
+
+Run it with:
+python -m fake_services.assemblyai --port 8010 --processing-ratio 0.2 --latency 0.05 --error-rate 0.01
+and point the service at it with ASSEMBLYAI_BASE_URL=http://localhost:8010/v2
+'''
+import json
+import time
+import uuid
+import random
+import itertools
+import argparse
+import threading
+import logging
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger=logging.getLogger(__name__)
+
+SAMPLE_TRANSCRIPT={
+    "language_code": "en_us",
+    "confidence": 0.94,
+    "audio_duration": 18.7,
+    "utterances": [
+        {"speaker": "A", "text": "Hello, thank you for calling customer support.", "start": 1200, "end": 3400, "confidence": 0.96},
+        {"speaker": "B", "text": "Hi, I'm having an issue with my internet connection.", "start": 3600, "end": 6800, "confidence": 0.95},
+        {"speaker": "A", "text": "I'm sorry to hear that. Could you please describe the problem?", "start": 7100, "end": 10200, "confidence": 0.94},
+        {"speaker": "B", "text": "Yes, the connection drops every few minutes.", "start": 10400, "end": 13800, "confidence": 0.93}
+    ]
+}
+
+
+class FakeAssemblyAI:
+    def __init__(self, transcript=None, processing_time:float=1.0, latency:float=0.0,
+                 error_rate:float=0.0, failure_rate:float=0.0, seed:int=None, processing_ratio:float=0.0):
+        '''
+        ARGS : canned transcript, or list of them served in turn (SAMPLE_TRANSCRIPT by default),
+        seconds a transcript stays "processing" before it is completed, seconds added to every
+        request, share of requests answered with an HTTP 500, share of transcripts that fail,
+        extra processing seconds per second of audio (audio_duration of the transcript)
+        '''
+        self.transcript=transcript or SAMPLE_TRANSCRIPT
+        self.processing_time=processing_time
+        self.processing_ratio=processing_ratio
+        self.latency=latency
+        self.error_rate=error_rate
+        self.failure_rate=failure_rate
+        self.uploads=0
+        self.status_checks=0
+        self.webhooks_sent=0
+        self.errors=0
+        self._ready_at={}
+        self._assigned={}
+        self._next=itertools.count()
+        self._random=random.Random(seed)
+        self._lock=threading.Lock()
+
+    def _pick_transcript(self):
+        '''
+        RETURN : the canned transcript of a new request, None when it has to fail
+        '''
+        with self._lock:
+            if self.failure_rate and self._random.random()<self.failure_rate:
+                return None
+            transcripts=self.transcript if isinstance(self.transcript, list) else [self.transcript]
+            return transcripts[next(self._next)%len(transcripts)]
+
+    def simulate(self) -> bool:
+        '''
+        Applies the latency, RETURN : False when the request has to fail with an HTTP 500
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.error_rate and self._random.random()<self.error_rate:
+                self.errors+=1
+                return False
+        return True
+
+    def upload(self, body:bytes) -> dict:
+        with self._lock:
+            self.uploads+=1
+        return {"upload_url": f"https://cdn.fake-assemblyai.local/{uuid.uuid4().hex}"}
+
+    def processing_seconds(self, transcript) -> float:
+        duration=float((transcript or {}).get('audio_duration') or 0)
+        return self.processing_time+self.processing_ratio*duration
+
+    def create(self, request:dict) -> dict:
+        transcript_id=uuid.uuid4().hex
+        transcript=self._pick_transcript()
+        processing=self.processing_seconds(transcript)
+        with self._lock:
+            self._ready_at[transcript_id]=time.monotonic()+processing
+            self._assigned[transcript_id]=transcript
+        if request.get('webhook_url'):
+            timer=threading.Timer(processing, self._send_webhook, args=(transcript_id, request))
+            timer.daemon=True
+            timer.start()
+        return {"id": transcript_id, "status": "queued", "audio_url": request.get('audio_url')}
+
+    def status(self, transcript_id:str):
+        with self._lock:
+            self.status_checks+=1
+            ready_at=self._ready_at.get(transcript_id)
+            transcript=self._assigned.get(transcript_id)
+        if ready_at is None:
+            return None
+        if transcript is None:
+            if time.monotonic()<ready_at:
+                return {"id": transcript_id, "status": "processing"}
+            return {"id": transcript_id, "status": "error", "error": "Simulated transcription failure"}
+        if time.monotonic()<ready_at:
+            return {"id": transcript_id, "status": "processing", "audio_duration": transcript.get('audio_duration')}
+        return dict(transcript, id=transcript_id, status="completed")
+
+    def _send_webhook(self, transcript_id:str, request:dict):
+        headers={}
+        if request.get('webhook_auth_header_name'):
+            headers[request['webhook_auth_header_name']]=request.get('webhook_auth_header_value', '')
+        with self._lock:
+            status='completed' if self._assigned.get(transcript_id) is not None else 'error'
+        try:
+            requests.post(request['webhook_url'], json={"transcript_id": transcript_id, "status": status}, headers=headers, timeout=10)
+            with self._lock:
+                self.webhooks_sent+=1
+        except requests.RequestException:
+            logger.exception(f'Webhook for {transcript_id} could not be delivered')
+
+
+def _handler(fake:FakeAssemblyAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version='HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def _body(self) -> bytes:
+            if self.headers.get('Transfer-Encoding', '').lower()=='chunked':
+                body=b''
+                while True:
+                    size=int(self.rfile.readline().strip(), 16)
+                    if size==0:
+                        self.rfile.readline()
+                        return body
+                    body+=self.rfile.read(size)
+                    self.rfile.readline()
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def _reply(self, code:int, payload:dict):
+            data=json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            try:
+                body=self._body()
+            except (ValueError, ConnectionError):
+                #the client aborted the upload half way (eg. size limit hit)
+                self.close_connection=True
+                return
+            if not fake.simulate():
+                return self._reply(500, {"error": "simulated failure"})
+            if self.path=='/v2/upload':
+                return self._reply(200, fake.upload(body))
+            if self.path=='/v2/transcript':
+                return self._reply(200, fake.create(json.loads(body or b'{}')))
+            self._reply(404, {"error": "not found"})
+
+        def do_GET(self):
+            if not fake.simulate():
+                return self._reply(500, {"error": "simulated failure"})
+            if self.path.startswith('/v2/transcript/'):
+                transcript=fake.status(self.path.rsplit('/', 1)[-1])
+                if transcript is None:
+                    return self._reply(404, {"error": "transcript not found"})
+                return self._reply(200, transcript)
+            self._reply(404, {"error": "not found"})
+
+    return Handler
+
+
+def start_server(fake:FakeAssemblyAI=None, host:str='127.0.0.1', port:int=0):
+    '''
+    Starts the stand-in on a background thread
+
+    RETURN : (server, base_url), stop it with server.shutdown()
+    '''
+    fake=fake or FakeAssemblyAI()
+    server=ThreadingHTTPServer((host, port), _handler(fake))
+    server.fake=fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v2'
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Local stand-in for the AssemblyAI API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--processing-time', type=float, default=1.0)
+    parser.add_argument('--processing-ratio', type=float, default=0.0, help='extra processing seconds per second of audio')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an HTTP 500')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of transcripts ending in the error status')
+    parser.add_argument('--transcript', nargs='+', help='JSON files with the canned transcripts, served in turn')
+    args=parser.parse_args()
+
+    transcript=None
+    if args.transcript:
+        transcript=[]
+        for path in args.transcript:
+            with open(path) as f:
+                transcript.append(json.load(f))
+    fake=FakeAssemblyAI(transcript=transcript, processing_time=args.processing_time, latency=args.latency,
+                        error_rate=args.error_rate, failure_rate=args.failure_rate, processing_ratio=args.processing_ratio)
+    server=ThreadingHTTPServer((args.host, args.port), _handler(fake))
+    print(f'Fake AssemblyAI listening on http://{args.host}:{args.port}/v2')
+    server.serve_forever()
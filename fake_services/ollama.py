@@ -0,0 +1,176 @@
+'''
+Local stand-in for the Ollama /api/generate endpoint used by find_speaker and empathy_check.
+
+Speaker classification prompts get a canned speaker JSON, every other prompt a canned
+empathy JSON, streamed in small chunks as newline delimited JSON the way Ollama does
+(or in one response when "stream" is false). A request without a prompt only "loads"
+the model (OllamaClient.warm). Latency, error rates and the answers are configurable.
+
+Run it with:
+python -m fake_services.ollama --port 11500 --first-token-latency 0.5 --tokens-per-second 40
+and point the service at it with OLLAMA_URL=http://localhost:11500
+'''
+import json
+import time
+import random
+import argparse
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger=logging.getLogger(__name__)
+
+SPEAKER_ANSWER={"Speaker A": "Customer Service Agent", "Speaker B": "Customer", "Confidence": "90%"}
+EMPATHY_ANSWER={
+    "emotion_recognition": 0.7,
+    "emotion_validation": 0.6,
+    "support_intent": 0.8,
+    "final_empathy_score": 0.7,
+    "Valid Reason": "The agent acknowledges the problem and offers help"
+}
+#characters per streamed chunk, roughly one token
+CHUNK_CHARS=4
+
+
+class FakeOllama:
+    def __init__(self, speaker_answer:dict=None, empathy_answer:dict=None, first_token_latency:float=0.0,
+                 tokens_per_second:float=0.0, error_rate:float=0.0, malformed_rate:float=0.0, seed:int=None):
+        '''
+        ARGS : canned answers (SPEAKER_ANSWER / EMPATHY_ANSWER by default), seconds before the
+        first chunk, chunks streamed per second (0 for no delay), share of requests answered
+        with an HTTP 500, share of answers cut in the middle of the JSON
+        '''
+        self.speaker_answer=speaker_answer or SPEAKER_ANSWER
+        self.empathy_answer=empathy_answer or EMPATHY_ANSWER
+        self.first_token_latency=first_token_latency
+        self.tokens_per_second=tokens_per_second
+        self.error_rate=error_rate
+        self.malformed_rate=malformed_rate
+        self.generate_calls=0
+        self.warm_calls=0
+        self.errors=0
+        self.malformed=0
+        self._random=random.Random(seed)
+        self._lock=threading.Lock()
+
+    def _draw(self, rate:float) -> bool:
+        with self._lock:
+            return rate>0 and self._random.random()<rate
+
+    def answer(self, request:dict):
+        '''
+        RETURN : (http status, answer text), answer text None for a warm up request
+        '''
+        if not request.get('prompt'):
+            with self._lock:
+                self.warm_calls+=1
+            return 200, None
+        with self._lock:
+            self.generate_calls+=1
+        if self._draw(self.error_rate):
+            with self._lock:
+                self.errors+=1
+            return 500, None
+
+        answer=self.speaker_answer if '"Speaker A"' in request['prompt'] else self.empathy_answer
+        text=json.dumps(answer)
+        if self._draw(self.malformed_rate):
+            with self._lock:
+                self.malformed+=1
+            text=text[:len(text)//2]
+        return 200, text
+
+    def chunks(self, text:str):
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        delay=1/self.tokens_per_second if self.tokens_per_second else 0
+        for i in range(0, len(text), CHUNK_CHARS):
+            if delay and i:
+                time.sleep(delay)
+            yield text[i:i+CHUNK_CHARS]
+
+
+def _handler(fake:FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version='HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def _reply(self, code:int, payload:dict):
+            data=json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, model:str, text:str):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in fake.chunks(text):
+                self._write_line({"model": model, "response": chunk, "done": False})
+            self._write_line({"model": model, "response": "", "done": True})
+            self.wfile.write(b'0\r\n\r\n')
+
+        def _write_line(self, line:dict):
+            data=(json.dumps(line)+'\n').encode()
+            self.wfile.write(f'{len(data):X}\r\n'.encode()+data+b'\r\n')
+            self.wfile.flush()
+
+        def do_POST(self):
+            body=self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path!='/api/generate':
+                return self._reply(404, {"error": "not found"})
+            request=json.loads(body or b'{}')
+            model=request.get('model', '')
+            status, text=fake.answer(request)
+            if status!=200:
+                return self._reply(status, {"error": "simulated failure"})
+            if text is None:
+                return self._reply(200, {"model": model, "response": "", "done": True})
+            if request.get('stream', True):
+                return self._stream(model, text)
+            self._reply(200, {"model": model, "response": ''.join(fake.chunks(text)), "done": True})
+
+    return Handler
+
+
+def start_server(fake:FakeOllama=None, host:str='127.0.0.1', port:int=0):
+    '''
+    Starts the stand-in on a background thread
+
+    RETURN : (server, base_url), stop it with server.shutdown()
+    '''
+    fake=fake or FakeOllama()
+    server=ThreadingHTTPServer((host, port), _handler(fake))
+    server.fake=fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Local stand-in for the Ollama API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--first-token-latency', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--speaker-answer', help='JSON file with the canned speaker classification answer')
+    parser.add_argument('--empathy-answer', help='JSON file with the canned empathy answer')
+    args=parser.parse_args()
+
+    answers={}
+    for name in ('speaker_answer', 'empathy_answer'):
+        path=getattr(args, name)
+        if path:
+            with open(path) as f:
+                answers[name]=json.load(f)
+    fake=FakeOllama(first_token_latency=args.first_token_latency, tokens_per_second=args.tokens_per_second,
+                    error_rate=args.error_rate, malformed_rate=args.malformed_rate, **answers)
+    server=ThreadingHTTPServer((args.host, args.port), _handler(fake))
+    print(f'Fake Ollama listening on http://{args.host}:{args.port}')
+    server.serve_forever()